@@ -14,16 +14,19 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import re
 import sys
+import codecs
+import struct
 import hashlib
 
+from base64 import b64encode
 from binascii import hexlify, unhexlify
 
 try:
     import passlib
     #  from passlib.utils.handlers import MAX_PASSWORD_SIZE
-    from passlib.hash import nthash, lmhash, mysql41, oracle10, mysql323
-    from passlib.hash import msdcc, msdcc2, postgres_md5
+    from passlib.hash import lmhash, oracle10
 except ImportError:
     err = "\nFailed to import passlib"
     sys.stderr.write(err)
@@ -37,6 +40,8 @@ except ImportError:
     sys.stderr.flush()
     whirlpool = None
 
+ALL = 'all'
+
 
 class BaseAlgorithm(object):
     '''
@@ -45,6 +50,9 @@ class BaseAlgorithm(object):
 
     _data = None
 
+    # Keys of the algorithms whose (full) digests `_derive` is built on
+    depends = ()
+
     def __init__(self, data=None):
         self.data = data if data is not None else b''
 
@@ -68,11 +76,235 @@ class BaseAlgorithm(object):
         self._data += data
 
     def digest(self):
-        raise NotImplementedError()
+        return self._hash(self.data)
 
     def hexdigest(self):
         return hexlify(self.digest())
 
+    @classmethod
+    def _hash(cls, data):
+        ''' Raw digest of `data` (any bytes-like object) '''
+        raise NotImplementedError()
+
+    @classmethod
+    def digest_many(cls, buffers, truncate=None, out=None):
+        '''
+        Digest each of `buffers` into `out`, a preallocated buffer of
+        `len(buffers) * width` bytes where `width` is the digest length or
+        `truncate` if it is shorter. Returns `out`, no instance is created.
+        '''
+        width = cls.hex_length // 2
+        if truncate is not None and truncate < width:
+            width = truncate
+        if out is None:
+            out = bytearray(len(buffers) * width)
+        _hash = cls._hash
+        offset = 0
+        for data in buffers:
+            out[offset:offset + width] = _hash(data)[:width]
+            offset += width
+        return out
+
+    @classmethod
+    def _derive(cls, data, *digests):
+        '''
+        Digest of `data` given the digests of `depends` for the same data,
+        by default the dependencies are ignored.
+        '''
+        return cls._hash(data)
+
+
+class SaltedAlgorithm(BaseAlgorithm):
+    '''
+    An algorithm salted with a username. `with_user` makes the algorithm for
+    a user at run time, keyed "<salt_key>_<user>", and users of the same
+    algorithm share the work `_prepare` does for each candidate.
+    '''
+
+    USER = re.compile(r'[A-Za-z0-9_]{1,64}')  # Users are part of column names
+
+    salt_key = None
+    salt_name = None
+    case_sensitive = True  # Users that only differ in case hash the same when False
+    _user = ''
+    _users = {}  # key -> algorithm for every user of every salted algorithm
+
+    @classmethod
+    def user_key(cls, user):
+        return '%s_%s' % (cls.salt_key, user if cls.case_sensitive else user.lower())
+
+    @classmethod
+    def check_user(cls, user):
+        ''' Raise ValueError if `user` can't be in a column name '''
+        if not isinstance(user, str) or not cls.USER.fullmatch(user):
+            raise ValueError('Invalid user %r, users are 1 - 64 letters, digits or underscores' % (user,))
+
+    @classmethod
+    def with_user(cls, user):
+        ''' This algorithm salted with `user`, see `check_user` '''
+        cls.check_user(user)
+        key = cls.user_key(user)
+        if key not in SaltedAlgorithm._users:
+            attrs = {'name': '%s (%s)' % (cls.salt_name, user), 'key': key, '_user': user}
+            attrs.update(cls._user_attrs(user))
+            SaltedAlgorithm._users[key] = type(cls.__name__, (cls,), attrs)
+        return SaltedAlgorithm._users[key]
+
+    @classmethod
+    def _user_attrs(cls, user):
+        ''' Class attributes of the algorithm for `user`, besides its name, key and user '''
+        return {}
+
+    @classmethod
+    def _prepare(cls, data):
+        ''' Work on a candidate that doesn't depend on the user '''
+        return bytes(data[:64])
+
+    @classmethod
+    def _salt(cls, prepared):
+        ''' Digest of a `_prepare`d candidate for this algorithm's user '''
+        raise NotImplementedError()
+
+    @classmethod
+    def _hash(cls, data):
+        return cls._salt(cls._prepare(data))
+
+
+def resolve(hash_algorithms):
+    '''
+    Order `hash_algorithms` (key -> algorithm) so every algorithm comes after
+    the algorithms it depends on, pulling in dependencies that weren't asked for
+    '''
+    ordered = []
+
+    def visit(key, algo):
+        if any(key == name for name, _ in ordered):
+            return
+        for dependency in algo.depends:
+            if get_algorithm(dependency) is not None:
+                visit(dependency, get_algorithm(dependency))
+        ordered.append((key, algo))
+
+    for key, algo in hash_algorithms.items():
+        visit(key, algo)
+    return ordered
+
+
+def digest_width(algo, truncate=None):
+    ''' Bytes of `algo`'s digests truncated to `truncate`, shorter digests are left as they are '''
+    width = algo.hex_length // 2
+    if truncate is not None and truncate < width:
+        return truncate
+    return width
+
+
+def digest_all(hash_algorithms, buffers, truncate=None):
+    '''
+    Digest `buffers` with every algorithm in `hash_algorithms` in one pass, an
+    algorithm that depends on another is derived from its digests instead of
+    repeating the shared work, as are the users of a salted algorithm.
+    Returns key -> packed (truncated) digests.
+    '''
+    ordered = resolve(hash_algorithms)
+    needed = set(dependency for _, algo in ordered for dependency in algo.depends)
+    full_digests, results, prepared = {}, {}, {}
+    for key, algo in ordered:
+        depends = [dependency for dependency in algo.depends if dependency in full_digests]
+        if depends and len(depends) == len(algo.depends):
+            columns = [full_digests[dependency] for dependency in depends]
+            digests = [algo._derive(data, *shared) for data, *shared in zip(buffers, *columns)]
+        elif issubclass(algo, SaltedAlgorithm) and not algo.depends:
+            # Candidates are prepared once for every user of the algorithm
+            if algo.salt_key not in prepared:
+                prepared[algo.salt_key] = [algo._prepare(data) for data in buffers]
+            _salt = algo._salt
+            digests = [_salt(value) for value in prepared[algo.salt_key]]
+        elif key in needed:
+            digests = [algo._hash(data) for data in buffers]
+        else:
+            digests = None
+        if key in needed:
+            full_digests[key] = digests
+        if key in hash_algorithms:
+            width = digest_width(algo, truncate)
+            if digests is None:
+                results[key] = algo.digest_many(buffers, width)
+            else:
+                results[key] = b''.join([digest[:width] for digest in digests])
+    return results
+
+
+def digest_valid(hash_algorithms, buffers, truncate=None):
+    '''
+    `digest_all` of the `buffers` every algorithm can hash, returns the
+    indexes of the buffers kept and their digests. A batch with a buffer an
+    algorithm can't decode (e.g. Oracle cutting a multibyte char in two) is
+    hashed again one buffer at a time, skipping the ones that fail.
+    '''
+    try:
+        return list(range(len(buffers))), digest_all(hash_algorithms, buffers, truncate)
+    except UnicodeDecodeError:
+        pass
+    kept, results = [], {key: bytearray() for key in hash_algorithms}
+    for index, data in enumerate(buffers):
+        try:
+            digests = digest_all(hash_algorithms, [data], truncate)
+        except UnicodeDecodeError:
+            continue
+        kept.append(index)
+        for key in hash_algorithms:
+            results[key] += digests[key]
+    return kept, results
+
+
+def encode_digests(digests, width):
+    ''' Base64 encode each `width` byte digest packed in `digests` '''
+    if width % 3 == 0:
+        # No padding, so the digests can be encoded in one go and split
+        encoded = b64encode(bytes(digests)).decode()
+        step = (width // 3) * 4
+        return [encoded[offset:offset + step] for offset in range(0, len(encoded), step)]
+    return [b64encode(digests[offset:offset + width]).decode()
+            for offset in range(0, len(digests), width)]
+
+
+_MD4_ROUND3 = (0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15)
+
+
+def _md4(data):
+    ''' Pure python MD4 (RFC 1320), OpenSSL 3 no longer provides it '''
+    data = bytes(data)
+    bit_length = (len(data) * 8) & 0xffffffffffffffff
+    data += b'\x80' + b'\x00' * ((55 - len(data)) % 64) + struct.pack('<Q', bit_length)
+    mask = 0xffffffff
+    a, b, c, d = 0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476
+    for offset in range(0, len(data), 64):
+        x = struct.unpack('<16I', data[offset:offset + 64])
+        aa, bb, cc, dd = a, b, c, d
+        for step in range(48):
+            stage, index = divmod(step, 16)
+            if stage == 0:
+                value = (a + ((b & c) | (~b & d)) + x[index]) & mask
+                shift = (3, 7, 11, 19)[index % 4]
+            elif stage == 1:
+                value = (a + ((b & c) | (b & d) | (c & d)) + x[(index % 4) * 4 + index // 4] + 0x5a827999) & mask
+                shift = (3, 5, 9, 13)[index % 4]
+            else:
+                value = (a + (b ^ c ^ d) + x[_MD4_ROUND3[index]] + 0x6ed9eba1) & mask
+                shift = (3, 9, 11, 15)[index % 4]
+            a, b, c, d = d, ((value << shift) | (value >> (32 - shift))) & mask, b, c
+        a, b, c, d = (a + aa) & mask, (b + bb) & mask, (c + cc) & mask, (d + dd) & mask
+    return struct.pack('<4I', a, b, c, d)
+
+
+try:
+    hashlib.new('md4', b'')
+
+    def md4(data):
+        return hashlib.new('md4', data).digest()
+except ValueError:
+    md4 = _md4
+
 
 ##########################################################
 # > HASHLIB
@@ -83,8 +315,9 @@ class Md4(BaseAlgorithm):
     key = 'md4'
     hex_length = 32
 
-    def digest(self):
-        return hashlib.new('md4', self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return md4(data)
 
 
 class Md5(BaseAlgorithm):
@@ -93,8 +326,9 @@ class Md5(BaseAlgorithm):
     key = 'md5'
     hex_length = 32
 
-    def digest(self):
-        return hashlib.md5(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.md5(data).digest()
 
 
 class Sha1(BaseAlgorithm):
@@ -103,8 +337,9 @@ class Sha1(BaseAlgorithm):
     key = 'sha1'
     hex_length = 40
 
-    def digest(self):
-        return hashlib.sha1(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha1(data).digest()
 
 
 class Sha224(BaseAlgorithm):
@@ -113,8 +348,9 @@ class Sha224(BaseAlgorithm):
     key = 'sha2_224'
     hex_length = 56
 
-    def digest(self):
-        return hashlib.sha224(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha224(data).digest()
 
 
 class Sha256(BaseAlgorithm):
@@ -123,8 +359,9 @@ class Sha256(BaseAlgorithm):
     key = 'sha2_256'
     hex_length = 64
 
-    def digest(self):
-        return hashlib.sha256(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha256(data).digest()
 
 
 class Sha384(BaseAlgorithm):
@@ -133,8 +370,9 @@ class Sha384(BaseAlgorithm):
     key = 'sha2_384'
     hex_length = 96
 
-    def digest(self):
-        return hashlib.sha384(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha384(data).digest()
 
 
 class Sha512(BaseAlgorithm):
@@ -143,8 +381,9 @@ class Sha512(BaseAlgorithm):
     key = 'sha2_512'
     hex_length = 128
 
-    def digest(self):
-        return hashlib.sha512(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha512(data).digest()
 
 
 class Ripemd160(BaseAlgorithm):
@@ -153,9 +392,10 @@ class Ripemd160(BaseAlgorithm):
     key = "ripemd160"
     hex_length = 40
 
-    def digest(self):
+    @classmethod
+    def _hash(cls, data):
         md = hashlib.new('ripemd160')
-        md.update(self._data)
+        md.update(data)
         return md.digest()
 
 
@@ -168,8 +408,9 @@ class Sha3_224(BaseAlgorithm):
     key = 'sha3_224'
     hex_length = 56
 
-    def digest(self):
-        return hashlib.sha3_224(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha3_224(data).digest()
 
 
 class Sha3_256(BaseAlgorithm):
@@ -178,8 +419,9 @@ class Sha3_256(BaseAlgorithm):
     key = 'sha3_256'
     hex_length = 64
 
-    def digest(self):
-        return hashlib.sha3_256(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha3_256(data).digest()
 
 
 class Sha3_384(BaseAlgorithm):
@@ -188,8 +430,9 @@ class Sha3_384(BaseAlgorithm):
     key = 'sha3_384'
     hex_length = 96
 
-    def digest(self):
-        return hashlib.sha3_384(self._data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha3_384(data).digest()
 
 
 class Sha3_512(BaseAlgorithm):
@@ -198,8 +441,9 @@ class Sha3_512(BaseAlgorithm):
     key = 'sha3_512'
     hex_length = 128
 
-    def digest(self):
-        return hashlib.sha3_512(self.data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha3_512(data).digest()
 
 
 ##########################################################
@@ -211,52 +455,53 @@ class Lm(BaseAlgorithm):
     key = 'lm'
     hex_length = 32
 
-    def digest(self):
-        return unhexlify(lmhash.encrypt(self.data[:15]))
-
-
-class Ntlm(BaseAlgorithm):
+    @classmethod
+    def _hash(cls, data):
+        return unhexlify(lmhash.encrypt(bytes(data[:15])))
 
-    name = 'NTLM'
-    key = 'ntlm'
-    hex_length = 32
 
-    def digest(self):
-        return unhexlify(nthash.encrypt(self.data[:127]))
-
-
-class MySql323(BaseAlgorithm):
+class LmHalf(BaseAlgorithm):
+    '''
+    A single DES half of an LM hash, LM uppercases the password and hashes
+    the first and second 7 chars independently. So a table of halves over
+    the uppercase <= 7 char keyspace resolves any LM hash one half at a time.
+    '''
 
-    name = 'MySQL v3.2.3'
-    key = 'mysql323'
+    name = 'LM (half)'
+    key = 'lm_half'
     hex_length = 16
+    max_length = 7
+    empty = unhexlify('aad3b435b51404ee')  # Half digest of ''
 
-    def digest(self):
-        return unhexlify(mysql323.encrypt(self.data[:64]))
-
-
-class MySql41(BaseAlgorithm):
-    ''' Ignore the preceeding "*" symbol '''
+    @classmethod
+    def _hash(cls, data):
+        return unhexlify(lmhash.encrypt(bytes(data[:cls.max_length])))[:8]
 
-    name = 'MySQL v4.1'
-    key = 'mysql41'
-    hex_length = 40
+    @classmethod
+    def split(cls, lm_digest):
+        ''' The two half digests of a full LM digest '''
+        return lm_digest[:8], lm_digest[8:16]
 
-    def digest(self):
-        return unhexlify(mysql41.encrypt(self.data[:64])[1:])
+    @classmethod
+    def charset(cls, charset):
+        ''' The chars of `charset` that can appear in a half, LM is case insensitive '''
+        return ''.join(dict.fromkeys(charset.upper()))
 
 
-class Oracle10(BaseAlgorithm):
+class Oracle10(SaltedAlgorithm):
     '''
     Base Oracle 10g algorithm, this algorithm is salted with a username.
-    Subclasses contain common usernames.
+    Subclasses contain common usernames, see `with_user` for others.
     '''
 
+    salt_key = 'oracle10g'
+    salt_name = 'Oracle 10g'
+    case_sensitive = False
     hex_length = 16
-    _user = ''
 
-    def digest(self):
-        return unhexlify(oracle10.encrypt(self.data[:64], user=self._user))
+    @classmethod
+    def _salt(cls, prepared):
+        return unhexlify(oracle10.encrypt(prepared, user=cls._user))
 
 
 class Oracle10_Sys(Oracle10):
@@ -273,14 +518,87 @@ class Oracle10_System(Oracle10):
     _user = 'SYSTEM'
 
 
-class PostgresMd5(BaseAlgorithm):
+##########################################################
+# > NATIVE
+# These match passlib's nthash, mysql323, mysql41, postgres_md5,
+# msdcc and msdcc2 but are built directly on hashlib primitives
+##########################################################
+def _utf16(data):
+    '''
+    UTF-16-LE encoding of utf-8 `data`, only an incomplete final char (cut by
+    truncating the password) is dropped, invalid bytes raise UnicodeDecodeError
+    so `digest_valid` skips the word
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    return decoder.decode(bytes(data), final=False).encode('utf-16-le')
 
+
+class Ntlm(BaseAlgorithm):
+    ''' MD4 of the UTF-16-LE password '''
+
+    name = 'NTLM'
+    key = 'ntlm'
     hex_length = 32
-    _user = ''
 
-    def digest(self):
-        ''' Removes the "md5" prefix '''
-        return unhexlify(postgres_md5.encrypt(self._data[:64], user=self._user)[3:])
+    @classmethod
+    def _hash(cls, data):
+        return md4(_utf16(data[:127]))
+
+
+class MySql323(BaseAlgorithm):
+
+    name = 'MySQL v3.2.3'
+    key = 'mysql323'
+    hex_length = 16
+
+    @classmethod
+    def _hash(cls, data):
+        nr1, nr2, add = 0x50305735, 0x12345671, 7
+        for char in bytes(data[:64]):
+            if char in (0x20, 0x09):  # Whitespace is skipped
+                continue
+            nr1 ^= ((((nr1 & 63) + add) * char) + (nr1 << 8)) & 0xffffffff
+            nr2 = (nr2 + ((nr2 << 8) ^ nr1)) & 0xffffffff
+            add = (add + char) & 0xffffffff
+        return struct.pack('>II', nr1 & 0x7fffffff, nr2 & 0x7fffffff)
+
+
+class MySql41(BaseAlgorithm):
+    ''' SHA1 of the SHA1 digest, the hex digest is usually prefixed by "*" '''
+
+    name = 'MySQL v4.1'
+    key = 'mysql41'
+    hex_length = 40
+    depends = (Sha1.key,)
+
+    @classmethod
+    def _hash(cls, data):
+        return hashlib.sha1(hashlib.sha1(data[:64]).digest()).digest()
+
+    @classmethod
+    def _derive(cls, data, sha1_digest):
+        if 64 < len(data):
+            return cls._hash(data)
+        return hashlib.sha1(sha1_digest).digest()
+
+
+class PostgresMd5(SaltedAlgorithm):
+    ''' MD5 of the password + username, the hex digest is usually prefixed by "md5" '''
+
+    salt_key = 'postgres_md5'
+    salt_name = 'Postgres MD5'
+    hex_length = 32
+
+    @classmethod
+    def _prepare(cls, data):
+        # The password comes first, so each user continues from its MD5 state
+        return hashlib.md5(bytes(data[:64]))
+
+    @classmethod
+    def _salt(cls, prepared):
+        md5 = prepared.copy()
+        md5.update(cls._user.encode())
+        return md5.digest()
 
 
 class PostgresMd5_Root(PostgresMd5):
@@ -304,27 +622,67 @@ class PostgresMd5_Admin(PostgresMd5):
     _user = 'admin'
 
 
-class Msdcc_Administrator(BaseAlgorithm):
+class Msdcc(SaltedAlgorithm):
+    ''' MD4 of the NTLM digest + UTF-16-LE lowercase username '''
+
+    salt_key = 'msdcc'
+    salt_name = 'MS Domain Cached Credentials'
+    case_sensitive = False
+    hex_length = 32
+    depends = (Ntlm.key,)
+
+    @classmethod
+    def _prepare(cls, data):
+        return md4(_utf16(data[:64]))
+
+    @classmethod
+    def _salt(cls, ntlm_digest):
+        return md4(ntlm_digest + cls._user.lower().encode('utf-16-le'))
+
+    @classmethod
+    def _derive(cls, data, ntlm_digest):
+        if 64 < len(data):
+            return cls._hash(data)
+        return cls._salt(ntlm_digest)
+
+
+class Msdcc_Administrator(Msdcc):
 
     name = 'MS Domain Cached Credentials'
     key = 'msdcc_administrator'
-    hex_length = 32
     _user = "administrator"
 
-    def digest(self):
-        return unhexlify(msdcc.encrypt(self._data[:64], user=self._user))
 
+class Msdcc2(SaltedAlgorithm):
+    ''' PBKDF2-HMAC-SHA1 (10240 rounds) of the MSDCC digest, salted with the username '''
+
+    salt_key = 'msdcc2'
+    salt_name = 'MS Domain Cached Credentials v2'
+    case_sensitive = False
+    hex_length = 32
+    _rounds = 10240
+
+    @classmethod
+    def _user_attrs(cls, user):
+        return {'depends': (Msdcc.user_key(user),)}  # Must be salted with the same user
 
-class Msdcc2_Administrator(BaseAlgorithm):
+    @classmethod
+    def _hash(cls, data):
+        return cls._derive(data, Msdcc.with_user(cls._user)._hash(data))
+
+    @classmethod
+    def _derive(cls, data, msdcc_digest):
+        user = cls._user.lower().encode('utf-16-le')
+        return hashlib.pbkdf2_hmac('sha1', msdcc_digest, user, cls._rounds, 16)
+
+
+class Msdcc2_Administrator(Msdcc2):
 
     name = 'MS Domain Cached Credentials v2'
     key = 'msdcc2_administrator'
-    hex_length = 32
+    depends = (Msdcc_Administrator.key,)  # Must be salted with the same user
     _user = "administrator"
 
-    def digest(self):
-        return unhexlify(msdcc2.encrypt(self._data[:64], user=self._user))
-
 
 ##########################################################
 # > Whirlpool
@@ -335,8 +693,9 @@ class Whirlpool(BaseAlgorithm):
     key = "whirlpool"
     hex_length = 128
 
-    def digest(self):
-        return whirlpool.new(self._data).digest()
+    @classmethod
+    def _hash(cls, data):
+        return whirlpool.new(bytes(data)).digest()
 
 
 # Base algorithms
@@ -358,18 +717,77 @@ if hasattr(hashlib, "algorithms_available"):
     if 'ripemd160' in hashlib.algorithms_available:
         algorithms[Ripemd160.key] = Ripemd160
 
+# Native replacements for passlib algorithms
+algorithms[Ntlm.key] = Ntlm
+algorithms[MySql323.key] = MySql323
+algorithms[MySql41.key] = MySql41
+algorithms[Msdcc_Administrator.key] = Msdcc_Administrator
+algorithms[Msdcc2_Administrator.key] = Msdcc2_Administrator
+algorithms[PostgresMd5_Admin.key] = PostgresMd5_Admin
+algorithms[PostgresMd5_Postgres.key] = PostgresMd5_Postgres
+algorithms[PostgresMd5_Root.key] = PostgresMd5_Root
+
+# Algorithms only selected by key, not by "all", e.g. LM halves are only useful in their own tables
+named_algorithms = {}
+
 if passlib is not None:
     algorithms[Lm.key] = Lm
-    algorithms[Ntlm.key] = Ntlm
-    algorithms[MySql323.key] = MySql323
-    algorithms[MySql41.key] = MySql41
+    named_algorithms[LmHalf.key] = LmHalf
     algorithms[Oracle10_Sys.key] = Oracle10_Sys
     algorithms[Oracle10_System.key] = Oracle10_System
-    algorithms[Msdcc_Administrator.key] = Msdcc_Administrator
-    algorithms[Msdcc2_Administrator.key] = Msdcc2_Administrator
-    algorithms[PostgresMd5_Admin.key] = PostgresMd5_Admin
-    algorithms[PostgresMd5_Postgres.key] = PostgresMd5_Postgres
-    algorithms[PostgresMd5_Root.key] = PostgresMd5_Root
 
 if whirlpool is not None:
     algorithms[Whirlpool.key] = Whirlpool
+
+# Salted algorithms that can be salted with any user (see `with_users`)
+salted_algorithms = {
+    PostgresMd5.salt_key: PostgresMd5,
+    Msdcc.salt_key: Msdcc,
+    Msdcc2.salt_key: Msdcc2,
+}
+
+if passlib is not None:
+    salted_algorithms[Oracle10.salt_key] = Oracle10
+
+for algo in list(algorithms.values()):
+    if issubclass(algo, SaltedAlgorithm):
+        SaltedAlgorithm._users[algo.key] = algo
+
+
+def get_algorithm(key):
+    ''' The algorithm for `key`, including "<salted algorithm>_<user>" for any user, or None '''
+    if key in algorithms:
+        return algorithms[key]
+    if key in named_algorithms:
+        return named_algorithms[key]
+    if key in SaltedAlgorithm._users:
+        return SaltedAlgorithm._users[key]
+    # Longest first, "msdcc2_" also starts with "msdcc"
+    for salt_key in sorted(salted_algorithms, key=len, reverse=True):
+        if key.startswith(salt_key + '_') and SaltedAlgorithm.USER.fullmatch(key[len(salt_key) + 1:]):
+            return salted_algorithms[salt_key].with_user(key[len(salt_key) + 1:])
+    return None
+
+
+def with_users(names, users=None):
+    '''
+    Algorithms (key -> algorithm) for `names`, "all" is every algorithm. The
+    name of a salted algorithm (e.g. "postgres_md5") selects it salted with
+    each of `users`, and e.g. "postgres_md5_root" with one user. Raises
+    ValueError for a user that can't be in a column name.
+    '''
+    users = users or []
+    for user in users:
+        SaltedAlgorithm.check_user(user)
+    selected = {}
+    if ALL in names:
+        selected.update(algorithms)
+        names = sorted(salted_algorithms)
+    for name in names:
+        if name in salted_algorithms:
+            for user in users:
+                algo = salted_algorithms[name].with_user(user)
+                selected[algo.key] = algo
+        elif get_algorithm(name) is not None:
+            selected[name] = get_algorithm(name)
+    return selected
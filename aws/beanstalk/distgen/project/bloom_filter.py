@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+'''
+
+> Per-algorithm Bloom filters over truncated digests, to drop definite misses
+
+Most hashes that are looked up aren't in the tables, a filter answers "not
+in the table" for them without probing an index or sending them to
+BigQuery. build_index.py writes one next to each index, sized from a false
+positive rate:
+
+    magic       4 bytes, "BRB1"
+    length      uint32 (little endian), length of the JSON header
+    header      JSON, algorithm, digest width, bits, hashes ...
+    bits        the filter, bit `n` is bit `n % 8` of byte `n // 8`
+
+Bit positions come from double hashing a BLAKE2b of the truncated digest,
+so filters work for any digest width.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import json
+import math
+import struct
+import hashlib
+import argparse
+
+from base64 import b64decode
+from binascii import Error as BinasciiError
+
+from table_format import TableFormatError
+
+MAGIC = b'BRB1'
+VERSION = 1
+EXTENSION = '.bloom'
+FP_RATE = 0.01
+MASK_64 = (1 << 64) - 1
+
+
+def filter_path(index_path):
+    ''' Path of the filter that goes with an index '''
+    return os.path.splitext(index_path)[0] + EXTENSION
+
+
+class BloomFilter(object):
+    ''' A Bloom filter of one algorithm's truncated digests '''
+
+    def __init__(self, algorithm, digest_width, bits, hashes, count=0, fp_rate=None, data=None):
+        if bits <= 0 or hashes <= 0:
+            raise ValueError('A filter needs at least one bit and one hash')
+        self.algorithm = algorithm
+        self.digest_width = digest_width
+        self.bits = bits
+        self.hashes = hashes
+        self.count = count
+        self.fp_rate = fp_rate
+        self.data = bytearray((bits + 7) // 8) if data is None else data
+
+    @classmethod
+    def for_capacity(cls, algorithm, digest_width, count, fp_rate=FP_RATE):
+        ''' An empty filter sized for `count` digests at a false positive rate of `fp_rate` '''
+        if not 0 < fp_rate < 1:
+            raise ValueError('False positive rate must be between 0 and 1')
+        count = max(1, count)
+        bits = int(math.ceil(-count * math.log(fp_rate) / (math.log(2) ** 2)))
+        hashes = max(1, int(round((bits / count) * math.log(2))))
+        return cls(algorithm, digest_width, bits, hashes, fp_rate=fp_rate)
+
+    def positions(self, digest):
+        ''' Bit positions of a digest '''
+        value = int.from_bytes(hashlib.blake2b(digest, digest_size=16).digest(), 'little')
+        first, second = value & MASK_64, (value >> 64) | 1
+        return [(first + index * second) % self.bits for index in range(self.hashes)]
+
+    def add(self, digest):
+        for position in self.positions(bytes(digest[:self.digest_width])):
+            self.data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        ''' False if `digest` is definitely not in the filter '''
+        for position in self.positions(bytes(digest[:self.digest_width])):
+            if not self.data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def to_dict(self):
+        return {
+            'version': VERSION,
+            'algorithm': self.algorithm,
+            'digest_width': self.digest_width,
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'count': self.count,
+            'fp_rate': self.fp_rate,
+        }
+
+    def save(self, fpath):
+        header = json.dumps(self.to_dict()).encode()
+        with open(fpath, 'wb') as fp:
+            fp.write(MAGIC + struct.pack('<I', len(header)) + header)
+            fp.write(self.data)
+
+    @classmethod
+    def load(cls, fpath):
+        with open(fpath, 'rb') as fp:
+            prefix = fp.read(len(MAGIC) + 4)
+            if len(prefix) != len(MAGIC) + 4 or prefix[:len(MAGIC)] != MAGIC:
+                raise TableFormatError('Not a Bloom filter')
+            length = struct.unpack('<I', prefix[len(MAGIC):])[0]
+            header = json.loads(fp.read(length).decode())
+            if header.get('version') != VERSION:
+                raise TableFormatError('Unsupported filter version %r' % header.get('version'))
+            data = bytearray(fp.read())
+        if len(data) != (header['bits'] + 7) // 8:
+            raise TableFormatError('Truncated filter')
+        return cls(header['algorithm'], header['digest_width'], header['bits'], header['hashes'],
+                   header.get('count', 0), header.get('fp_rate'), data)
+
+
+def distinct_digests(reader):
+    ''' Yield each digest of a sorted index once, repeats (collisions) are adjacent '''
+    header = reader.header
+    width = header.record_width
+    previous = None
+    for data in reader.batches():
+        for offset in range(0, len(data), width):
+            digest = data[offset:offset + header.digest_width]
+            if digest != previous:
+                yield digest
+                previous = digest
+
+
+def build_filter(reader, fp_rate=FP_RATE):
+    '''
+    Filter of every digest in a sorted index (see sorted_index.py), sized by
+    the distinct digests so repeated digests don't inflate it
+    '''
+    header = reader.header
+    count = sum(1 for _ in distinct_digests(reader))
+    bloom = BloomFilter.for_capacity(header.algorithm, header.digest_width, count, fp_rate)
+    for digest in distinct_digests(reader):
+        bloom.add(digest)
+    return bloom
+
+
+def prune(bloom, hashes):
+    ''' The base64 `hashes` that may be in the filter, invalid or too short hashes are dropped '''
+    kept = []
+    for value in hashes:
+        try:
+            data = b64decode(value, validate=True)
+        except (BinasciiError, TypeError, ValueError):
+            continue
+        if bloom.digest_width <= len(data) and data in bloom:
+            kept.append(value)
+    return kept
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Drop the hashes of a QuerySet that are definitely not in the tables')
+    parser.add_argument('filters',
+        nargs='+',
+        help='filter files (see build_index.py), a hash is kept if any filter of its algorithm may have it')
+    parser.add_argument('-f', '--file',
+        dest='file',
+        default=None,
+        help='read the QuerySet JSON from a file instead of stdin')
+    args = parser.parse_args()
+    with open(args.file, 'r') if args.file is not None else sys.stdin as fp:
+        query_set = json.load(fp)
+    hashes = list(query_set.get('hashes') or [])
+    kept, filtered = set(), False
+    for fpath in args.filters:
+        bloom = BloomFilter.load(fpath)
+        if bloom.algorithm == query_set.get('algorithm'):
+            kept.update(prune(bloom, hashes))
+            filtered = True
+    if filtered:
+        query_set['hashes'] = [value for value in hashes if value in kept]
+    sys.stderr.write('Kept %d of %d hashes\n' % (len(query_set['hashes']), len(hashes)))
+    sys.stdout.write(json.dumps(query_set) + '\n')
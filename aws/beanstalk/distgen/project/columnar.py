@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+'''
+
+> Columnar per-algorithm output, so scans and load jobs only touch one algorithm
+
+With pyarrow installed tables are written as Parquet, one BYTES column per
+algorithm and the preimage as BYTES (or its rank as a UINT64), with the
+table header (see table_format.py) kept in the schema metadata.
+
+Without pyarrow a table is a directory with one file per column:
+
+    header.json         the table header
+    preimage.col        fixed width preimage records, inline or rank tables only
+    <algorithm>.col     the raw (truncated) digests, `digest_width` bytes each
+
+Every column file is fixed width, so row `n` of any column is at `n` times
+its width.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import json
+import argparse
+
+from table_format import TableHeader, TableReader, INLINE, RANK, IMPLICIT, BATCH_RECORDS, batch_ranks
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+HEADER = 'header.json'
+PREIMAGE = 'preimage'
+COLUMN_EXTENSION = '.col'
+HEADER_METADATA = b'big_rainbow_header'
+ROW_GROUP_SIZE = 1 << 17  # Rows buffered before a Parquet row group is written
+
+
+class ColumnWriter(object):
+    ''' Writes a table as a directory of column files, the pure python fallback '''
+
+    extension = ''
+
+    def __init__(self, dirpath, header):
+        self.path = dirpath
+        self.header = header
+        self.next_rank = header.start
+        os.makedirs(dirpath, exist_ok=True)
+        with open(os.path.join(dirpath, HEADER), 'w') as fp:
+            json.dump(header.to_dict(), fp)
+        # A table without digests packs just the preimage records
+        self._preimages = TableHeader([], [], header.preimage_width, preimage=header.preimage,
+                                      charset=header.charset, keyspace=header.keyspace,
+                                      start=header.start)
+        self.columns = {}
+        if header.preimage != IMPLICIT:
+            self.columns[PREIMAGE] = open(self.column_path(dirpath, PREIMAGE), 'wb')
+        for algorithm in header.algorithms:
+            self.columns[algorithm] = open(self.column_path(dirpath, algorithm), 'wb')
+
+    @staticmethod
+    def column_path(dirpath, column):
+        return os.path.join(dirpath, column + COLUMN_EXTENSION)
+
+    def write_batch(self, preimages, digests, start=None):
+        ''' Write a batch of rows, `start` is the rank of the first preimage (see TableHeader.pack) '''
+        if self.header.preimage == IMPLICIT and start != self.next_rank:
+            raise ValueError('Implicit tables must be written in rank order')
+        if PREIMAGE in self.columns:
+            self.columns[PREIMAGE].write(self._preimages.pack(preimages, {}, start))
+        for algorithm in self.header.algorithms:
+            self.columns[algorithm].write(digests[algorithm])
+        if isinstance(start, int):
+            self.next_rank = start + len(preimages)
+
+    def close(self):
+        for fp in self.columns.values():
+            fp.close()
+
+
+class ColumnReader(object):
+    ''' Reads a directory of column files, one column at a time '''
+
+    def __init__(self, dirpath):
+        self.path = dirpath
+        with open(os.path.join(dirpath, HEADER), 'r') as fp:
+            self.header = TableHeader.from_dict(json.load(fp))
+        self._preimages = TableHeader([], [], self.header.preimage_width,
+                                      preimage=self.header.preimage, charset=self.header.charset,
+                                      keyspace=self.header.keyspace, start=self.header.start)
+
+    def width(self, column):
+        if column == PREIMAGE:
+            return self._preimages.record_width
+        return self.header.digest_widths[self.header.algorithms.index(column)]
+
+    def __len__(self):
+        algorithm = self.header.algorithms[0]
+        size = os.path.getsize(ColumnWriter.column_path(self.path, algorithm))
+        return size // self.width(algorithm)
+
+    def digests(self, algorithm, count=BATCH_RECORDS):
+        ''' Yield the packed digests of one algorithm, up to `count` at a time '''
+        width = self.width(algorithm)
+        with open(ColumnWriter.column_path(self.path, algorithm), 'rb') as fp:
+            while True:
+                data = fp.read(count * width)
+                if not data:
+                    break
+                yield data
+
+    def preimage(self, index):
+        ''' The preimage (bytes) of row `index` '''
+        if self.header.preimage == IMPLICIT:
+            return self.header.unrank(self.header.start + index)
+        width = self.width(PREIMAGE)
+        with open(ColumnWriter.column_path(self.path, PREIMAGE), 'rb') as fp:
+            fp.seek(index * width)
+            preimages, _ = self._preimages.unpack(fp.read(width))
+        return self.header.preimage_of(preimages[0])
+
+
+class ParquetWriter(object):
+    ''' Writes a table as a Parquet file with pyarrow '''
+
+    extension = '.parquet'
+
+    def __init__(self, fpath, header):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is required to write Parquet')
+        self.path = fpath
+        self.header = header
+        self.next_rank = header.start
+        fields = []
+        if header.preimage == INLINE:
+            fields.append(pyarrow.field(PREIMAGE, pyarrow.binary()))
+        elif header.preimage == RANK:
+            fields.append(pyarrow.field(RANK, pyarrow.uint64()))
+        for algorithm, width in zip(header.algorithms, header.digest_widths):
+            fields.append(pyarrow.field(algorithm, pyarrow.binary(width)))
+        metadata = {HEADER_METADATA: json.dumps(header.to_dict()).encode()}
+        self.schema = pyarrow.schema(fields, metadata=metadata)
+        self._writer = parquet.ParquetWriter(fpath, self.schema)
+        self._pending = []
+        self._pending_rows = 0
+
+    def write_batch(self, preimages, digests, start=None):
+        ''' Write a batch of rows, `start` is the rank of the first preimage (see TableHeader.pack) '''
+        if self.header.preimage == IMPLICIT and start != self.next_rank:
+            raise ValueError('Implicit tables must be written in rank order')
+        count = len(preimages)
+        columns = []
+        if self.header.preimage == INLINE:
+            columns.append(pyarrow.array(preimages, pyarrow.binary()))
+        elif self.header.preimage == RANK:
+            columns.append(pyarrow.array(batch_ranks(start, count), pyarrow.uint64()))
+        for algorithm, width in zip(self.header.algorithms, self.header.digest_widths):
+            buffer = pyarrow.py_buffer(bytes(digests[algorithm]))
+            columns.append(pyarrow.FixedSizeBinaryArray.from_buffers(
+                pyarrow.binary(width), count, [None, buffer]))
+        self._pending.append(pyarrow.Table.from_arrays(columns, schema=self.schema))
+        self._pending_rows += count
+        if ROW_GROUP_SIZE <= self._pending_rows:
+            self.flush()
+        if isinstance(start, int):
+            self.next_rank = start + count
+
+    def flush(self):
+        ''' Write the buffered batches as a single row group '''
+        if self._pending:
+            self._writer.write_table(pyarrow.concat_tables(self._pending), row_group_size=self._pending_rows)
+            self._pending, self._pending_rows = [], 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+def open_columnar(path, header):
+    ''' Parquet writer if pyarrow is installed, otherwise column files (`path` without extension) '''
+    if pyarrow is not None:
+        return ParquetWriter(path + ParquetWriter.extension, header)
+    return ColumnWriter(path + ColumnWriter.extension, header)
+
+
+def _runs(header, preimages):
+    ''' Split a batch into `(offset, stop, start rank)` runs of consecutive ranks '''
+    if header.preimage == INLINE:
+        yield 0, len(preimages), None
+        return
+    offset = 0
+    for index in range(1, len(preimages) + 1):
+        if index == len(preimages) or preimages[index] != preimages[index - 1] + 1:
+            yield offset, index, preimages[offset]
+            offset = index
+
+
+def convert(reader, path):
+    ''' Write a binary table (see table_format.py) as a columnar table '''
+    header = reader.header
+    writer = open_columnar(path, header)
+    try:
+        for preimages, digests in reader.batches():
+            for offset, stop, start in _runs(header, preimages):
+                columns = {}
+                for algorithm, width in zip(header.algorithms, header.digest_widths):
+                    columns[algorithm] = digests[algorithm][offset * width:stop * width]
+                writer.write_batch(preimages[offset:stop], columns, start)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert binary tables to columnar tables (Parquet or column files)')
+    parser.add_argument('tables',
+        nargs='+',
+        help='binary table file(s)')
+    parser.add_argument('-o', '--output',
+        dest='output',
+        default=os.getcwd(),
+        help='output directory to write data to')
+    args = parser.parse_args()
+    for fpath in args.tables:
+        name = os.path.splitext(os.path.basename(fpath))[0]
+        reader = TableReader.open(fpath)
+        try:
+            convert(reader, os.path.join(args.output, name))
+        finally:
+            reader.close()
+        sys.stdout.write('%s -> %s\n' % (fpath, os.path.join(args.output, name)))
@@ -7,69 +7,163 @@ import os
 import sys
 import time
 import json
+import shutil
 import logging
 import argparse
 import  multiprocessing as mp
 
 from os import getcwd, _exit
+from itertools import islice
 from binascii import hexlify
 from base64 import b64encode
 
 import boto3
 
-from generate_seeded_keyspace import KeyspaceGenerator
-from algorithms import algorithms
+from generate_seeded_keyspace import KeyspaceGenerator, KeyspaceBlock, MaskKeyspace, PolicyKeyspace, iter_candidates
+from algorithms import algorithms, salted_algorithms, with_users, digest_all, digest_width, encode_digests
+from table_format import TableHeader, TableWriter, NdjsonWriter, INLINE, IMPLICIT, PREIMAGE_MODES, TRUNCATE
+from columnar import open_columnar
+from shards import ShardedWriter, shard_name
 
 ALL = 'all'
-TRUNCATE = 6
+BATCH_SIZE = 4096
+JSON, BINARY, COLUMNAR = 'json', 'binary', 'columnar'
 
 
-def get_hash_algorithms(algorithm_names):
+def get_hash_algorithms(algorithm_names, users=None):
     ''' Gets the algorithm objects by name(s) '''
-    if ALL in algorithm_names:
-        return algorithms
+    return with_users(algorithm_names, users)
+
+
+def compute_keyspace(start, stop, hash_algorithms, charset, fout, keyspace=None, truncate=TRUNCATE):
+    ''' Hash every value in `start` -> `stop` (exclusive), digests are truncated to `truncate` bytes '''
+    candidates = iter_candidates(start, stop, charset, keyspace)
+    words = list(islice(candidates, BATCH_SIZE))
+    position = start
+    while words:
+        if hasattr(fout, 'write_batch'):
+            fout.write_batch(words, digest_all(hash_algorithms, words, truncate), position)
+        else:
+            fout.write(compute_batch(words, hash_algorithms, truncate))
+        position += len(words)
+        words = list(islice(candidates, BATCH_SIZE))
+
+
+def compute_batch(words, hash_algorithms, truncate=TRUNCATE):
+    ''' JSON lines for a batch of words, digests shared between algorithms are computed once '''
+    digests = digest_all(hash_algorithms, words, truncate)
+    columns = {}
+    for name, algo in hash_algorithms.items():
+        columns[name] = encode_digests(digests[name], digest_width(algo, truncate))
+    lines = []
+    for index, word in enumerate(words):
+        results = {"preimage": word.decode()}
+        for name, column in columns.items():
+            results[name] = column[index]
+        lines.append(json.dumps(results)+"\n")
+    return ''.join(lines)
+
+
+def block_header(hash_algorithms, start, stop, charset=None, keyspace=None, preimage=INLINE,
+                 truncate=TRUNCATE):
+    '''
+    Table header for a block, binary records are as wide as its widest value and
+    with `preimage` set to "rank" or "implicit" store ranks in their place
+    '''
+    if keyspace is not None:
+        preimage_width = keyspace.width
     else:
-        hash_algorithms = {}
-        for name in algorithm_names:
-            if name in algorithms:
-                hash_algorithms[name] = algorithms[name]
-        return hash_algorithms
-
-
-def compute_keyspace(start, stop, hash_algorithms, charset, fout):
-    seed = KeyspaceGenerator.to_base_n(start, charset)
-    keyspace = KeyspaceGenerator(seed, stop)
-    for word in keyspace:
-        results = {"preimage": word}
-        for name, algo in hash_algorithms.items():
-            results[name] = b64encode(algo(word.encode()).digest()[:TRUNCATE]).decode()
-        data = json.dumps(results)+"\n"
-        fout.write(data)
-
-
-def start_worker(worker_id, sqs_queue_name, s3_bucket, algorithm_names=None, charset=None):
-    ''' Excuted as a worker process '''
+        preimage_width = KeyspaceBlock.position_width(max(start, stop - 1), charset)
+    return TableHeader.for_algorithms(hash_algorithms, truncate, preimage_width, charset, keyspace,
+                                      preimage, start)
+
+
+def open_output(fpath, output_format, header):
+    '''
+    Output at `fpath` (without extension) and the path written to, without
+    pyarrow columnar output is a directory
+    '''
+    if output_format == COLUMNAR:
+        fout = open_columnar(fpath, header)
+        return fout, fout.path
+    if output_format == BINARY:
+        return TableWriter(open(fpath + '.bin', 'wb'), header), fpath + '.bin'
+    return open(fpath + '.json', 'w'), fpath + '.json'
+
+
+def open_sharded(dirpath, fname, output_format, header, shard_bits, shard_algorithm):
+    ''' Buffered writers for `fname` in each shard directory of `dirpath`, opened as needed '''
+    def open_shard(index):
+        shard_path = os.path.join(dirpath, shard_name(index, shard_bits))
+        os.makedirs(shard_path, exist_ok=True)
+        fout, _ = open_output(os.path.join(shard_path, fname), output_format, header)
+        return fout if hasattr(fout, 'write_batch') else NdjsonWriter(fout, header)
+    digest_widths = dict(zip(header.algorithms, header.digest_widths))
+    return ShardedWriter(open_shard, shard_algorithm, digest_widths, shard_bits)
+
+
+def output_files(fpath):
+    ''' Every file written to `fpath`, a file or a directory '''
+    if not os.path.isdir(fpath):
+        return [fpath]
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(fpath) for name in names)
+
+
+def start_worker(worker_id, sqs_queue_name, s3_bucket, algorithm_names=None, charset=None,
+                 output_format=JSON, preimage=INLINE, shard_bits=None, shard_algorithm=None,
+                 truncate=TRUNCATE, users=None):
+    '''
+    Excuted as a worker process, blocks that don't say what to truncate
+    digests to use `truncate`, salted algorithms are salted with each of `users`
+    '''
     
     s3 = boto3.client('s3')
     sqs = boto3.resource('sqs', region_name=os.environ.get('AWS_REGION', 'us-west-2'))
     sqs_queue = sqs.get_queue_by_name(QueueName=sqs_queue_name, region_name=os.environ.get('AWS_REGION', 'us-west-2'))
     charset = KeyspaceGenerator.DEFAULT_CHARSET if charset is None else charset
     algorithm_names = ['all'] if algorithm_names is None else algorithm_names
-    hash_algorithms = get_hash_algorithms(algorithm_names)
+    hash_algorithms = get_hash_algorithms(algorithm_names, users)
+    if output_format == JSON:
+        preimage = INLINE
+    if shard_bits is not None:
+        shard_algorithm = shard_algorithm or next(iter(hash_algorithms))
 
     while True:
         for message in sqs_queue.receive_messages():
             print('Recieved message(s): %r' % message)
             try:
                 block = json.loads(message.body)
-                fname = "generated_keyspace_{}_{}.json".format(block['start'], block['stop'])
-                fpath = os.path.join(getcwd(), fname)
-                with open(fpath, 'w') as fout:
-                    compute_keyspace(block['start'], block['stop'], hash_algorithms, charset, fout)
-                with open(fpath, 'r') as fout:
-                    print("S3 Put '{}' -> {}://{}".format(fpath, s3_bucket, fname))
-                    s3.put_object(Bucket=s3_bucket, Key=fname, Body=fout.read())
-                os.unlink(fpath)
+                fname = "generated_keyspace_{}_{}".format(block['start'], block['stop'])
+                keyspace = None
+                if block.get('mask'):
+                    keyspace = MaskKeyspace(block['mask'], block.get('custom_charsets'))
+                elif block.get('policy'):
+                    keyspace = PolicyKeyspace.from_spec(block['policy'])
+                block_charset = charset if keyspace is None else None
+                block_truncate = block.get('truncate') or truncate
+                header = block_header(hash_algorithms, block['start'], block['stop'], block_charset,
+                                      keyspace, preimage, block_truncate)
+                if shard_bits is not None:
+                    # Keys are "<shard>/<fname>" so each shard is its own S3 prefix
+                    fpath = key_root = os.path.join(getcwd(), fname)
+                    fout = open_sharded(fpath, fname, output_format, header, shard_bits, shard_algorithm)
+                else:
+                    key_root = getcwd()
+                    fout, fpath = open_output(os.path.join(getcwd(), fname), output_format, header)
+                try:
+                    compute_keyspace(block['start'], block['stop'], hash_algorithms,
+                                     block_charset, fout, keyspace, block_truncate)
+                finally:
+                    fout.close()
+                for upload in output_files(fpath):
+                    key = os.path.relpath(upload, key_root)
+                    with open(upload, 'rb') as fout:
+                        print("S3 Put '{}' -> {}://{}".format(upload, s3_bucket, key))
+                        s3.put_object(Bucket=s3_bucket, Key=key, Body=fout.read())
+                if os.path.isdir(fpath):
+                    shutil.rmtree(fpath)
+                else:
+                    os.unlink(fpath)
                 message.delete()
             except:
                 logging.exception('Error in worker process')
@@ -77,11 +171,21 @@ def start_worker(worker_id, sqs_queue_name, s3_bucket, algorithm_names=None, cha
 def main(args):
     ''' Starts worker processes '''
     print('Starting big rainbow dist-gen')
+    if args.shard_bits is not None and args.format != JSON and args.preimage == IMPLICIT:
+        sys.stderr.write('Implicit preimages depend on record order, they cannot be sharded\n')
+        sys.exit(1)
+    try:
+        get_hash_algorithms(args.algorithms, args.users)
+    except ValueError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(1)
     workers = []
     print('Starting %d worker processes' % mp.cpu_count())
     for worker_id in range(mp.cpu_count()):
         worker = mp.Process(target=start_worker, 
-                            args=(worker_id, args.sqs_queue, args.s3_bucket, args.algorithms))
+                            args=(worker_id, args.sqs_queue, args.s3_bucket, args.algorithms, None,
+                                  args.format, args.preimage, args.shard_bits, args.shard_algorithm,
+                                  args.truncate, args.users))
         worker.start()
         workers.append(worker)
     [worker.join() for worker in workers]       
@@ -103,7 +207,14 @@ if __name__ == '__main__':
         nargs='*',
         dest='algorithms',
         default=get_default_algorithms(),
-        help='hashing algorithm to use: %s' % (['all']+ sorted(algorithms.keys())))
+        help='hashing algorithm to use: %s, salted algorithms %s with each user of -U' % (
+            ['all']+ sorted(algorithms.keys()), sorted(salted_algorithms.keys())))
+
+    parser.add_argument('-U',
+        nargs='+',
+        dest='users',
+        help='users to salt the salted algorithms of -a with, e.g. -a postgres_md5 -U root bob',
+        default=os.environ.get('DISTGEN_USERS', '').split() or None)
 
     parser.add_argument('-Q',
         dest='sqs_queue',
@@ -115,4 +226,34 @@ if __name__ == '__main__':
         default=os.environ.get('DISTGEN_S3_BUCKET', 'big-rainbow-distgen'),
         help='s3 bucket name to store results')
     
+    parser.add_argument('-f',
+        choices=[JSON, BINARY, COLUMNAR],
+        dest='format',
+        default=os.environ.get('DISTGEN_FORMAT', JSON),
+        help='write JSON lines, fixed width binary records (see table_format.py) '
+             'or a column per algorithm (see columnar.py)')
+
+    parser.add_argument('-p',
+        choices=PREIMAGE_MODES,
+        dest='preimage',
+        default=os.environ.get('DISTGEN_PREIMAGE', INLINE),
+        help='store binary preimages inline, as their rank, or implied by record order')
+
+    parser.add_argument('-S',
+        type=int,
+        dest='shard_bits',
+        default=int(os.environ['DISTGEN_SHARD_BITS']) if os.environ.get('DISTGEN_SHARD_BITS') else None,
+        help='route records into 2^n shards by the leading bits of a digest')
+
+    parser.add_argument('--shard-algorithm',
+        dest='shard_algorithm',
+        default=os.environ.get('DISTGEN_SHARD_ALGORITHM') or None,
+        help='algorithm whose digest picks the shard (default: the first algorithm)')
+
+    parser.add_argument('-T',
+        type=int,
+        dest='truncate',
+        default=int(os.environ.get('DISTGEN_TRUNCATE') or TRUNCATE),
+        help='bytes to truncate digests to, unless a block says (see distgen_fill_queue.py -T)')
+
     main(parser.parse_args())
@@ -21,88 +21,1030 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import sys
+import json
+import math
 
-from string import printable
+from bisect import bisect_right
+from string import printable, ascii_lowercase, ascii_uppercase, digits, punctuation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class MaskKeyspace(object):
+    '''
+    A hashcat style mask (e.g. "?u?l?l?l?d?d") where each position has its own
+    charset, positions are ranked in mixed radix with the last char changing
+    fastest. Literal chars take up a position with a single char charset, "??"
+    is a literal "?" and "?1" - "?4" refer to `custom_charsets`.
+    '''
+
+    BUILTIN_CHARSETS = {
+        'l': ascii_lowercase,
+        'u': ascii_uppercase,
+        'd': digits,
+        'h': digits + 'abcdef',
+        'H': digits + 'ABCDEF',
+        's': ' ' + punctuation,
+        'a': ascii_lowercase + ascii_uppercase + digits + ' ' + punctuation,
+    }
+    MAX_CUSTOM_CHARSETS = 4
+
+    def __init__(self, mask, custom_charsets=None):
+        if not isinstance(mask, str) or not len(mask):
+            raise ValueError('Mask must be a non-empty string')
+        custom_charsets = custom_charsets if custom_charsets is not None else []
+        if self.MAX_CUSTOM_CHARSETS < len(custom_charsets):
+            raise ValueError('Max custom charsets is %d' % self.MAX_CUSTOM_CHARSETS)
+        self.mask = mask
+        self.custom_charsets = [self._expand(charset) for charset in custom_charsets]
+        self.charsets = self._parse(mask)
+        self._charmaps = [{char: index for index, char in enumerate(charset)}
+                          for charset in self.charsets]
+
+    @classmethod
+    def is_mask(cls, value):
+        ''' Is `value` a mask rather than a plain chars length? '''
+        return not value.isdigit()
+
+    def _expand(self, charset):
+        ''' Expand builtin placeholders inside a custom charset '''
+        expanded = []
+        index = 0
+        while index < len(charset):
+            if charset[index] == '?' and index + 1 < len(charset):
+                key = charset[index + 1]
+                expanded.append('?' if key == '?' else self._builtin(key))
+                index += 2
+            else:
+                expanded.append(charset[index])
+                index += 1
+        chars = ''.join(expanded)
+        return ''.join(char for index, char in enumerate(chars) if chars.index(char) == index)
+
+    def _builtin(self, key):
+        if key not in self.BUILTIN_CHARSETS:
+            raise ValueError('Unknown mask charset ?%s' % key)
+        return self.BUILTIN_CHARSETS[key]
+
+    def _parse(self, mask):
+        ''' Parse the mask into a list of per-position charsets '''
+        charsets = []
+        index = 0
+        while index < len(mask):
+            if mask[index] != '?':
+                charsets.append(mask[index])
+                index += 1
+                continue
+            if len(mask) <= index + 1:
+                raise ValueError('Mask cannot end with a bare "?"')
+            key = mask[index + 1]
+            if key == '?':
+                charsets.append('?')
+            elif key.isdigit():
+                custom = int(key) - 1
+                if not 0 <= custom < len(self.custom_charsets):
+                    raise ValueError('Mask uses undefined custom charset ?%s' % key)
+                charsets.append(self.custom_charsets[custom])
+            else:
+                charsets.append(self._builtin(key))
+            index += 2
+        if any(not len(charset) for charset in charsets):
+            raise ValueError('Mask charsets cannot be empty')
+        return charsets
+
+    @property
+    def width(self):
+        return len(self.charsets)
+
+    @property
+    def count(self):
+        ''' Exact number of values the mask produces '''
+        count = 1
+        for charset in self.charsets:
+            count *= len(charset)
+        return count
+
+    def rank(self, value):
+        ''' Integer position of `value` within the mask '''
+        if len(value) != self.width:
+            raise ValueError('Value does not match the mask width')
+        position = 0
+        for charset, charmap, char in zip(self.charsets, self._charmaps, value):
+            if char not in charmap:
+                raise ValueError('Value does not match the mask')
+            position = position * len(charset) + charmap[char]
+        return position
+
+    def unrank(self, position):
+        ''' Value at integer `position` within the mask '''
+        if not 0 <= position < self.count:
+            raise IndexError('Position is outside of the mask keyspace')
+        chars = []
+        for charset in reversed(self.charsets):
+            position, digit = divmod(position, len(charset))
+            chars.append(charset[digit])
+        return ''.join(reversed(chars))
+
+    def generator(self, start=0, stop=None):
+        ''' A KeyspaceGenerator over the mask from `start` to `stop` (inclusive) '''
+        return KeyspaceGenerator(self.unrank(start), stop, mask=self)
+
+    def to_dict(self):
+        ''' JSON serializable spec, see `keyspace_from_dict` '''
+        return {'type': 'mask', 'mask': self.mask,
+                'custom_charsets': [charset.replace('?', '??') for charset in self.custom_charsets]}
+
+    @classmethod
+    def from_dict(cls, spec):
+        ''' Rebuild a mask from its `to_dict` spec, custom charsets are parsed again '''
+        return cls(spec['mask'], spec.get('custom_charsets'))
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        return self.mask
+
+
+class PolicyKeyspace(object):
+    '''
+    Fixed length values that meet a password policy, i.e. at least `n` chars
+    from each of the lower, upper, digit and symbol classes. Only conforming
+    values are counted and ranked: at each position the chars are grouped by
+    class (in `CLASSES` order) and the number of policy conforming completions
+    of every class is counted, so a position maps directly to a value.
+
+    Policies are written as "<length>:<mask charsets>", e.g. "8:?u?d?s" is 8
+    chars with at least one upper, one digit and one symbol.
+    '''
+
+    CLASSES = ('l', 'u', 'd', 's')
+
+    def __init__(self, length, minimums=None):
+        if length < 1:
+            raise ValueError('Policy length must be at least 1 char')
+        minimums = minimums if minimums is not None else {}
+        for key in minimums:
+            if key not in self.CLASSES:
+                raise ValueError('Unknown policy class ?%s' % key)
+        self.length = length
+        self.minimums = tuple(minimums.get(key, 0) for key in self.CLASSES)
+        self.charsets = [MaskKeyspace.BUILTIN_CHARSETS[key] for key in self.CLASSES]
+        self._classmap = {}
+        for cls_index, charset in enumerate(self.charsets):
+            for index, char in enumerate(charset):
+                self._classmap[char] = (cls_index, index)
+        self._completions_cache = {}
+
+    @classmethod
+    def is_policy(cls, value):
+        return ':' in value
+
+    @classmethod
+    def from_spec(cls, spec):
+        ''' Parse a "<length>:<mask charsets>" policy '''
+        length, _, required = spec.partition(':')
+        if not length.isdigit():
+            raise ValueError('Policy must start with a length')
+        minimums = {}
+        for placeholder in required.split('?')[1:]:
+            if len(placeholder) != 1:
+                raise ValueError('Invalid policy class ?%s' % placeholder)
+            minimums[placeholder] = minimums.get(placeholder, 0) + 1
+        return cls(int(length), minimums)
+
+    @property
+    def spec(self):
+        required = ''.join('?%s' % key * minimum
+                           for key, minimum in zip(self.CLASSES, self.minimums))
+        return '%d:%s' % (self.length, required)
+
+    def to_dict(self):
+        ''' JSON serializable spec, see `keyspace_from_dict` '''
+        return {'type': 'policy', 'spec': self.spec}
+
+    @property
+    def width(self):
+        return self.length
+
+    def _completions(self, length, deficits):
+        ''' Number of `length` char suffixes that cover the `deficits` '''
+        key = (length, deficits)
+        if key not in self._completions_cache:
+            if length < sum(deficits):
+                count = 0
+            elif length == 0:
+                count = 1
+            else:
+                count = 0
+                for cls_index, charset in enumerate(self.charsets):
+                    count += len(charset) * self._completions(
+                        length - 1, self._consume(deficits, cls_index))
+            self._completions_cache[key] = count
+        return self._completions_cache[key]
+
+    @staticmethod
+    def _consume(deficits, cls_index):
+        if not deficits[cls_index]:
+            return deficits
+        return deficits[:cls_index] + (deficits[cls_index] - 1,) + deficits[cls_index + 1:]
+
+    @property
+    def count(self):
+        ''' Exact number of values that meet the policy '''
+        return self._completions(self.length, self.minimums)
+
+    def rank(self, value):
+        ''' Integer position of `value` within the policy '''
+        if len(value) != self.length:
+            raise ValueError('Value does not match the policy length')
+        position = 0
+        deficits = self.minimums
+        for offset, char in enumerate(value):
+            if char not in self._classmap:
+                raise ValueError('Value contains chars outside of the policy')
+            cls_index, index = self._classmap[char]
+            remaining = self.length - offset - 1
+            for earlier in range(cls_index):
+                position += len(self.charsets[earlier]) * self._completions(
+                    remaining, self._consume(deficits, earlier))
+            deficits = self._consume(deficits, cls_index)
+            position += index * self._completions(remaining, deficits)
+        if sum(deficits):
+            raise ValueError('Value does not meet the policy')
+        return position
+
+    def _unrank_prefix(self, position):
+        '''
+        Unrank all but the last char of `position`, returns the prefix, the
+        chars allowed in the last position and the offset into them
+        '''
+        if not 0 <= position < self.count:
+            raise IndexError('Position is outside of the policy keyspace')
+        chars = []
+        deficits = self.minimums
+        for offset in range(self.length - 1):
+            remaining = self.length - offset - 1
+            for cls_index, charset in enumerate(self.charsets):
+                consumed = self._consume(deficits, cls_index)
+                completions = self._completions(remaining, consumed)
+                if position < len(charset) * completions:
+                    index, position = divmod(position, completions)
+                    chars.append(charset[index])
+                    deficits = consumed
+                    break
+                position -= len(charset) * completions
+        tail = ''.join(charset for cls_index, charset in enumerate(self.charsets)
+                       if self._completions(0, self._consume(deficits, cls_index)))
+        return ''.join(chars), tail, position
+
+    def unrank(self, position):
+        ''' Value at integer `position` within the policy '''
+        prefix, tail, offset = self._unrank_prefix(position)
+        return prefix + tail[offset]
+
+    def iterate(self, start=0, stop=None):
+        '''
+        Yield the values in `start` -> `stop` (exclusive), only the prefix is
+        unranked and then every allowed last char is appended to it
+        '''
+        stop = self.count if stop is None or self.count < stop else stop
+        position = start
+        while position < stop:
+            prefix, tail, offset = self._unrank_prefix(position)
+            run = tail[offset:offset + stop - position]
+            for char in run:
+                yield prefix + char
+            position += len(run)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.iterate()
+
+    def __str__(self):
+        return self.spec
+
+
+class MarkovKeyspace(object):
+    '''
+    Fixed length values in (approximately) descending probability under a per
+    position Markov model, in the style of OMEN. Each transition probability is
+    bucketed into an integer level (0 is most likely, `MAX_LEVEL` least) and
+    values are enumerated in order of the sum of their levels. The number of
+    values in each level is counted, so positions are still plain integers and
+    a run can be resumed or split into blocks like any other keyspace.
+    '''
+
+    MAX_LEVEL = 10
+    MAX_POSITIONS = 16
+    START = ''
+
+    def __init__(self, model, length):
+        if length < 1:
+            raise ValueError('Markov length must be at least 1 char')
+        self.model = model
+        self.charset = model['charset']
+        self.length = length
+        self._levels = model['levels']
+        self._ranks = [{prev: {char: index for index, (char, _) in enumerate(transitions)}
+                        for prev, transitions in position.items()}
+                       for position in self._levels]
+        self._counts = {}
+        self._level_counts = []
+
+    @classmethod
+    def train(cls, words, charset=None):
+        '''
+        Build a model from an iterable of words, transitions are add-one
+        smoothed so every value in the charset can still be generated
+        '''
+        charset = charset if charset is not None else KeyspaceGenerator.DEFAULT_CHARSET
+        prevs = [cls.START] + list(charset)
+        counts = [{prev: {char: 1 for char in charset} for prev in prevs}
+                  for _ in range(cls.MAX_POSITIONS)]
+        for word in words:
+            prev = cls.START
+            for offset, char in enumerate(word[:cls.MAX_POSITIONS]):
+                if char not in counts[offset][prev]:
+                    break
+                counts[offset][prev][char] += 1
+                prev = char
+        levels = []
+        for position in counts:
+            levels.append({prev: cls._to_levels(chars) for prev, chars in position.items()})
+        return {'charset': charset, 'levels': levels}
+
+    @classmethod
+    def _to_levels(cls, chars):
+        ''' Bucket transition counts into levels, sorted most likely first '''
+        total = float(sum(chars.values()))
+        transitions = []
+        for char, count in sorted(chars.items(), key=lambda item: -item[1]):
+            level = int(-math.log(count / total, 2))
+            transitions.append((char, level if level < cls.MAX_LEVEL else cls.MAX_LEVEL))
+        return transitions
+
+    @classmethod
+    def load(cls, fpath, length):
+        with open(fpath, 'r') as fp:
+            return cls(json.load(fp), length)
+
+    @classmethod
+    def save(cls, model, fpath):
+        with open(fpath, 'w') as fp:
+            json.dump(model, fp)
+
+    @property
+    def width(self):
+        return self.length
+
+    @property
+    def count(self):
+        return len(self.charset) ** self.length
+
+    def _transitions(self, offset, prev):
+        position = offset if offset < len(self._levels) else len(self._levels) - 1
+        return self._levels[position][prev]
+
+    def _count(self, offset, prev, budget):
+        ''' Number of suffixes from `offset` whose levels sum to exactly `budget` '''
+        if offset == self.length:
+            return 1 if budget == 0 else 0
+        key = (offset, prev, budget)
+        if key not in self._counts:
+            count = 0
+            for char, level in self._transitions(offset, prev):
+                if budget < level:
+                    break
+                count += self._count(offset + 1, char, budget - level)
+            self._counts[key] = count
+        return self._counts[key]
+
+    def _level_offset(self, position):
+        ''' The level containing `position`, and the position it starts at '''
+        if not 0 <= position < self.count:
+            raise IndexError('Position is outside of the markov keyspace')
+        level, start = 0, 0
+        while True:
+            if len(self._level_counts) <= level:
+                self._level_counts.append(self._count(0, self.START, level))
+            if position < start + self._level_counts[level]:
+                return level, start
+            start += self._level_counts[level]
+            level += 1
+
+    def _walk(self, offset, prev, budget, prefix, skip):
+        ''' Yield suffixes in order, skipping the first `skip` of them '''
+        if offset == self.length - 1:
+            for char, level in self._transitions(offset, prev):
+                if budget < level:
+                    return
+                if level == budget:
+                    if skip:
+                        skip -= 1
+                    else:
+                        yield prefix + char
+            return
+        for char, level in self._transitions(offset, prev):
+            if budget < level:
+                return
+            count = self._count(offset + 1, char, budget - level)
+            if skip < count:
+                yield from self._walk(offset + 1, char, budget - level, prefix + char, skip)
+                skip = 0
+            else:
+                skip -= count
+
+    def iterate(self, start=0, stop=None):
+        ''' Yield the values in `start` -> `stop` (exclusive) '''
+        stop = self.count if stop is None or self.count < stop else stop
+        if stop <= start:
+            return
+        level, level_start = self._level_offset(start)
+        remaining = stop - start
+        skip = start - level_start
+        while remaining:
+            for value in self._walk(0, self.START, level, '', skip):
+                yield value
+                remaining -= 1
+                if not remaining:
+                    return
+            skip = 0
+            level += 1
+
+    def rank(self, value):
+        ''' Integer position of `value` within the markov order '''
+        if len(value) != self.length:
+            raise ValueError('Value does not match the markov length')
+        prev, levels = self.START, []
+        for offset, char in enumerate(value):
+            transitions = self._transitions(offset, prev)
+            position = offset if offset < len(self._ranks) else len(self._ranks) - 1
+            if char not in self._ranks[position][prev]:
+                raise ValueError('Value contains chars outside of the charset')
+            levels.append(transitions[self._ranks[position][prev][char]][1])
+            prev = char
+        budget = sum(levels)
+        position = sum(self._count(0, self.START, level) for level in range(budget))
+        prev = self.START
+        for offset, char in enumerate(value):
+            for other, level in self._transitions(offset, prev):
+                if other == char:
+                    break
+                if level <= budget:
+                    position += self._count(offset + 1, other, budget - level)
+            budget -= levels[offset]
+            prev = char
+        return position
+
+    def unrank(self, position):
+        ''' Value at integer `position` within the markov order '''
+        if not 0 <= position < self.count:
+            raise IndexError('Position is outside of the markov keyspace')
+        for value in self.iterate(position, position + 1):
+            return value
+
+    def to_dict(self):
+        ''' JSON serializable spec including the model, see `keyspace_from_dict` '''
+        return {'type': 'markov', 'length': self.length, 'model': self.model}
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.iterate()
+
+    def __str__(self):
+        return 'markov:%d' % self.length
 
 
 class KeyspaceGenerator(object):
 
-    MAX_SEED_LENGTH = 8
     DEFAULT_CHARSET = printable[:-5]
 
-    def __init__(self, seed=None, stop=None, charset=None):
+    def __init__(self, seed=None, stop=None, charset=None, mask=None):
         self.generated_count = 0
+        if mask is not None and charset is not None:
+            raise ValueError('Use either a charset or a mask, not both')
+        self.mask = MaskKeyspace(mask) if isinstance(mask, str) else mask
         self.charset = charset if charset is not None else self.DEFAULT_CHARSET
-        self._charmax = len(self.charset)
         if stop is not None and not isinstance(stop, int):
             raise TypeError('Stop must be an integer')
-        self.stop = self.to_base_n(stop, self.charset) if stop is not None else None
-        self._value = seed if seed is not None else self.charset[0]
+        self.stop = stop
+        if self.mask is not None:
+            self._value = seed if seed is not None else self.mask.unrank(0)
+        else:
+            self._value = seed if seed is not None else self.charset[0]
         if not isinstance(self._value, str):
             raise TypeError('Seed must be a string')
-        if self.MAX_SEED_LENGTH < len(self._value):
-            raise ValueError('Max seed length is %d' % self.MAX_SEED_LENGTH)
+        if not len(self._value):
+            raise ValueError('Seed must not be empty')
+        if self.mask is not None:
+            if len(self._value) != self.mask.width:
+                raise ValueError('Seed does not match the mask width')
+            self._charsets = self.mask.charsets
+            self._charmaps = self.mask._charmaps
+        else:
+            charmap = {char: index for index, char in enumerate(self.charset)}
+            self._charsets = [self.charset] * len(self._value)
+            self._charmaps = [charmap] * len(self._value)
+        self._digits = self._char_indexes()
+        self._start = self._digits_to_int(self._digits)
+        self._bound = self._digits_to_int([len(charset) - 1 for charset in self._charsets])
+        if self.stop is not None and self.stop < self._bound:
+            self._bound = self.stop if self._start < self.stop else self._start
 
     @classmethod
     def keyspace_length(cls, seed, charset):
-        return len(charset) ** len(seed)
+        ''' Number of values from `seed` (inclusive) to the end of its length '''
+        return (len(charset) ** len(seed)) - cls.rank(seed, charset)
+
+    @classmethod
+    def keyspace_range(cls, chars_len, charset, inclusive=False):
+        '''
+        The `(start, stop)` positions (stop is exclusive) of every value that is
+        `chars_len` chars long, or of every value up to `chars_len` chars long
+        when `inclusive` is set
+        '''
+        if chars_len < 1:
+            raise ValueError('Keyspace must be at least 1 char')
+        stop = len(charset) ** chars_len
+        if inclusive or chars_len == 1:
+            return 0, stop
+        return len(charset) ** (chars_len - 1), stop
+
+    @classmethod
+    def keyspace_count(cls, chars_len, charset, inclusive=False):
+        ''' Exact number of values in `keyspace_range` '''
+        start, stop = cls.keyspace_range(chars_len, charset, inclusive)
+        return stop - start
 
     @classmethod
     def to_base_n(cls, x, charset):
         '''
         Convert a number `x` to base `n` str where `n` is the len of the charset
         '''
+        if x < 0:
+            raise ValueError('Position must not be negative')
         base = len(charset)
-        if x < base:
-            return charset[x]
-        else:
-            return cls.to_base_n(x // base, charset) + charset[x % base]
+        chars = []
+        while True:
+            x, digit = divmod(x, base)
+            chars.append(charset[digit])
+            if not x:
+                return ''.join(reversed(chars))
+
+    @classmethod
+    def unrank(cls, position, charset, width=None):
+        '''
+        Value at integer `position`, the inverse of `rank`. If `width` is given
+        the value is left padded with the "zero" symbol to that many chars.
+        '''
+        value = cls.to_base_n(position, charset)
+        if width is not None and len(value) < width:
+            value = charset[0] * (width - len(value)) + value
+        return value
+
+    @classmethod
+    def rank(cls, value, charset):
+        '''
+        Integer position of `value`, leading "zero" symbols carry no weight so
+        values only round trip through `unrank` given the same `width`
+        '''
+        base = len(charset)
+        position = 0
+        for char in value:
+            position = position * base + charset.index(char)
+        return position
 
     def _char_indexes(self):
         ''' Get the indexes of each char in the current value '''
-        return [self.charset.index(char) for char in self._value]
-    
-    def _char_indexes_to_str(self, char_indexes):
-        ''' Converts char indexes back into a string '''
-        return ''.join(self.charset[index] for index in char_indexes)
-
-    def _next_char_indexes(self, char_indexes):
-        ''' Given a list of char indexes, return the next list of char indexes '''
-        next_char_indexes = [index for index in char_indexes]
-        for index, char_index in enumerate(char_indexes[::-1]):
-            rindex = (index + 1) * -1  # reverse index
-            next_char_indexes[rindex] = (char_index + 1) % self._charmax
-            if next_char_indexes[rindex] != 0:
-                return next_char_indexes
-
-    def _is_keyspace_limit(self):
-        ''' Have we hit the limit of the keyspace? '''
-        if all(char == (self._charmax - 1) for char in self._char_indexes()):
-            return True
-        if self.stop == self._value:
-            return True
-        return False
+        try:
+            return [charmap[char] for charmap, char in zip(self._charmaps, self._value)]
+        except KeyError:
+            raise ValueError('Seed contains chars outside of the keyspace')
+
+    def _digits_to_int(self, digits):
+        ''' Converts a list of char indexes into its integer position '''
+        position = 0
+        for charset, digit in zip(self._charsets, digits):
+            position = position * len(charset) + digit
+        return position
+
+    def _unrank(self, position):
+        ''' Value at absolute `position`, values of a charset aren't padded (see `unrank`) '''
+        if self.mask is not None:
+            return self.mask.unrank(position)
+        return self.unrank(position, self.charset)
+
+    @property
+    def position(self):
+        ''' Integer position of the current value '''
+        return self._start + self.generated_count
+
+    @property
+    def count(self):
+        ''' Number of values left for the iterator to yield '''
+        if self.generated_count == 0:
+            return self._bound - self._start + 1
+        return self._bound - self.position
 
     def __len__(self):
-        return self.keyspace_length(self._value, self.charset)
+        return self.count
 
     def __getitem__(self, key):
-        return self.to_base_n(key, self.charset)
+        '''
+        Value at absolute position `key` (its rank, whatever the seed is), a
+        slice returns a lazy iterator over the selected positions up to `stop`
+        '''
+        if isinstance(key, slice):
+            return (self._unrank(position) for position in range(self._bound + 1)[key])
+        if not isinstance(key, int):
+            raise TypeError('Index must be an integer or slice')
+        if self.mask is not None:
+            return self.mask.unrank(range(self.mask.count)[key])
+        return self._unrank(key)
 
     def __str__(self):
         return self._value
 
     def __iter__(self):
-        ''' Iterate over the entire keyspace starting at `seed` (inclusive) '''
+        '''
+        Iterate over the entire keyspace starting at `seed` (inclusive), the
+        char indexes are kept as an odometer so each step only touches the
+        digits that actually roll over.
+        '''
         if self.generated_count == 0:
             yield self._value
-        while not self._is_keyspace_limit():
-            char_indexes = self._char_indexes()
-            next_char_indexes = self._next_char_indexes(char_indexes)
-            next_value = self._char_indexes_to_str(next_char_indexes)
-            self._value = next_value
+        charsets = self._charsets
+        tops = [len(charset) - 1 for charset in charsets]
+        digits = self._digits
+        last = len(digits) - 1
+        tail = charsets[last]
+        head = self._value[:-1]
+        position = self.position
+        while position < self._bound:
+            index = last
+            while digits[index] == tops[index]:
+                digits[index] = 0
+                index -= 1
+            digits[index] += 1
+            if index != last:
+                head = ''.join([charsets[column][digit] for column, digit in enumerate(digits[:-1])])
+            position += 1
+            self._value = head + tail[digits[last]]
             self.generated_count += 1
-            yield next_value
+            yield self._value
+
+
+class KeyspaceBlock(object):
+    '''
+    Materializes a `(start, stop)` range of a fixed width keyspace as a single
+    contiguous buffer of `width` byte records, the digits are computed a whole
+    column at a time instead of one candidate string at a time.
+    '''
+
+    def __init__(self, start, stop, charset=None, keyspace=None):
+        if not isinstance(start, int) or not isinstance(stop, int):
+            raise TypeError('Start and stop must be integers')
+        if stop < start:
+            raise ValueError('Stop must not be less than start')
+        if keyspace is not None and charset is not None:
+            raise ValueError('Use either a charset or a keyspace, not both')
+        self.keyspace = keyspace
+        self.charset = charset if charset is not None else KeyspaceGenerator.DEFAULT_CHARSET
+        self.start = start
+        self.stop = stop
+        if self.keyspace is not None:
+            if self.keyspace.count < stop:
+                raise ValueError('Block is outside of the keyspace')
+            self.width = self.keyspace.width
+        else:
+            self.width = self.position_width(start, self.charset)
+            if start < stop and self.width != self.position_width(stop - 1, self.charset):
+                raise ValueError('Block must not span more than one width')
+        self.data = self._materialize()
+
+    @classmethod
+    def position_width(cls, position, charset):
+        ''' Length of the value at `position` (see `to_base_n`) '''
+        width = 1
+        while len(charset) ** width <= position:
+            width += 1
+        return width
+
+    @classmethod
+    def split(cls, start, stop, charset=None, keyspace=None):
+        '''
+        Yield fixed width blocks covering `start` -> `stop` (exclusive), `keyspace`
+        is a mask, policy or markov keyspace which are always fixed width
+        '''
+        if keyspace is not None:
+            if start < stop:
+                yield cls(start, stop, keyspace=keyspace)
+            return
+        charset = charset if charset is not None else KeyspaceGenerator.DEFAULT_CHARSET
+        while start < stop:
+            limit = len(charset) ** cls.position_width(start, charset)
+            end = stop if stop < limit else limit
+            yield cls(start, end, charset)
+            start = end
+
+    def _column(self, alphabet, period):
+        ''' Bytes of the digit column that changes every `period` positions '''
+        base = len(alphabet)
+        count = self.stop - self.start
+        cycle_length = base * period
+        if cycle_length <= count:
+            # Short cycles are cheaper to tile than to build run by run
+            cycle = b''.join([alphabet[index:index + 1] * period for index in range(base)])
+            offset = self.start % cycle_length
+            tiled = cycle * ((offset + count) // cycle_length + 1)
+            return tiled[offset:offset + count]
+        runs = []
+        position = self.start
+        while position < self.stop:
+            digit = (position // period) % base
+            run_end = (position // period + 1) * period
+            run_end = run_end if run_end < self.stop else self.stop
+            runs.append(alphabet[digit:digit + 1] * (run_end - position))
+            position = run_end
+        return b''.join(runs)
+
+    def _materialize(self):
+        if self.keyspace is not None and not isinstance(self.keyspace, MaskKeyspace):
+            # Without independent digit columns values are built one by one
+            data = ''.join(self.keyspace.iterate(self.start, self.stop)).encode()
+            if len(data) != len(self) * self.width:
+                raise ValueError('Keyspace must only contain single byte chars')
+            return data
+        if self.keyspace is not None:
+            charsets = self.keyspace.charsets
+        else:
+            charsets = [self.charset] * self.width
+        alphabets = [charset.encode() for charset in charsets]
+        if any(len(alphabet) != len(charset) for alphabet, charset in zip(alphabets, charsets)):
+            raise ValueError('Charset must only contain single byte chars')
+        data = bytearray((self.stop - self.start) * self.width)
+        period = 1
+        for column in reversed(range(self.width)):
+            alphabet = alphabets[column]
+            data[column::self.width] = self._column(alphabet, period)
+            period *= len(alphabet)
+        return bytes(data)
+
+    @property
+    def view(self):
+        return memoryview(self.data)
+
+    def matrix(self):
+        ''' The block as a (count, width) uint8 numpy matrix '''
+        if numpy is None:
+            raise RuntimeError('numpy is required to build a block matrix')
+        return numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(len(self), self.width)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Block index out of range')
+        offset = index * self.width
+        return self.data[offset:offset + self.width]
+
+    def __iter__(self):
+        width = self.width
+        data = self.data
+        for offset in range(0, len(data), width):
+            yield data[offset:offset + width]
+
+
+class HybridKeyspace(object):
+    '''
+    Every word of a wordlist combined with every value of a mask, either as
+    word + mask or as mask + word when `prepend` is set. Positions are ranked
+    as `word_index * mask.count + mask_index`, so blocks walk the mask of one
+    word before moving on to the next. Unlike the other keyspaces the values
+    vary in width, so they're produced directly as bytes by `candidates`.
+    '''
+
+    MAX_CACHED_MASK = 1 << 20
+
+    def __init__(self, words, mask, prepend=False):
+        self.words = [word.encode() if isinstance(word, str) else word for word in words]
+        self.mask = MaskKeyspace(mask) if isinstance(mask, str) else mask
+        self.prepend = prepend
+        self._mask_block = None
+
+    @classmethod
+    def load(cls, fpath, mask, prepend=False):
+        ''' Load a wordlist, lines that are not valid utf-8 are skipped '''
+        words = []
+        with open(fpath, 'rb') as fword:
+            for line in fword:
+                word = line.rstrip(b'\r\n')
+                try:
+                    word.decode()
+                except UnicodeDecodeError:
+                    continue
+                words.append(word)
+        return cls(words, mask, prepend)
+
+    @staticmethod
+    def combine(word, block, prepend=False):
+        ''' Yield `word` combined with each value of a mask KeyspaceBlock '''
+        if prepend:
+            for value in block:
+                yield value + word
+        else:
+            for value in block:
+                yield word + value
+
+    @property
+    def width(self):
+        return None
+
+    @property
+    def max_width(self):
+        ''' Length in bytes of the longest value '''
+        return max(len(word) for word in self.words) + self.mask.width if self.words else 0
+
+    @property
+    def count(self):
+        return len(self.words) * self.mask.count
+
+    def position(self, word_index, mask_index):
+        ''' Integer position of the `(word_index, mask_index)` pair '''
+        return word_index * self.mask.count + mask_index
+
+    def indexes(self, position):
+        ''' The `(word_index, mask_index)` pair at integer `position` '''
+        if not 0 <= position < self.count:
+            raise IndexError('Position is outside of the hybrid keyspace')
+        return divmod(position, self.mask.count)
+
+    def _block(self, start, stop):
+        if start == 0 and stop == self.mask.count and stop <= self.MAX_CACHED_MASK:
+            if self._mask_block is None:
+                self._mask_block = KeyspaceBlock(0, stop, keyspace=self.mask)
+            return self._mask_block
+        return KeyspaceBlock(start, stop, keyspace=self.mask)
+
+    def candidates(self, start=0, stop=None):
+        ''' Yield the values in `start` -> `stop` (exclusive) as bytes '''
+        stop = self.count if stop is None or self.count < stop else stop
+        if stop <= start:
+            return
+        word_index, mask_index = self.indexes(start)
+        position = start
+        while position < stop:
+            mask_stop = self.mask.count
+            if stop - position < mask_stop - mask_index:
+                mask_stop = mask_index + stop - position
+            block = self._block(mask_index, mask_stop)
+            yield from self.combine(self.words[word_index], block, self.prepend)
+            position += mask_stop - mask_index
+            word_index, mask_index = word_index + 1, 0
+
+    def iterate(self, start=0, stop=None):
+        ''' Yield the values in `start` -> `stop` (exclusive) '''
+        for candidate in self.candidates(start, stop):
+            yield candidate.decode()
+
+    def unrank(self, position):
+        ''' Value at integer `position` '''
+        word_index, mask_index = self.indexes(position)
+        word, value = self.words[word_index].decode(), self.mask.unrank(mask_index)
+        return value + word if self.prepend else word + value
+
+    def to_dict(self):
+        ''' JSON serializable spec, without the words so it can't be rebuilt from it '''
+        return {'type': 'hybrid', 'mask': self.mask.to_dict(), 'prepend': self.prepend}
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.iterate()
+
+    def __str__(self):
+        return '?w' + str(self.mask) if not self.prepend else str(self.mask) + '?w'
+
+
+class IncrementKeyspace(object):
+    '''
+    Fixed width keyspaces one after another, e.g. a charset at every length
+    from 1 -> n like hashcat's --increment. All positions of a keyspace come
+    before those of the next, and as the values vary in width they're produced
+    directly as bytes by `candidates` like HybridKeyspace.
+    '''
+
+    def __init__(self, keyspaces):
+        if not len(keyspaces):
+            raise ValueError('At least one keyspace is required')
+        self.keyspaces = list(keyspaces)
+        self.offsets = []
+        offset = 0
+        for keyspace in self.keyspaces:
+            self.offsets.append(offset)
+            offset += keyspace.count
+        self._count = offset
+
+    @classmethod
+    def from_charset(cls, charset, max_length, min_length=1):
+        ''' Every value of `charset` from `min_length` to `max_length` chars long '''
+        if min_length < 1 or max_length < min_length:
+            raise ValueError('Lengths must be 1 <= min_length <= max_length')
+        custom_charset = charset.replace('?', '??')
+        return cls([MaskKeyspace('?1' * length, [custom_charset])
+                    for length in range(min_length, max_length + 1)])
+
+    @property
+    def width(self):
+        return None
+
+    @property
+    def max_width(self):
+        return max(keyspace.width for keyspace in self.keyspaces)
+
+    @property
+    def count(self):
+        return self._count
+
+    def indexes(self, position):
+        ''' The `(keyspace_index, position within keyspace)` pair at `position` '''
+        if not 0 <= position < self.count:
+            raise IndexError('Position is outside of the increment keyspace')
+        index = bisect_right(self.offsets, position) - 1
+        return index, position - self.offsets[index]
+
+    def candidates(self, start=0, stop=None):
+        ''' Yield the values in `start` -> `stop` (exclusive) as bytes '''
+        stop = self.count if stop is None or self.count < stop else stop
+        if stop <= start:
+            return
+        index, offset = self.indexes(start)
+        position = start
+        while position < stop:
+            keyspace = self.keyspaces[index]
+            keyspace_stop = keyspace.count
+            if stop - position < keyspace_stop - offset:
+                keyspace_stop = offset + stop - position
+            yield from KeyspaceBlock(offset, keyspace_stop, keyspace=keyspace)
+            position += keyspace_stop - offset
+            index, offset = index + 1, 0
+
+    def iterate(self, start=0, stop=None):
+        ''' Yield the values in `start` -> `stop` (exclusive) '''
+        for candidate in self.candidates(start, stop):
+            yield candidate.decode()
+
+    def unrank(self, position):
+        ''' Value at integer `position` '''
+        index, offset = self.indexes(position)
+        return self.keyspaces[index].unrank(offset)
+
+    def to_dict(self):
+        ''' JSON serializable spec, see `keyspace_from_dict` '''
+        return {'type': 'increment', 'keyspaces': [keyspace.to_dict() for keyspace in self.keyspaces]}
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.iterate()
+
+    def __str__(self):
+        return ','.join(str(keyspace) for keyspace in self.keyspaces)
+
+
+def keyspace_from_dict(spec):
+    ''' Rebuild a keyspace from its `to_dict` spec '''
+    if spec['type'] == 'mask':
+        return MaskKeyspace.from_dict(spec)
+    if spec['type'] == 'policy':
+        return PolicyKeyspace.from_spec(spec['spec'])
+    if spec['type'] == 'markov':
+        return MarkovKeyspace(spec['model'], spec['length'])
+    if spec['type'] == 'increment':
+        return IncrementKeyspace([keyspace_from_dict(keyspace) for keyspace in spec['keyspaces']])
+    raise ValueError('Cannot rebuild a %s keyspace' % spec['type'])
+
+
+def iter_candidates(start, stop, charset=None, keyspace=None):
+    ''' Yield every value in `start` -> `stop` (exclusive) as bytes '''
+    if isinstance(keyspace, (HybridKeyspace, IncrementKeyspace)):
+        yield from keyspace.candidates(start, stop)
+        return
+    for block in KeyspaceBlock.split(start, stop, charset, keyspace):
+        yield from block
 
 
 if __name__ == '__main__':
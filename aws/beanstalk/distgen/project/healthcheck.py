@@ -1,17 +1,190 @@
+#!/usr/bin/env python3
+'''
+
+> Health check, and a local lookup service for QuerySets (see index_lookup.py)
+
+GET / answers "ok". POST / takes the same QuerySet JSON the bigrainbow CLI
+sends the lambda and answers with the same ResultSet (or a 400 and an
+error), from the sorted indexes in DISTGEN_INDEXES.
+
+Concurrent requests for an algorithm are coalesced: while one batch is
+being probed new requests queue up, and are all probed together as the
+next batch. Recent answers, including misses, are kept in an LRU, and with
+DISTGEN_CRACKED_CACHE cracked hashes persist in a cache (see
+cracked_cache.py) that is checked before the indexes.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import json
+import asyncio
+import argparse
+
+from collections import OrderedDict
+
 import tornado.ioloop
 import tornado.web
 
+from index_lookup import IndexLookup, QueryError
+from cracked_cache import CrackedCache
+
+CACHE_SIZE = 65536  # Answers (one per algorithm and hash) kept in the LRU
+
+
+class LookupService(object):
+    ''' Answers QuerySets from an IndexLookup, one batched probe per algorithm at a time '''
+
+    def __init__(self, lookup, cache_size=CACHE_SIZE):
+        self.lookup = lookup
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self._pending = {}
+        self._probing = set()
+
+    def _cached(self, algorithm, value):
+        key = (algorithm, value)
+        if key not in self.cache:
+            return None
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def _remember(self, algorithm, value, results):
+        self.cache[(algorithm, value)] = results
+        self.cache.move_to_end((algorithm, value))
+        while self.cache_size < len(self.cache):
+            self.cache.popitem(last=False)
+
+    def answer(self, algorithm, hashes):
+        ''' Map each of the base64 `hashes` to its `[(preimage, hash)]`, runs in a worker thread '''
+        answers = {}
+        for value, results in self.lookup.answers(algorithm, hashes).items():
+            answers[value] = [(preimage.decode(errors='replace'), encoded) for preimage, encoded in results]
+        return answers
+
+    async def _probe(self, algorithm):
+        ''' Probe queued batches of `algorithm` until none are left '''
+        loop = asyncio.get_event_loop()
+        try:
+            while algorithm in self._pending:
+                waiters = self._pending.pop(algorithm)
+                hashes = set()
+                for _, wanted in waiters:
+                    hashes.update(wanted)
+                try:
+                    answers = await loop.run_in_executor(None, self.answer, algorithm, hashes)
+                except Exception as error:
+                    for future, _ in waiters:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                for value, results in answers.items():
+                    self._remember(algorithm, value, results)
+                for future, wanted in waiters:
+                    if not future.done():
+                        future.set_result({value: answers[value] for value in wanted})
+        finally:
+            self._probing.discard(algorithm)
+
+    async def query(self, query_set):
+        ''' ResultSet for a QuerySet, raises QueryError like the lambda's errors '''
+        algorithm = query_set.get('algorithm')
+        hashes = [value for value in set(query_set.get('hashes') or []) if isinstance(value, str) and value]
+        if algorithm not in self.lookup.readers:
+            raise QueryError('Unsupported hash algorithm')
+        if not hashes:
+            raise QueryError('No hashes in request')
+        answers, missing = {}, set()
+        for value in hashes:
+            cached = self._cached(algorithm, value)
+            if cached is None:
+                missing.add(value)
+            else:
+                answers[value] = cached
+        if missing:
+            future = asyncio.get_event_loop().create_future()
+            self._pending.setdefault(algorithm, []).append((future, missing))
+            if algorithm not in self._probing:
+                self._probing.add(algorithm)
+                asyncio.ensure_future(self._probe(algorithm))
+            answers.update(await future)
+        results = []
+        for value in hashes:
+            results.extend({'preimage': preimage, 'hash': encoded} for preimage, encoded in answers[value])
+        return {'algorithm': algorithm, 'results': results}
+
+
 class MainHandler(tornado.web.RequestHandler):
-    
+
+    def initialize(self, service):
+        self.service = service
+
     def get(self):
         self.write("ok")
 
-def make_app():
+    def error(self, message):
+        self.set_status(400)
+        self.write({'error': message})
+
+    async def post(self):
+        if not self.request.body:
+            return self.error('no HTTP body')
+        try:
+            query_set = json.loads(self.request.body)
+        except ValueError:
+            return self.error('failed to parse HTTP body')
+        if not isinstance(query_set, dict):
+            return self.error('failed to parse HTTP body')
+        try:
+            result_set = await self.service.query(query_set)
+        except QueryError as error:
+            return self.error(str(error))
+        self.write(result_set)
+
+
+def make_app(service):
     return tornado.web.Application([
-        (r"/", MainHandler),
+        (r"/", MainHandler, dict(service=service)),
     ])
 
+
 if __name__ == "__main__":
-    app = make_app()
-    app.listen(80)
+    parser = argparse.ArgumentParser(
+        description='Health check and local QuerySet lookup service')
+    parser.add_argument('-i',
+        nargs='*',
+        dest='indexes',
+        default=[path for path in os.environ.get('DISTGEN_INDEXES', '').split(os.pathsep) if path],
+        help='directories of sorted indexes to serve (see build_index.py)')
+    parser.add_argument('-p',
+        type=int,
+        dest='port',
+        default=int(os.environ.get('DISTGEN_LOOKUP_PORT') or 80),
+        help='port to listen on')
+    parser.add_argument('-c',
+        type=int,
+        dest='cache_size',
+        default=int(os.environ.get('DISTGEN_CACHE_SIZE') or CACHE_SIZE),
+        help='answers kept in the LRU')
+    parser.add_argument('-C',
+        dest='cracked_cache',
+        default=os.environ.get('DISTGEN_CRACKED_CACHE') or None,
+        help='cracked hash cache log, checked before the indexes')
+    args = parser.parse_args()
+    cracked = CrackedCache(args.cracked_cache) if args.cracked_cache is not None else None
+    app = make_app(LookupService(IndexLookup(args.indexes, cache=cracked), args.cache_size))
+    app.listen(args.port)
     tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+'''
+
+> Answer QuerySets from local sorted indexes (see build_index.py)
+
+Takes the same JSON the big-rainbow lambda does and returns the same
+ResultSet, without a BigQuery query:
+
+    {"algorithm": "md5", "hashes": ["<base64 digest>", ...]}
+    {"algorithm": "md5", "results": [{"preimage": "...", "hash": "<base64>"}, ...]}
+
+Hashes are deduplicated and truncated to the index's digest width like the
+lambda does. Small batches search the memory mapped index for each hash,
+larger batches are sorted and joined with the index in a single forward
+pass, skipping blocks of records that no hash can be in. Hashes an index's
+Bloom filter (if it has one) rules out are dropped before either. With a
+cracked hash cache (see cracked_cache.py) only the hashes it misses are
+looked up at all.
+
+Indexes only hold truncated digests, so a hash that isn't in the tables
+can match a row anyway. When hashes longer than an index's digests are
+submitted, the candidate preimages are re-hashed in one batch and those
+that don't hash to the submitted digest are dropped.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import json
+import argparse
+
+from base64 import b64decode, b64encode
+
+from algorithms import get_algorithm
+from sorted_index import IndexReader, EXTENSION
+from bloom_filter import BloomFilter, filter_path
+from cracked_cache import CrackedCache, decode_hash
+
+SMALL_BATCH = 1024  # Larger batches are merge joined instead of searched
+JOIN_BLOCK = 4096  # Records skipped at a time while merge joining
+
+
+class QueryError(ValueError):
+    ''' The QuerySet cannot be answered, the message is returned as the error '''
+    pass
+
+
+def search(reader, digests):
+    ''' Map each of `digests` found in the index to its preimages, one search per digest '''
+    found = {}
+    for digest in digests:
+        preimages = reader.find(digest)
+        if preimages:
+            found[digest] = preimages
+    return found
+
+
+def merge_join(reader, digests):
+    ''' Same as `search`, but walks the index once in digest order '''
+    found = {}
+    position, count = 0, len(reader)
+    for digest in sorted(digests):
+        # Skip whole blocks that end before this digest
+        while position < count and reader.digest(min(position + JOIN_BLOCK, count) - 1) < digest:
+            position = min(position + JOIN_BLOCK, count)
+        if count <= position:
+            break
+        position = reader.bisect(digest, position, min(position + JOIN_BLOCK, count))
+        while position < count and reader.digest(position) == digest:
+            found.setdefault(digest, []).append(reader.header.preimage_of(reader.record(position)[1]))
+            position += 1
+    return found
+
+
+def verify_results(algo, hashes, results):
+    '''
+    The `results` (`[(preimage, hash)]`) whose preimage hashes to one of the
+    base64 `hashes` it was matched with, every candidate is hashed in one
+    batch. Results only matched with hashes no longer than the index's
+    digests can't be checked and are kept.
+    '''
+    widths = set(len(b64decode(encoded)) for _, encoded in results)
+    submitted = {}
+    for value in hashes:
+        data = decode_hash(value)
+        if data is None:
+            continue
+        for width in widths:
+            if width <= len(data):
+                submitted.setdefault(data[:width], set()).add(data)
+    checks, candidates = [], {}
+    for preimage, encoded in results:
+        truncated = b64decode(encoded)
+        matched = submitted.get(truncated, ())
+        if not matched or any(len(data) <= len(truncated) for data in matched):
+            checks.append(None)
+        else:
+            checks.append(matched)
+            candidates.setdefault(preimage, None)
+    width = algo.hex_length // 2
+    preimages = list(candidates)
+    packed = algo.digest_many(preimages)
+    for index, preimage in enumerate(preimages):
+        candidates[preimage] = bytes(packed[index * width:(index + 1) * width])
+    verified = []
+    for (preimage, encoded), matched in zip(results, checks):
+        if matched is None or any(candidates[preimage][:len(data)] == data for data in matched):
+            verified.append((preimage, encoded))
+    return verified
+
+
+def match_results(algo, hashes, results):
+    '''
+    Map each of the base64 `hashes` to the `results` (`[(preimage, hash)]`)
+    that are its answers. With an `algo` a hash longer than the index's
+    digests only gets the preimages that hash to it (each candidate is
+    hashed once), so hashes that share a prefix don't get each other's.
+    '''
+    candidates = {}
+    for preimage, encoded in results:
+        candidates.setdefault(encoded, []).append(preimage)
+    widths = sorted(set(len(b64decode(encoded)) for encoded in candidates))
+    digests, answers = {}, {}
+    for value in hashes:
+        answers[value] = []
+        data = decode_hash(value)
+        if data is None:
+            continue
+        for width in widths:
+            if len(data) < width:
+                continue
+            encoded = b64encode(data[:width]).decode()
+            for preimage in candidates.get(encoded, []):
+                if algo is not None and width < len(data):
+                    if preimage not in digests:
+                        digests[preimage] = algo._hash(preimage)
+                    if digests[preimage][:len(data)] != data:
+                        continue
+                answers[value].append((preimage, encoded))
+    return answers
+
+
+class IndexLookup(object):
+    ''' Every index in a set of directories, e.g. the indexes of each shard '''
+
+    def __init__(self, dirpaths, small_batch=SMALL_BATCH, cache=None, verify=True):
+        self.small_batch = small_batch
+        self.cache = cache
+        self.verify = verify
+        self.readers = {}
+        self.filters = {}
+        for dirpath in dirpaths:
+            for name in sorted(os.listdir(dirpath)):
+                if name.endswith(EXTENSION):
+                    fpath = os.path.join(dirpath, name)
+                    reader = IndexReader(fpath)
+                    self.readers.setdefault(reader.header.algorithm, []).append(reader)
+                    if os.path.exists(filter_path(fpath)):
+                        self.filters[reader] = BloomFilter.load(filter_path(fpath))
+
+    @property
+    def algorithms(self):
+        return sorted(self.readers)
+
+    @staticmethod
+    def digests(hashes, width):
+        ''' Map the unique base64 `hashes` truncated to `width` bytes to how results encode them '''
+        digests = {}
+        for value in hashes:
+            data = decode_hash(value)
+            if data is not None and width <= len(data):
+                digests[data[:width]] = b64encode(data[:width]).decode()
+        return digests
+
+    def lookup(self, algorithm, hashes):
+        '''
+        `[(preimage, hash)]` for each of the base64 `hashes` found in
+        `algorithm`'s indexes, records in more than one index are returned once.
+        With a cache, cached hashes are answered from it and only the rest
+        are looked up, then whatever they cracked is cached. With `verify`
+        false positives are dropped (see `verify_results`).
+        '''
+        if algorithm not in self.readers:
+            raise QueryError('Unsupported hash algorithm')
+        readers = self.readers[algorithm]
+        results, seen = [], set()
+        if self.cache is not None:
+            missing = []
+            for value in hashes:
+                digest = decode_hash(value)
+                preimage = self.cache.get(algorithm, digest) if digest is not None else None
+                if preimage is None:
+                    missing.append(value)
+                    continue
+                for reader in readers:
+                    for encoded in self.digests([value], reader.header.digest_width).values():
+                        if (preimage, encoded) not in seen:
+                            seen.add((preimage, encoded))
+                            results.append((preimage, encoded))
+            hashes = missing
+        found_results = []
+        for reader in readers:
+            digests = self.digests(hashes, reader.header.digest_width)
+            if reader in self.filters:
+                bloom = self.filters[reader]
+                digests = {digest: value for digest, value in digests.items() if digest in bloom}
+            if len(digests) <= self.small_batch:
+                found = search(reader, digests)
+            else:
+                found = merge_join(reader, digests)
+            for digest, preimages in found.items():
+                for preimage in preimages:
+                    if (preimage, digests[digest]) not in seen:
+                        seen.add((preimage, digests[digest]))
+                        found_results.append((preimage, digests[digest]))
+        if self.verify and found_results and get_algorithm(algorithm) is not None:
+            found_results = verify_results(get_algorithm(algorithm), hashes, found_results)
+        if self.cache is not None and found_results:
+            self.learn(algorithm, hashes, found_results)
+        return results + found_results
+
+    def answers(self, algorithm, hashes):
+        ''' Map each of the base64 `hashes` to its own `[(preimage, hash)]`, see `lookup` '''
+        results = self.lookup(algorithm, hashes)
+        algo = get_algorithm(algorithm) if self.verify else None
+        return match_results(algo, hashes, results)
+
+    def learn(self, algorithm, hashes, results):
+        ''' Cache the full digests of `hashes` that one of the table `results` cracks '''
+        candidates = {}
+        for preimage, encoded in results:
+            candidates.setdefault(encoded, []).append(preimage)
+        widths = set(reader.header.digest_width for reader in self.readers[algorithm])
+        for value in hashes:
+            preimages = []
+            for width in widths:
+                for encoded in self.digests([value], width).values():
+                    preimages.extend(candidates.get(encoded, []))
+            if preimages:
+                self.cache.learn(algorithm, [decode_hash(value)], preimages)
+
+    def query(self, query_set):
+        ''' ResultSet for a QuerySet (both dicts), raises QueryError like the lambda's errors '''
+        algorithm = query_set.get('algorithm')
+        hashes = [value for value in set(query_set.get('hashes') or []) if value]
+        if not hashes:
+            raise QueryError('No hashes in request')
+        results = self.lookup(algorithm, hashes)
+        return {
+            'algorithm': algorithm,
+            'results': [{'preimage': preimage.decode(errors='replace'), 'hash': value}
+                        for preimage, value in results],
+        }
+
+    def close(self):
+        for readers in self.readers.values():
+            for reader in readers:
+                reader.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def main(args):
+    if args.algorithm is not None:
+        with open(args.file, 'r') if args.file is not None else sys.stdin as fp:
+            query_set = {'algorithm': args.algorithm, 'hashes': [line.strip() for line in fp]}
+    else:
+        with open(args.file, 'r') if args.file is not None else sys.stdin as fp:
+            query_set = json.load(fp)
+    cache = CrackedCache(args.cache) if args.cache is not None else None
+    lookup = IndexLookup(args.indexes, args.small_batch, cache, args.verify)
+    try:
+        sys.stdout.write(json.dumps(lookup.query(query_set)) + '\n')
+    except QueryError as error:
+        sys.stdout.write(json.dumps({'error': str(error)}) + '\n')
+        sys.exit(1)
+    finally:
+        lookup.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Answer a QuerySet from local sorted indexes')
+    parser.add_argument('-i', '--indexes',
+        nargs='+',
+        dest='indexes',
+        help='directories of sorted indexes (see build_index.py)',
+        required=True)
+    parser.add_argument('-f', '--file',
+        dest='file',
+        default=None,
+        help='read the QuerySet JSON from a file instead of stdin')
+    parser.add_argument('-a', '--algorithm',
+        dest='algorithm',
+        default=None,
+        help='read base64 hashes, one per line, for this algorithm instead of a QuerySet')
+    parser.add_argument('-C', '--cache',
+        dest='cache',
+        default=None,
+        help='cracked hash cache (see cracked_cache.py), checked first and updated with new results')
+    parser.add_argument('--small-batch',
+        type=int,
+        dest='small_batch',
+        default=SMALL_BATCH,
+        help='batches larger than this are merge joined (default: %d)' % SMALL_BATCH)
+    parser.add_argument('--no-verify',
+        action='store_false',
+        dest='verify',
+        default=True,
+        help="don't re-hash candidates to drop matches on the truncated digest only")
+    main(parser.parse_args())
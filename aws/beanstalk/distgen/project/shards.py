@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+'''
+
+> Route records into 2^k shards by the leading bits of one algorithm's digest
+
+Records with the same digest prefix always land in the same shard, so
+sorting, merging and lookups can work on one small shard at a time. Shards
+are named by their prefix in hex (e.g. "shard_3f"), each has its own writer
+(JSON lines, binary or columnar) that is only opened once it has records.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+from table_format import batch_ranks
+
+MAX_SHARD_BITS = 16
+BUFFER_RECORDS = 1024  # Records buffered per shard before they're written
+
+
+def shard_name(index, bits):
+    ''' Directory name of shard `index` of 2^`bits` '''
+    return 'shard_%0*x' % ((bits + 3) // 4, index)
+
+
+def shard_of(digest, bits):
+    ''' Shard index of a (truncated) digest '''
+    if not bits:
+        return 0
+    return int.from_bytes(bytes(digest[:2]).ljust(2, b'\x00'), 'big') >> (16 - bits)
+
+
+class ShardedWriter(object):
+    '''
+    Splits each batch by the leading `bits` of `algorithm`'s digests and
+    buffers the rows of each shard, `open_shard(index)` returns the writer of
+    a shard (anything with `write_batch` and `close`)
+    '''
+
+    def __init__(self, open_shard, algorithm, digest_widths, bits, buffer_records=BUFFER_RECORDS):
+        if not 0 <= bits <= MAX_SHARD_BITS:
+            raise ValueError('Shard bits must be 0 - %d' % MAX_SHARD_BITS)
+        if algorithm not in digest_widths:
+            raise ValueError('Cannot shard by %s, it is not being generated' % algorithm)
+        if digest_widths[algorithm] * 8 < bits:
+            raise ValueError('Shard bits must not exceed the digest width')
+        self.open_shard = open_shard
+        self.algorithm = algorithm
+        self.digest_widths = digest_widths
+        self.bits = bits
+        self.buffer_records = buffer_records
+        self.writers = {}
+        self._buffers = {}
+
+    def shards(self, digests):
+        ''' Shard index of every row of a batch '''
+        width = self.digest_widths[self.algorithm]
+        column = digests[self.algorithm]
+        return [shard_of(column[offset:offset + width], self.bits)
+                for offset in range(0, len(column), width)]
+
+    def write_batch(self, preimages, digests, start=None):
+        ''' Route a batch, `start` is the rank of the first preimage (see TableHeader.pack) '''
+        ranks = batch_ranks(start, len(preimages)) if start is not None else None
+        rows = {}
+        for index, shard in enumerate(self.shards(digests)):
+            rows.setdefault(shard, []).append(index)
+        for shard, indexes in rows.items():
+            if shard not in self._buffers:
+                self._buffers[shard] = ([], [], {algorithm: [] for algorithm in self.digest_widths})
+            buffered_preimages, buffered_ranks, buffered_digests = self._buffers[shard]
+            buffered_preimages.extend(preimages[index] for index in indexes)
+            if ranks is not None:
+                buffered_ranks.extend(ranks[index] for index in indexes)
+            for algorithm, width in self.digest_widths.items():
+                column = digests[algorithm]
+                buffered_digests[algorithm].extend(column[index * width:(index + 1) * width]
+                                                   for index in indexes)
+            if self.buffer_records <= len(buffered_preimages):
+                self.flush(shard)
+
+    def flush(self, shard=None):
+        ''' Write the buffered rows of a shard, or of every shard '''
+        for index in ([shard] if shard is not None else list(self._buffers)):
+            preimages, ranks, digests = self._buffers.pop(index, ([], [], {}))
+            if not preimages:
+                continue
+            if index not in self.writers:
+                self.writers[index] = self.open_shard(index)
+            packed = {algorithm: b''.join(column) for algorithm, column in digests.items()}
+            self.writers[index].write_batch(preimages, packed, ranks if ranks else None)
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+'''
+
+> Sorted per-algorithm indexes, fixed width records that can be binary searched
+
+An index holds one algorithm's (truncated) digests, sorted, each with the
+preimage it came from (see build_index.py to build them):
+
+    magic       4 bytes, "BRI1"
+    length      uint32 (little endian), length of the JSON header
+    header      JSON, algorithm, digest width, preimage mode, charset ...
+                padded with spaces so the records start 8 byte aligned
+
+Each record is the digest then the preimage, stored the same way as a
+binary table's (see table_format.py), either inline (a length byte and the
+preimage padded to `preimage_width`) or as its rank in the keyspace. Record
+`n` is at the records' offset plus `n` times the record width, so readers
+memory map the file and binary search it in place.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+
+from table_format import TableHeader, TableFormatError, INLINE, RANK, BATCH_RECORDS
+
+MAGIC = b'BRI1'
+VERSION = 1
+ALIGNMENT = 8
+EXTENSION = '.idx'
+INDEX_MODES = (INLINE, RANK)
+SEARCH_MIN = 8  # Records left when searching switches to a plain binary search
+
+
+class IndexHeader(object):
+    ''' Layout of an index's records, plus the keyspace its ranks are in '''
+
+    def __init__(self, algorithm, digest_width, preimage_width=1, truncate=None,
+                 charset=None, keyspace=None, preimage=INLINE, chain=None):
+        if preimage not in INDEX_MODES:
+            raise ValueError('Index preimage mode must be one of %s' % ', '.join(INDEX_MODES))
+        if digest_width <= 0:
+            raise ValueError('Digest width must be positive')
+        self.algorithm = algorithm
+        self.digest_width = digest_width
+        self.truncate = truncate
+        # Chain length and table number of rainbow chain tables (see rainbow_chains.py)
+        self.chain = chain
+        # A table without digests packs and unpacks just the preimage field
+        self.preimages = TableHeader([], [], preimage_width, charset=charset, keyspace=keyspace,
+                                     preimage=preimage)
+
+    @property
+    def preimage(self):
+        return self.preimages.preimage
+
+    @property
+    def preimage_width(self):
+        return self.preimages.preimage_width
+
+    @property
+    def record_width(self):
+        return self.digest_width + self.preimages.record_width
+
+    def with_preimage_width(self, preimage_width):
+        ''' Copy of the header with inline preimages padded to `preimage_width` '''
+        return IndexHeader(self.algorithm, self.digest_width, preimage_width, self.truncate,
+                           self.preimages.charset, self.preimages.keyspace, self.preimage, self.chain)
+
+    def pack(self, records):
+        ''' Records for a list of `(digest, preimage or rank)` '''
+        if self.preimage == INLINE:
+            fields = self.preimages.pack([value for _, value in records], {})
+        else:
+            fields = self.preimages.pack([None] * len(records), {}, [value for _, value in records])
+        width = self.preimages.record_width
+        return b''.join([digest + fields[index * width:(index + 1) * width]
+                         for index, (digest, _) in enumerate(records)])
+
+    def unpack(self, data):
+        ''' The inverse of `pack`, ranks are returned as ints (see `preimage_of`) '''
+        if len(data) % self.record_width:
+            raise TableFormatError('Truncated record')
+        digests = [bytes(data[offset:offset + self.digest_width])
+                   for offset in range(0, len(data), self.record_width)]
+        fields = b''.join([data[offset + self.digest_width:offset + self.record_width]
+                           for offset in range(0, len(data), self.record_width)])
+        values, _ = self.preimages.unpack(fields)
+        return list(zip(digests, values))
+
+    def preimage_of(self, value):
+        return self.preimages.preimage_of(value)
+
+    def to_dict(self):
+        return {
+            'version': VERSION,
+            'algorithm': self.algorithm,
+            'digest_width': self.digest_width,
+            'preimage_width': self.preimage_width,
+            'truncate': self.truncate,
+            'charset': self.preimages.charset,
+            'keyspace': self.preimages.keyspace,
+            'preimage': self.preimage,
+            'chain': self.chain,
+        }
+
+    def to_bytes(self):
+        header = json.dumps(self.to_dict()).encode()
+        padding = -(len(MAGIC) + 4 + len(header)) % ALIGNMENT
+        header += b' ' * padding
+        return MAGIC + struct.pack('<I', len(header)) + header
+
+    @classmethod
+    def read(cls, fp):
+        ''' Read the header from the start of an index, leaves `fp` at the first record '''
+        prefix = fp.read(len(MAGIC) + 4)
+        if len(prefix) != len(MAGIC) + 4 or prefix[:len(MAGIC)] != MAGIC:
+            raise TableFormatError('Not a sorted index')
+        length = struct.unpack('<I', prefix[len(MAGIC):])[0]
+        return cls.from_dict(json.loads(fp.read(length).decode()))
+
+    @classmethod
+    def from_dict(cls, header):
+        ''' The inverse of `to_dict` '''
+        if header.get('version') != VERSION:
+            raise TableFormatError('Unsupported index version %r' % header.get('version'))
+        return cls(header['algorithm'], header['digest_width'], header.get('preimage_width', 1),
+                   header.get('truncate'), header.get('charset'), header.get('keyspace'),
+                   header.get('preimage', INLINE), header.get('chain'))
+
+
+class IndexWriter(object):
+    ''' Writes a header then records, which must already be in digest order '''
+
+    def __init__(self, fpath, header):
+        self.path = fpath
+        self.header = header
+        self.fp = open(fpath, 'wb')
+        self.fp.write(header.to_bytes())
+
+    def write(self, records):
+        ''' Write a list of `(digest, preimage or rank)` '''
+        if records:
+            self.fp.write(self.header.pack(records))
+
+    def write_packed(self, data):
+        ''' Write records that are already packed with this header '''
+        self.fp.write(data)
+
+    def close(self):
+        self.fp.close()
+
+
+class IndexReader(object):
+    ''' Memory maps an index, records are read and searched in place '''
+
+    def __init__(self, fpath):
+        self.path = fpath
+        self.fp = open(fpath, 'rb')
+        self.header = IndexHeader.read(self.fp)
+        self.data_offset = self.fp.tell()
+        size = os.fstat(self.fp.fileno()).st_size
+        if (size - self.data_offset) % self.header.record_width:
+            raise TableFormatError('Truncated record')
+        self.count = (size - self.data_offset) // self.header.record_width
+        # Empty files cannot be mapped, and have nothing to search anyway
+        self.data = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b''
+
+    def __len__(self):
+        return self.count
+
+    def digest(self, index):
+        offset = self.data_offset + index * self.header.record_width
+        return self.data[offset:offset + self.header.digest_width]
+
+    def record(self, index):
+        ''' `(digest, preimage or rank)` of record `index` '''
+        offset = self.data_offset + index * self.header.record_width
+        return self.header.unpack(self.data[offset:offset + self.header.record_width])[0]
+
+    def bisect(self, digest, lo=0, hi=None):
+        ''' Index of the first record whose digest is not less than `digest` '''
+        digest = bytes(digest[:self.header.digest_width])
+        hi = self.count if hi is None else hi
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self.digest(middle) < digest:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def search(self, digest, lo=0, hi=None):
+        '''
+        Same as `bisect`, but digests are uniformly distributed so it mostly
+        probes where the digest should be, alternating with halving to bound
+        the worst case
+        '''
+        digest = bytes(digest[:self.header.digest_width])
+        hi = self.count if hi is None else hi
+        target = int.from_bytes(digest, 'big')
+        # Every digest in lo -> hi is between low and high
+        low, high = 0, 1 << (8 * len(digest))
+        interpolate = True
+        while SEARCH_MIN < hi - lo:
+            if interpolate and low < high:
+                probe = lo + ((target - low) * (hi - lo)) // (high - low)
+                probe = min(max(probe, lo), hi - 1)
+            else:
+                probe = (lo + hi) // 2
+            interpolate = not interpolate
+            key = int.from_bytes(self.digest(probe), 'big')
+            if key < target:
+                lo, low = probe + 1, key
+            else:
+                hi, high = probe, key
+        return self.bisect(digest, lo, hi)
+
+    def find(self, digest):
+        ''' Every preimage (bytes) with this (truncated) digest '''
+        digest = bytes(digest[:self.header.digest_width])
+        index = self.search(digest)
+        preimages = []
+        while index < self.count and self.digest(index) == digest:
+            preimages.append(self.header.preimage_of(self.record(index)[1]))
+            index += 1
+        return preimages
+
+    def batches(self, count=BATCH_RECORDS):
+        ''' Yield the packed records, up to `count` at a time '''
+        width = self.header.record_width
+        for start in range(0, self.count, count):
+            offset = self.data_offset + start * width
+            yield self.data[offset:offset + min(count, self.count - start) * width]
+
+    def __iter__(self):
+        ''' Yield `(digest, preimage or rank)` in order '''
+        for data in self.batches():
+            for record in self.header.unpack(data):
+                yield record
+
+    def close(self):
+        if self.count:
+            self.data.close()
+        self.fp.close()
+
+
+def index_path(dirpath, algorithm):
+    ''' Path of `algorithm`'s index in `dirpath` '''
+    return os.path.join(dirpath, algorithm + EXTENSION)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Search sorted indexes for hex encoded digests')
+    parser.add_argument('index',
+        help='sorted index file (see build_index.py)')
+    parser.add_argument('digests',
+        nargs='*',
+        help='hex encoded digests, full or truncated')
+    parser.add_argument('-H', '--header',
+        dest='show_header',
+        action='store_true',
+        help='print the header and record count instead')
+    args = parser.parse_args()
+    reader = IndexReader(args.index)
+    try:
+        if args.show_header:
+            sys.stdout.write(json.dumps(dict(reader.header.to_dict(), count=len(reader))) + '\n')
+        for digest in args.digests:
+            for preimage in reader.find(bytes.fromhex(digest)):
+                sys.stdout.write('%s:%s\n' % (digest, preimage.decode(errors='replace')))
+    finally:
+        reader.close()
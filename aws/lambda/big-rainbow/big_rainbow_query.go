@@ -18,6 +18,7 @@ package main
 import (
 	"context"
 	"fmt"
+	"regexp"
 	"strings"
 
 	"cloud.google.com/go/bigquery"
@@ -65,6 +66,7 @@ var (
 		"sha3_512":              true,
 		"ripemd160":             true,
 		"lm":                    true,
+		"lm_half":               true,
 		"ntlm":                  true,
 		"mysql323":              true,
 		"mysql41":               true,
@@ -77,12 +79,15 @@ var (
 		"postgres_md5_root":     true,
 		"whirlpool":             true,
 	}
+
+	// Salted algorithms have a column per user, "<algorithm>_<user>"
+	saltedAlgorithm = regexp.MustCompile(`^(oracle10g|msdcc|msdcc2|postgres_md5)_[A-Za-z0-9_]{1,64}$`)
 )
 
 // IsSupportedAlgorithm - Bool
 func IsSupportedAlgorithm(algorithm string) bool {
 	_, ok := supportedAlgorithms[algorithm]
-	return ok
+	return ok || saltedAlgorithm.MatchString(algorithm)
 }
 
 // It's up to the caller to make sure these parameters are legit, table is pulled
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+'''
+
+> Build sorted per-algorithm indexes from generated tables (see sorted_index.py)
+
+Reads the JSON lines or binary tables written by multigen.py, rainbow_hash.py
+and distgen, and sorts each algorithm's `digest -> preimage` records with an
+external merge sort so memory use stays bounded however big the tables are:
+
+    1. The inputs are split into ranges and workers turn each range into
+       sorted runs, each no larger than its share of `--memory`
+    2. The runs of each algorithm are k-way merged (in several passes if
+       there are too many to open at once) into `<algorithm>.idx`
+
+Indexes store inline preimages, or with `--preimage rank` the ranks from
+binary rank/implicit tables that were all generated from the same keyspace.
+Duplicate records are dropped during the merge. Each index also gets a
+Bloom filter (see bloom_filter.py) sized for `--fp-rate` false positives.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import json
+import heapq
+import shutil
+import argparse
+import tempfile
+import multiprocessing as mp
+
+from base64 import b64decode
+
+from table_format import MAGIC, MAX_PREIMAGE_WIDTH, INLINE, RANK, TableHeader, TableReader
+from sorted_index import IndexHeader, IndexWriter, IndexReader, INDEX_MODES, index_path
+from columnar import HEADER
+from bloom_filter import FP_RATE, build_filter, filter_path
+from line_ranges import split_lines
+
+JSON, BINARY = 'json', 'binary'
+MEMORY = 512  # MiB shared between the run generating workers
+RECORD_OVERHEAD = 160  # Rough bytes of memory per buffered record
+MIN_RUN_RECORDS = 4096
+MAX_FAN_IN = 64  # Runs merged at once
+MERGE_BATCH = 4096  # Records written per batch while merging
+
+
+def table_kind(fpath):
+    ''' BINARY for binary tables, otherwise the file is read as JSON lines '''
+    with open(fpath, 'rb') as fp:
+        return BINARY if fp.read(len(MAGIC)) == MAGIC else JSON
+
+
+def find_tables(paths):
+    ''' Every table in `paths`, directories (e.g. shards) are searched for .json and .bin files '''
+    tables = []
+    for fpath in paths:
+        if not os.path.isdir(fpath):
+            tables.append(fpath)
+            continue
+        for root, _, names in os.walk(fpath):
+            for name in sorted(names):
+                if name != HEADER and os.path.splitext(name)[1] in ('.json', '.bin'):
+                    tables.append(os.path.join(root, name))
+    return tables
+
+
+def describe(fpath):
+    '''
+    `(kind, header)` of a table, JSON lines don't have a header so one is
+    made from the first line (None if the file is empty)
+    '''
+    kind = table_kind(fpath)
+    if kind == BINARY:
+        reader = TableReader.open(fpath)
+        reader.close()
+        return kind, reader.header
+    with open(fpath, 'r') as fp:
+        for line in fp:
+            if line.strip():
+                entry = json.loads(line)
+                algorithms = [key for key in entry if key != 'preimage']
+                widths = [len(b64decode(entry[key])) for key in algorithms]
+                return kind, TableHeader(algorithms, widths, MAX_PREIMAGE_WIDTH)
+    return kind, None
+
+
+def split_table(fpath, kind, parts):
+    ''' Split a table into at most `parts` `(start, stop)` ranges, bytes for JSON and records for binary '''
+    if kind == JSON:
+        return split_lines(fpath, parts)
+    reader = TableReader.open(fpath)
+    count = len(reader)
+    reader.close()
+    offsets = sorted(set((count * index) // parts for index in range(parts + 1)))
+    return list(zip(offsets, offsets[1:]))
+
+
+def read_json(fpath, start, stop, algorithms):
+    ''' Yield `(preimage, {algorithm: digest})` for the lines in `start` -> `stop` '''
+    with open(fpath, 'rb') as fp:
+        fp.seek(start)
+        position = start
+        while position < stop:
+            line = fp.readline()
+            if not line:
+                break
+            position += len(line)
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            digests = {}
+            for algorithm in algorithms:
+                if algorithm in entry:
+                    digests[algorithm] = b64decode(entry[algorithm])
+            yield entry['preimage'].encode(), digests
+
+
+def read_binary(fpath, start, stop, algorithms, preimage):
+    ''' Yield `(preimage or rank, {algorithm: digest})` for records `start` -> `stop` '''
+    reader = TableReader.open(fpath)
+    try:
+        header = reader.header
+        wanted = [(algorithm, width) for algorithm, width in zip(header.algorithms, header.digest_widths)
+                  if algorithm in algorithms]
+        for preimages, digests in reader.batches(start=start, stop=stop):
+            for index, value in enumerate(preimages):
+                if preimage == INLINE:
+                    value = header.preimage_of(value)
+                yield value, {algorithm: bytes(digests[algorithm][index * width:(index + 1) * width])
+                              for algorithm, width in wanted}
+    finally:
+        reader.close()
+
+
+def write_runs(buffers, templates, run_dir):
+    ''' Sort each algorithm's buffered records into a run file, returns `[(algorithm, path)]` '''
+    runs = []
+    for algorithm, records in buffers.items():
+        if not records:
+            continue
+        records.sort()
+        header = IndexHeader.from_dict(templates[algorithm])
+        if header.preimage == INLINE:
+            header = header.with_preimage_width(max(1, max(len(value) for _, value in records)))
+        fd, fpath = tempfile.mkstemp(prefix='run_', suffix='.idx', dir=run_dir)
+        os.close(fd)
+        writer = IndexWriter(fpath, header)
+        writer.write(records)
+        writer.close()
+        runs.append((algorithm, fpath))
+        del records[:]
+    return runs
+
+
+def generate_runs(task):
+    ''' Worker process, sorts one range of a table into runs of at most `run_records` records '''
+    fpath, kind, start, stop, templates, preimage, run_dir, run_records = task
+    if kind == JSON:
+        records = read_json(fpath, start, stop, templates)
+    else:
+        records = read_binary(fpath, start, stop, templates, preimage)
+    buffers = {algorithm: [] for algorithm in templates}
+    runs, buffered, skipped = [], 0, 0
+    for value, digests in records:
+        if preimage == INLINE and MAX_PREIMAGE_WIDTH < len(value):
+            skipped += 1
+            continue
+        for algorithm, digest in digests.items():
+            buffers[algorithm].append((digest, value))
+        buffered += len(digests)
+        if run_records <= buffered:
+            runs.extend(write_runs(buffers, templates, run_dir))
+            buffered = 0
+    runs.extend(write_runs(buffers, templates, run_dir))
+    return runs, skipped
+
+
+def merge_runs(run_paths, fpath):
+    ''' k-way merge sorted runs into one index at `fpath`, dropping duplicate records '''
+    readers = [IndexReader(run_path) for run_path in run_paths]
+    try:
+        header = readers[0].header
+        if header.preimage == INLINE:
+            header = header.with_preimage_width(max(reader.header.preimage_width for reader in readers))
+        writer = IndexWriter(fpath, header)
+        batch, previous = [], None
+        for record in heapq.merge(*readers):
+            if record == previous:
+                continue
+            batch.append(record)
+            previous = record
+            if MERGE_BATCH <= len(batch):
+                writer.write(batch)
+                batch = []
+        writer.write(batch)
+        writer.close()
+    finally:
+        for reader in readers:
+            reader.close()
+    return fpath
+
+
+def merge_all(run_paths, fpath, run_dir, fan_in=MAX_FAN_IN):
+    ''' Merge sorted runs into one index at `fpath`, at most `fan_in` at a time, removing the runs '''
+    fan_in = max(2, fan_in)
+    while fan_in < len(run_paths):
+        merged = []
+        for offset in range(0, len(run_paths), fan_in):
+            group = run_paths[offset:offset + fan_in]
+            fd, run_path = tempfile.mkstemp(prefix='run_', suffix='.idx', dir=run_dir)
+            os.close(fd)
+            merged.append(merge_runs(group, run_path))
+            for path in group:
+                os.remove(path)
+        run_paths = merged
+    merge_runs(run_paths, fpath)
+    for path in run_paths:
+        os.remove(path)
+    return fpath
+
+
+def merge_algorithm(task):
+    '''
+    Worker process, merges every run of one algorithm then builds the index's
+    filter unless `fp_rate` is 0
+    '''
+    algorithm, run_paths, output, run_dir, fan_in, fp_rate = task
+    fpath = merge_all(run_paths, index_path(output, algorithm), run_dir, fan_in)
+    if fp_rate:
+        reader = IndexReader(fpath)
+        try:
+            build_filter(reader, fp_rate).save(filter_path(fpath))
+        finally:
+            reader.close()
+    return algorithm, fpath
+
+
+def index_templates(tables, selected, preimage):
+    ''' Header dict of each algorithm's index, checking that the tables agree on it '''
+    templates = {}
+    for fpath, (kind, header) in tables.items():
+        if preimage == RANK and (kind != BINARY or header.preimage == INLINE):
+            raise ValueError('%s has no ranks, only binary rank or implicit tables do' % fpath)
+        for algorithm, width in zip(header.algorithms, header.digest_widths):
+            if selected and algorithm not in selected:
+                continue
+            template = IndexHeader(algorithm, width, 1, header.truncate,
+                                   header.charset if preimage == RANK else None,
+                                   header.keyspace if preimage == RANK else None, preimage).to_dict()
+            # JSON lines don't record their truncation, binary tables do
+            current = templates.setdefault(algorithm, template)
+            if current['truncate'] is None:
+                current['truncate'] = template['truncate']
+            if dict(current, truncate=None) != dict(template, truncate=None):
+                raise ValueError('%s does not match the other tables of %s (digest width or keyspace)'
+                                 % (fpath, algorithm))
+    return templates
+
+
+def main(args):
+    if args.jobs < 1:
+        sys.stderr.write('Need at least one worker, see -j\n')
+        sys.exit(1)
+    if not 0 <= args.fp_rate < 1:
+        sys.stderr.write('False positive rate must be 0 (no filter) or between 0 and 1\n')
+        sys.exit(1)
+    if args.preimage not in INDEX_MODES:
+        sys.stderr.write('Index preimages must be one of %s\n' % ', '.join(INDEX_MODES))
+        sys.exit(1)
+    tables = {}
+    for fpath in find_tables(args.tables):
+        kind, header = describe(fpath)
+        if header is not None:
+            tables[fpath] = (kind, header)
+    try:
+        templates = index_templates(tables, args.algorithms, args.preimage)
+    except ValueError as error:
+        sys.stderr.write('Cannot build index: %s\n' % error)
+        sys.exit(1)
+    if not templates:
+        sys.stderr.write('No tables with the selected algorithms\n')
+        sys.exit(1)
+    os.makedirs(args.output, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix='build_index_', dir=args.temp or args.output)
+    run_records = max(MIN_RUN_RECORDS, (args.memory * 1024 ** 2) // args.jobs // RECORD_OVERHEAD)
+
+    tasks = []
+    for fpath, (kind, header) in tables.items():
+        wanted = {algorithm: templates[algorithm] for algorithm in header.algorithms
+                  if algorithm in templates}
+        for start, stop in split_table(fpath, kind, args.jobs):
+            tasks.append((fpath, kind, start, stop, wanted, args.preimage, run_dir, run_records))
+    print('Sorting %d table(s) in %d part(s) with %d workers ...' % (len(tables), len(tasks), args.jobs))
+    runs, skipped = {}, 0
+    pool = mp.Pool(args.jobs)
+    try:
+        for task_runs, task_skipped in pool.imap_unordered(generate_runs, tasks):
+            skipped += task_skipped
+            for algorithm, run_path in task_runs:
+                runs.setdefault(algorithm, []).append(run_path)
+        if skipped:
+            sys.stderr.write('Skipped %d preimages longer than %d bytes\n' % (skipped, MAX_PREIMAGE_WIDTH))
+        print('Merging %d run(s) ...' % sum(len(run_paths) for run_paths in runs.values()))
+        merges = [(algorithm, sorted(run_paths), args.output, run_dir, args.fan_in, args.fp_rate)
+                  for algorithm, run_paths in runs.items()]
+        for algorithm, fpath in pool.imap_unordered(merge_algorithm, merges):
+            print('%s -> %s' % (algorithm, fpath))
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build sorted per-algorithm indexes from generated tables')
+    parser.add_argument('tables',
+        nargs='+',
+        help='JSON lines or binary table files, or directories of them')
+    parser.add_argument('-o', '--output',
+        dest='output',
+        default=os.getcwd(),
+        help='output directory to write the indexes to')
+    parser.add_argument('-a', '--algorithms',
+        nargs='*',
+        dest='algorithms',
+        default=[],
+        help='only index these algorithms (default: every algorithm in the tables)')
+    parser.add_argument('-p', '--preimage',
+        dest='preimage',
+        default=INLINE,
+        help='store preimages %s, rank needs binary rank/implicit tables' % ' or '.join(INDEX_MODES))
+    parser.add_argument('-m', '--memory',
+        type=int,
+        dest='memory',
+        default=MEMORY,
+        help='memory (MiB) used for sorting runs (default: %d)' % MEMORY)
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        dest='jobs',
+        default=mp.cpu_count(),
+        help='worker processes (default: %d)' % mp.cpu_count())
+    parser.add_argument('--fan-in',
+        type=int,
+        dest='fan_in',
+        default=MAX_FAN_IN,
+        help='runs merged at once (default: %d)' % MAX_FAN_IN)
+    parser.add_argument('-F', '--fp-rate',
+        type=float,
+        dest='fp_rate',
+        default=FP_RATE,
+        help='false positive rate of the Bloom filter written with each index, 0 for none (default: %s)'
+             % FP_RATE)
+    parser.add_argument('-d', '--temp',
+        dest='temp',
+        default=None,
+        help='directory for the sorted runs (default: the output directory)')
+    main(parser.parse_args())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+
+> Look up hashes in rainbow chain tables (see rainbow_chains.py)
+
+For each table and each step, from the last step back, the digest is
+assumed to be at that step and walked to the end of its chain. Chains with
+that end rank are regenerated from their start to find the preimage, or
+to find out the end rank matched by chance (a false alarm). Hashes are
+spread over worker processes, each looks up a hash in every table.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import sys
+import json
+import argparse
+import multiprocessing as mp
+
+from binascii import unhexlify, Error as BinasciiError
+
+from sorted_index import IndexReader
+from rainbow_chains import Chains
+
+_tables = None
+
+
+def open_tables(fpaths):
+    ''' `[(reader, chains)]` for each chain table '''
+    tables = []
+    for fpath in fpaths:
+        reader = IndexReader(fpath)
+        tables.append((reader, Chains(reader.header)))
+    return tables
+
+
+def find(tables, digest):
+    ''' Preimage (bytes) of a full `digest`, or None '''
+    for reader, chains in tables:
+        for step in reversed(range(chains.length)):
+            end = chains.encode(chains.end_of(digest, step))
+            index = reader.bisect(end)
+            while index < len(reader) and reader.digest(index) == end:
+                preimage = chains.preimage_in(reader.record(index)[1], digest, step)
+                if preimage is not None:
+                    return preimage
+                index += 1
+    return None
+
+
+def _init_worker(fpaths):
+    global _tables
+    _tables = open_tables(fpaths)
+
+
+def _find(item):
+    value, digest = item
+    return value, find(_tables, digest)
+
+
+def parse_hashes(hashes, width):
+    ''' Map each hex hash to its digest, hashes that aren't `width` bytes are skipped '''
+    digests = {}
+    for value in hashes:
+        try:
+            digest = unhexlify(value.strip())
+        except (BinasciiError, ValueError):
+            continue
+        if len(digest) == width:
+            digests[value.strip()] = digest
+    return digests
+
+
+def main(args):
+    hashes = list(args.hashes)
+    if args.file is not None:
+        with open(args.file, 'r') as fp:
+            hashes.extend(line for line in fp if line.strip())
+    tables = open_tables(args.tables)
+    algorithm = tables[0][1].algorithm
+    if any(chains.algorithm is not algorithm for _, chains in tables):
+        sys.stderr.write('Every table must be for the same algorithm\n')
+        sys.exit(1)
+    digests = parse_hashes(hashes, algorithm.hex_length // 2)
+    results = []
+    pool = mp.Pool(args.jobs, _init_worker, (args.tables,))
+    try:
+        for value, preimage in pool.imap_unordered(_find, digests.items()):
+            if preimage is not None:
+                results.append({"preimage": preimage.decode(errors='replace'), "hash": value})
+    finally:
+        pool.close()
+        pool.join()
+    print(json.dumps({"algorithm": algorithm.key, "results": results}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Look up hex encoded hashes in rainbow chain tables')
+    parser.add_argument('hashes',
+        nargs='*',
+        help='hex encoded hashes')
+    parser.add_argument('-t', '--tables',
+        nargs='+',
+        dest='tables',
+        help='chain tables generated by rainbow_chains.py',
+        required=True)
+    parser.add_argument('-f', '--file',
+        dest='file',
+        default=None,
+        help='read hex encoded hashes from a file, one per line')
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        dest='jobs',
+        default=mp.cpu_count(),
+        help='worker processes (default: %d)' % mp.cpu_count())
+    main(parser.parse_args())
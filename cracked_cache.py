@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+'''
+
+> Persistent cache of cracked hashes, checked before any table lookup
+
+Every hash a lookup cracks is appended to a log as a JSON line, keyed by
+the algorithm and the *full* digest:
+
+    {"algorithm": "md5", "hash": "<base64 digest>", "preimage": "..."}
+
+Table hits only match a truncated digest, so a result is only cached once
+the preimage re-hashes to the full digest that was asked for. On start the
+log is read once into an in-memory index of where each entry is, lookups
+then cost a dict lookup and a single read. A torn last line (e.g. from a
+crash) is ignored.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from algorithms import get_algorithm
+
+
+def decode_hash(value):
+    ''' Digest of a base64 hash, None if it is not valid base64 '''
+    try:
+        return b64decode(value, validate=True)
+    except (BinasciiError, TypeError, ValueError):
+        return None
+
+
+class CrackedCache(object):
+    ''' Append-only log of cracked hashes, with an in-memory index of their offsets '''
+
+    def __init__(self, fpath):
+        self.path = fpath
+        self.index = {}
+        self._lock = threading.Lock()
+        self.fp = open(fpath, 'a+b')
+        self._load()
+
+    def _load(self):
+        self.fp.seek(0)
+        offset = 0
+        for line in self.fp:
+            try:
+                entry = json.loads(line)
+                key = (entry['algorithm'], b64decode(entry['hash']))
+            except (ValueError, KeyError, BinasciiError):
+                key = None
+            if key is not None and key not in self.index:
+                self.index[key] = offset
+            offset += len(line)
+        if offset and not line.endswith(b'\n'):
+            # Don't append to a torn line
+            self.fp.write(b'\n')
+            self.fp.flush()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, algorithm, digest):
+        ''' The preimage (bytes) of a full `digest`, or None '''
+        offset = self.index.get((algorithm, bytes(digest)))
+        if offset is None:
+            return None
+        with self._lock:
+            self.fp.seek(offset)
+            entry = json.loads(self.fp.readline())
+        return entry['preimage'].encode('utf-8', 'surrogateescape')
+
+    def add(self, algorithm, digest, preimage):
+        ''' Append a cracked hash, unless it is already cached '''
+        key = (algorithm, bytes(digest))
+        if key in self.index:
+            return
+        line = json.dumps({
+            'algorithm': algorithm,
+            'hash': b64encode(digest).decode(),
+            'preimage': preimage.decode('utf-8', 'surrogateescape'),
+        }) + '\n'
+        with self._lock:
+            self.fp.seek(0, os.SEEK_END)
+            self.index[key] = self.fp.tell()
+            self.fp.write(line.encode('utf-8', 'surrogateescape'))
+            self.fp.flush()
+
+    @staticmethod
+    def verify(algorithm, digest, preimage):
+        ''' True if `preimage` hashes to the full `digest` '''
+        algo = get_algorithm(algorithm)
+        if algo is None or len(digest) != algo.hex_length // 2:
+            return False
+        return algo._hash(preimage) == digest
+
+    def learn(self, algorithm, digests, preimages):
+        ''' Cache each of the full `digests` one of the candidate `preimages` verifies against '''
+        learned = 0
+        for digest in digests:
+            if (algorithm, bytes(digest)) in self.index:
+                continue
+            for preimage in preimages:
+                if self.verify(algorithm, digest, preimage):
+                    self.add(algorithm, digest, preimage)
+                    learned += 1
+                    break
+        return learned
+
+    def close(self):
+        self.fp.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Look up base64 hashes in a cracked hash cache')
+    parser.add_argument('cache',
+        help='cache log file')
+    parser.add_argument('-a', '--algorithm',
+        dest='algorithm',
+        required=True,
+        help='algorithm of the hashes')
+    parser.add_argument('hashes',
+        nargs='*',
+        help='base64 encoded full digests')
+    args = parser.parse_args()
+    cache = CrackedCache(args.cache)
+    try:
+        sys.stderr.write('%d cached hashes\n' % len(cache))
+        for value in args.hashes:
+            digest = decode_hash(value)
+            preimage = cache.get(args.algorithm, digest) if digest is not None else None
+            if preimage is not None:
+                sys.stdout.write('%s -> %s\n' % (value, preimage.decode(errors='replace')))
+    finally:
+        cache.close()
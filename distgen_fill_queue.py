@@ -12,7 +12,8 @@ from binascii import hexlify
 
 import boto3
 
-from generate_seeded_keyspace import KeyspaceGenerator
+from generate_seeded_keyspace import KeyspaceGenerator, MaskKeyspace, PolicyKeyspace
+from table_format import TRUNCATE, AUTO, COLLISION_RATE, truncate_width, parse_truncate
 
 MAX_ENTIRES = 10
 
@@ -23,14 +24,20 @@ def gen_id():
 def fill_queue(args, queue_url):
     ''' Fills up the SQS queue with blocks for the given key space '''
     charset = KeyspaceGenerator.DEFAULT_CHARSET if args.charset is None else args.charset
-    z = charset[0]  # The "zero value" symbol in the charset
-
-    end = KeyspaceGenerator.keyspace_length(z*args.chars_len, charset)
-    if args.inclusive:
-        start = 0
+    mask, policy = None, None
+    if PolicyKeyspace.is_policy(args.keyspace):
+        policy = PolicyKeyspace.from_spec(args.keyspace)
+        start, end = 0, policy.count
+    elif MaskKeyspace.is_mask(args.keyspace):
+        mask = MaskKeyspace(args.keyspace, args.custom_charsets)
+        start, end = 0, mask.count
     else:
-        start = KeyspaceGenerator.keyspace_length(z*(args.chars_len-1), charset) + 1
+        start, end = KeyspaceGenerator.keyspace_range(int(args.keyspace), charset, args.inclusive)
     print('Keyspace {} -> {}'.format(start, end))
+    truncate = args.truncate
+    if truncate == AUTO:
+        truncate = truncate_width(end - start, args.collision_rate)
+    print('Truncating digests to {} bytes'.format(truncate))
 
     sqs = boto3.resource('sqs')
     queue = sqs.Queue(queue_url)
@@ -41,14 +48,21 @@ def fill_queue(args, queue_url):
     for entry in range(start, end, args.block_size):
         stop = entry+args.block_size
         stop = stop if stop < end else end
+        block = {
+            'start': entry,
+            'stop': stop,
+            'truncate': truncate,
+        }
+        if mask is not None:
+            block['mask'] = mask.mask
+            block['custom_charsets'] = mask.to_dict()['custom_charsets']
+        if policy is not None:
+            block['policy'] = policy.spec
         entries.append({
             'Id': gen_id(),
             'MessageDeduplicationId': gen_id(),
             'MessageGroupId': gen_id(),
-            'MessageBody': json.dumps({
-                'start': entry,
-                'stop': stop,
-            })
+            'MessageBody': json.dumps(block)
         })
         if len(entries) == MAX_ENTIRES:
             send_count += 1
@@ -93,11 +107,17 @@ if __name__ == '__main__':
         default=None)
 
     parser.add_argument('-k',
-        type=int,
-        dest='chars_len',
-        help='generate keyspace for `n` chars',
+        type=str,
+        dest='keyspace',
+        help='generate keyspace for `n` chars, a mask (e.g. ?u?l?l?l?d?d) or a policy (e.g. 8:?u?d?s)',
         required=True)
 
+    parser.add_argument('-C',
+        action='append',
+        dest='custom_charsets',
+        help='custom charset for a mask, referenced as ?1 - ?4 in order given',
+        default=None)
+
     parser.add_argument('-Q',
         dest='sqs_queue',
         default=os.environ.get('DISTGEN_SQS_QUEUE', 'big_rainbow_distgen.fifo'),
@@ -109,4 +129,16 @@ if __name__ == '__main__':
         default=int(os.environ.get('DISTGEN_BLOCK_SIZE', 500000)),
         help='block size')
 
+    parser.add_argument('-T',
+        type=parse_truncate,
+        dest='truncate',
+        default=parse_truncate(os.environ.get('DISTGEN_TRUNCATE') or str(TRUNCATE)),
+        help='bytes to truncate digests to, or %s to pick them from the keyspace size and -R' % AUTO)
+
+    parser.add_argument('-R',
+        type=float,
+        dest='collision_rate',
+        default=float(os.environ.get('DISTGEN_COLLISION_RATE') or COLLISION_RATE),
+        help='with -T %s, the chance a hash not in the tables matches a row anyway' % AUTO)
+
     main(parser.parse_args())
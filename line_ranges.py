@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+'''
+
+> Split line oriented files (wordlists, JSON lines tables) between workers
+
+Each worker gets a byte range of the file that starts at the beginning of a
+line and ends at the beginning of the next worker's, so workers can seek
+straight to their range and never split a line.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+
+
+def split_lines(fpath, parts):
+    ''' Split a file into at most `parts` byte ranges that start on a new line '''
+    size = os.path.getsize(fpath)
+    offsets = [0]
+    with open(fpath, 'rb') as fp:
+        for index in range(1, parts):
+            target = (size * index) // parts
+            if target <= offsets[-1]:
+                continue
+            fp.seek(target - 1)
+            fp.readline()
+            offsets.append(fp.tell())
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
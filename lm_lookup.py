@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''
+
+> Resolve LM hashes using LM half tables (see multigen.py --lm-half)
+
+An LM hash is two independent DES halves, one for each uppercased 7 char
+chunk of the password. Each half is looked up in the tables separately and
+the two preimages are joined, passwords are recovered in uppercase since LM
+does not preserve case.
+
+Tables are JSON lines or binary tables (see table_format.py), which are read
+in full, or sorted indexes of lm_half (see build_index.py), which are only
+searched for the halves that are looked up.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import sys
+import json
+import argparse
+
+from base64 import b64decode
+from binascii import unhexlify, Error as BinasciiError
+
+from algorithms import algorithms, Lm, LmHalf
+from table_format import TableReader, MAGIC as TABLE_MAGIC
+from sorted_index import IndexReader, MAGIC as INDEX_MAGIC
+
+
+def parse_hashes(lm_hashes):
+    ''' Map each hex LM hash to its two half digests, invalid hashes are skipped '''
+    halves = {}
+    for lm_hash in lm_hashes:
+        try:
+            digest = unhexlify(lm_hash.strip())
+        except (BinasciiError, ValueError):
+            continue
+        if len(digest) == Lm.hex_length // 2:
+            halves[lm_hash.strip()] = list(LmHalf.split(digest))
+    return halves
+
+
+def truncated(wanted, width):
+    ''' Map each of the `wanted` half digests truncated to `width` to the halves '''
+    prefixes = {}
+    for digest in wanted:
+        prefixes.setdefault(digest[:width], []).append(digest)
+    return prefixes
+
+
+def scan_json(fpath, wanted, found):
+    ''' JSON lines, tables may be truncated to any width (it is read off each entry) '''
+    prefixes = {}  # width -> truncated half -> wanted halves
+    with open(fpath, 'r') as fp:
+        for line in fp:
+            entry = json.loads(line)
+            half = entry.get(LmHalf.key)
+            if half is None:
+                continue
+            half = b64decode(half)
+            if len(half) not in prefixes:
+                prefixes[len(half)] = truncated(wanted, len(half))
+            for digest in prefixes[len(half)].get(half, []):
+                found.setdefault(digest, []).append(entry['preimage'])
+
+
+def scan_binary(fpath, wanted, found):
+    ''' A binary table, read a batch of records at a time '''
+    with open(fpath, 'rb') as fp:
+        reader = TableReader(fp)
+        header = reader.header
+        if LmHalf.key not in header.algorithms:
+            return
+        width = header.digest_widths[header.algorithms.index(LmHalf.key)]
+        prefixes = truncated(wanted, width)
+        for preimages, digests in reader.batches():
+            column = digests[LmHalf.key]
+            for index, preimage in enumerate(preimages):
+                for digest in prefixes.get(bytes(column[index * width:(index + 1) * width]), []):
+                    found.setdefault(digest, []).append(header.preimage_of(preimage).decode())
+
+
+def search_index(fpath, wanted, found):
+    ''' A sorted index, only the wanted halves are searched for '''
+    reader = IndexReader(fpath)
+    try:
+        if reader.header.algorithm != LmHalf.key:
+            return
+        for digest in wanted:
+            for preimage in reader.find(digest):
+                found.setdefault(digest, []).append(preimage.decode())
+    finally:
+        reader.close()
+
+
+def scan_tables(fpaths, wanted):
+    ''' Map each of the `wanted` half digests to the preimages found in the tables '''
+    found = {LmHalf.empty: ['']}
+    for fpath in fpaths:
+        with open(fpath, 'rb') as fp:
+            magic = fp.read(len(TABLE_MAGIC))
+        if magic == INDEX_MAGIC:
+            search_index(fpath, wanted, found)
+        elif magic == TABLE_MAGIC:
+            scan_binary(fpath, wanted, found)
+        else:
+            scan_json(fpath, wanted, found)
+    return found
+
+
+def resolve(lm_hash, halves, found):
+    '''
+    The preimage of `lm_hash` or None, truncated halves can collide so every
+    combination is tried and verified against the full hash when possible
+    '''
+    first, second = halves
+    for head in found.get(first, []):
+        # A password with a second half must fill the first half completely
+        if second != LmHalf.empty and len(head) != LmHalf.max_length:
+            continue
+        for tail in found.get(second, []):
+            preimage = head + tail
+            if Lm.key not in algorithms:
+                return preimage
+            if Lm._hash(preimage.encode()) == unhexlify(lm_hash):
+                return preimage
+    return None
+
+
+def main(args):
+    lm_hashes = list(args.hashes)
+    if args.file is not None:
+        with open(args.file, 'r') as fp:
+            lm_hashes.extend(line for line in fp if line.strip())
+    halves = parse_hashes(lm_hashes)
+    wanted = set(half for pair in halves.values() for half in pair)
+    found = scan_tables(args.tables, wanted)
+    results = []
+    for lm_hash, pair in halves.items():
+        preimage = resolve(lm_hash, pair, found)
+        if preimage is not None:
+            results.append({"preimage": preimage, "hash": lm_hash})
+    print(json.dumps({"algorithm": Lm.key, "results": results}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Resolve LM hashes using LM half tables')
+    parser.add_argument('hashes',
+        nargs='*',
+        help='hex encoded LM hashes')
+    parser.add_argument('-t', '--tables',
+        nargs='+',
+        dest='tables',
+        help='LM half tables generated by multigen.py --lm-half (JSON or binary), or their indexes',
+        required=True)
+    parser.add_argument('-f', '--file',
+        dest='file',
+        default=None,
+        help='read hex encoded LM hashes from a file, one per line')
+    main(parser.parse_args())
@@ -11,57 +11,129 @@ import argparse
 import  multiprocessing as mp
 
 from os import getcwd, _exit
+from itertools import islice
 from binascii import hexlify
 from base64 import b64encode
 
-from generate_seeded_keyspace import KeyspaceGenerator
-from algorithms import algorithms
+from generate_seeded_keyspace import KeyspaceGenerator, KeyspaceBlock, MaskKeyspace, PolicyKeyspace
+from generate_seeded_keyspace import MarkovKeyspace, HybridKeyspace, IncrementKeyspace, iter_candidates
+from algorithms import algorithms, salted_algorithms, get_algorithm, with_users, LmHalf
+from algorithms import digest_all, digest_width, encode_digests
+from table_format import TableHeader, TableWriter, NdjsonWriter, INLINE, IMPLICIT, PREIMAGE_MODES
+from table_format import TRUNCATE, AUTO, COLLISION_RATE, truncate_width, parse_truncate
+from columnar import open_columnar
+from shards import ShardedWriter, shard_name
 
 ALL = 'all'
-TRUNCATE = 6
 CLEAR  = "\r\x1b[2K"
 MAX_SIZE = 32000
+BATCH_SIZE = 4096
+JSON, BINARY, COLUMNAR = 'json', 'binary', 'columnar'
 
 
 def get_hash_algorithms(args):
     ''' Gets the algorithm objects by name(s) '''
-    if ALL in args.algorithms:
-        return algorithms
-    else:
-        hash_algorithms = {}
-        for name in args.algorithms:
-            if name in algorithms:
-                hash_algorithms[name] = algorithms[name]
-        return hash_algorithms
-
-
-def compute_keyspace(start, stop, hash_algorithms, fout):
-    seed = KeyspaceGenerator.to_base_n(start, KeyspaceGenerator.DEFAULT_CHARSET)
-    keyspace = KeyspaceGenerator(seed, stop)
-    for word in keyspace:
-        results = {"preimage": word}
-        for name, algo in hash_algorithms.items():
-            results[name] = b64encode(algo(word.encode()).digest()[:TRUNCATE]).decode()
-        data = json.dumps(results)+"\n"
-        fout.write(data)
-
-
-def compute_single_entry(word, hash_algorithms):
-    results = {"preimage": word}
+    return with_users(args.algorithms, args.users)
+
+
+def compute_keyspace(start, stop, hash_algorithms, fout, charset=None, keyspace=None, truncate=TRUNCATE):
+    ''' Hash every value in `start` -> `stop` (exclusive), digests are truncated to `truncate` bytes '''
+    candidates = iter_candidates(start, stop, charset, keyspace)
+    words = list(islice(candidates, BATCH_SIZE))
+    position = start
+    while words:
+        if hasattr(fout, 'write_batch'):
+            fout.write_batch(words, digest_all(hash_algorithms, words, truncate), position)
+        else:
+            fout.write(compute_batch(words, hash_algorithms, truncate))
+        position += len(words)
+        words = list(islice(candidates, BATCH_SIZE))
+
+
+def compute_batch(words, hash_algorithms, truncate=TRUNCATE):
+    ''' JSON lines for a batch of words, digests shared between algorithms are computed once '''
+    digests = digest_all(hash_algorithms, words, truncate)
+    columns = {}
     for name, algo in hash_algorithms.items():
-        results[name] = b64encode(algo(word.encode()).digest()[:TRUNCATE]).decode()
-    return json.dumps(results)+"\n"
+        columns[name] = encode_digests(digests[name], digest_width(algo, truncate))
+    lines = []
+    for index, word in enumerate(words):
+        results = {"preimage": word.decode()}
+        for name, column in columns.items():
+            results[name] = column[index]
+        lines.append(json.dumps(results)+"\n")
+    return ''.join(lines)
+
+
+def compute_single_entry(word, hash_algorithms, truncate=TRUNCATE):
+    return compute_batch([word.encode()], hash_algorithms, truncate)
+
+
+def open_output(fpath, output_format=JSON, header=None):
+    ''' JSON lines, a binary table or a columnar table at `fpath` (without extension) '''
+    if output_format == BINARY:
+        return TableWriter(open(fpath + '.bin', 'wb'), header)
+    if output_format == COLUMNAR:
+        return open_columnar(fpath, header)
+    return open(fpath + '.json', 'w')
+
 
+def open_sharded(output, fname, output_format, header, shard_bits, shard_algorithm):
+    ''' Buffered writers for `fname` in each shard directory of `output`, opened as needed '''
+    def open_shard(index):
+        dirpath = os.path.join(output, shard_name(index, shard_bits))
+        os.makedirs(dirpath, exist_ok=True)
+        fout = open_output(os.path.join(dirpath, fname), output_format, header)
+        return fout if hasattr(fout, 'write_batch') else NdjsonWriter(fout, header)
+    digest_widths = dict(zip(header.algorithms, header.digest_widths))
+    return ShardedWriter(open_shard, shard_algorithm, digest_widths, shard_bits)
 
-def start_worker(worker_id, queue, chars_len, hash_algorithms, output):
-    fname = "generated_keyspace_%s_%s.json" % (chars_len, worker_id)
-    fout = open(os.path.join(output, fname), 'w')
-    while not queue.empty():
-        start, stop = queue.get()
-        compute_keyspace(start, stop, hash_algorithms, fout)
+
+def start_worker(worker_id, queue, chars_len, hash_algorithms, output, charset=None, keyspace=None,
+                 output_format=JSON, header=None, shard_bits=None, shard_algorithm=None, truncate=TRUNCATE):
+    '''
+    Hash blocks from the queue, binary and columnar tables are described by `header`.
+    Implicit tables get a file per block as ranks are implied by record order.
+    '''
+    if header is not None and header.preimage == IMPLICIT:
+        for start, stop in iter(queue.get, None):
+            fname = "generated_keyspace_%s_%s_%s" % (chars_len, start, stop)
+            fout = open_output(os.path.join(output, fname), output_format, header.with_start(start))
+            compute_keyspace(start, stop, hash_algorithms, fout, charset, keyspace, truncate)
+            fout.close()
+        return
+    fname = "generated_keyspace_%s_%s" % (chars_len, worker_id)
+    if shard_bits is not None:
+        fout = open_sharded(output, fname, output_format, header, shard_bits, shard_algorithm)
+    else:
+        fout = open_output(os.path.join(output, fname), output_format, header)
+    for start, stop in iter(queue.get, None):
+        compute_keyspace(start, stop, hash_algorithms, fout, charset, keyspace, truncate)
     fout.close()
 
 
+def check_lm_half(keyspace):
+    '''
+    Raise ValueError unless every value of a mask or hybrid `keyspace` is an
+    uppercase LM half, lowercase values would only repeat the uppercase ones
+    '''
+    mask = keyspace.mask if isinstance(keyspace, HybridKeyspace) else keyspace
+    if not isinstance(mask, MaskKeyspace):
+        raise ValueError('LM half tables take a length, a mask or a hybrid mask')
+    for position, charset in enumerate(mask.charsets):
+        if charset != LmHalf.charset(charset):
+            raise ValueError('Mask position %d has lowercase chars, use ?u rather than ?l '
+                             'and uppercase custom charsets' % (position + 1))
+    if isinstance(keyspace, HybridKeyspace):
+        if any(word != word.upper() for word in keyspace.words):
+            raise ValueError('Wordlist has lowercase words')
+        width = keyspace.max_width
+    else:
+        width = keyspace.width
+    if LmHalf.max_length < width:
+        raise ValueError('LM halves are at most %d chars' % LmHalf.max_length)
+
+
 def sizeof_fmt(num, suffix='B'):
     ''' https://stackoverflow.com/questions/1094841/reusable-library-to-get-human-readable-version-of-file-size '''
     for unit in ['','Ki','Mi','Gi','Ti','Pi','Ei','Zi']:
@@ -73,15 +145,90 @@ def sizeof_fmt(num, suffix='B'):
 
 def main(args):
     charset = KeyspaceGenerator.DEFAULT_CHARSET if args.charset is None else args.charset
-    hash_algorithms = get_hash_algorithms(args)
+    try:
+        hash_algorithms = get_hash_algorithms(args)
+    except ValueError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(1)
     queue = mp.Queue()
-    
-    z = charset[0]  # zero symbol
-    end = KeyspaceGenerator.keyspace_length(z*args.chars_len, charset)
-    if args.inclusive:
-        start = 0
+
+    if args.lm_half:
+        if get_algorithm(LmHalf.key) is None:
+            sys.stderr.write('LM half tables require passlib\n')
+            sys.exit(1)
+        # Every LM hash is two halves from the uppercase <= 7 char keyspace
+        hash_algorithms = {LmHalf.key: LmHalf}
+        charset = LmHalf.charset(charset)
+    elif not hash_algorithms:
+        sys.stderr.write('No hashing algorithms selected, see -a\n')
+        sys.exit(1)
+
+    keyspace = None
+    if args.lm_half and args.keyspace.isdigit():
+        keyspace = IncrementKeyspace.from_charset(charset, min(int(args.keyspace), LmHalf.max_length))
+    elif args.wordlist is not None:
+        keyspace = HybridKeyspace.load(args.wordlist, MaskKeyspace(args.keyspace, args.custom_charsets),
+                                       args.prepend)
+    elif args.markov is not None:
+        keyspace = MarkovKeyspace.load(args.markov, int(args.keyspace))
+    elif PolicyKeyspace.is_policy(args.keyspace):
+        keyspace = PolicyKeyspace.from_spec(args.keyspace)
+    elif MaskKeyspace.is_mask(args.keyspace):
+        keyspace = MaskKeyspace(args.keyspace, args.custom_charsets)
+    if args.lm_half and not isinstance(keyspace, IncrementKeyspace):
+        try:
+            check_lm_half(keyspace)
+        except ValueError as error:
+            sys.stderr.write('Cannot generate LM halves: %s\n' % error)
+            sys.exit(1)
+    if keyspace is not None:
+        charset = None
+        if keyspace.width is not None:
+            chars_len = keyspace.width
+        else:
+            chars_len = 'hybrid' if isinstance(keyspace, HybridKeyspace) else 'increment'
+        start, end = 0, keyspace.count
+        first = keyspace.unrank(0)
     else:
-        start = KeyspaceGenerator.keyspace_length(z*(args.chars_len-1), charset) + 1
+        chars_len = int(args.keyspace)
+        start, end = KeyspaceGenerator.keyspace_range(chars_len, charset, args.inclusive)
+        first = charset[0] * chars_len
+
+    truncate = args.truncate
+    if truncate == AUTO:
+        try:
+            truncate = truncate_width(end - start, args.collision_rate)
+        except ValueError as error:
+            sys.stderr.write('Cannot pick a truncation: %s\n' % error)
+            sys.exit(1)
+        print('Truncating digests to %d bytes' % truncate)
+
+    header = None
+    if args.format in (BINARY, COLUMNAR) or args.shard_bits is not None:
+        if keyspace is None:
+            preimage_width = chars_len
+        else:
+            preimage_width = keyspace.width if keyspace.width is not None else keyspace.max_width
+        preimage = args.preimage if args.format != JSON else INLINE
+        try:
+            header = TableHeader.for_algorithms(hash_algorithms, truncate, preimage_width, charset,
+                                                keyspace, preimage)
+        except ValueError as error:
+            sys.stderr.write('Cannot store %s preimages: %s\n' % (preimage, error))
+            sys.exit(1)
+
+    shard_algorithm = None
+    if args.shard_bits is not None:
+        shard_algorithm = args.shard_algorithm or next(iter(hash_algorithms))
+        if header.preimage == IMPLICIT:
+            sys.stderr.write('Implicit preimages depend on record order, they cannot be sharded\n')
+            sys.exit(1)
+        try:
+            ShardedWriter(None, shard_algorithm, dict(zip(header.algorithms, header.digest_widths)),
+                          args.shard_bits)
+        except ValueError as error:
+            sys.stderr.write('Cannot shard output: %s\n' % error)
+            sys.exit(1)
 
     if args.skip is not None and start + abs(args.skip) < end:
         start += abs(args.skip)
@@ -89,11 +236,17 @@ def main(args):
         end = start + abs(args.limit)
 
     block_size = (end // MAX_SIZE) + 1
+    if header is not None and header.preimage == IMPLICIT:
+        # Every block is its own file, so use fewer larger blocks
+        block_size = max(block_size, (end - start) // (mp.cpu_count() * 4) + 1)
 
     print('Keyspace is %d -> %d (%s entries)' % (start, end, end-start))
 
     # For inclusive spaces we'll end up over estimating a little but whatever
-    file_size = (end-start) * len(compute_single_entry(z*args.chars_len, hash_algorithms))
+    if args.format != JSON:
+        file_size = (end-start) * header.record_width
+    else:
+        file_size = (end-start) * len(compute_single_entry(first, hash_algorithms, truncate))
     print('Estimated output is %d bytes (%s)' % (file_size, sizeof_fmt(file_size)))
 
     print('Block size is %d' % block_size)
@@ -101,18 +254,24 @@ def main(args):
         sys.exit()
 
     for index, block_start in enumerate(range(start, end, block_size)):
-        queue.put((block_start, block_start+block_size))
+        block_stop = min(block_start+block_size, end)
+        queue.put((block_start, block_stop))
         sys.stdout.write(CLEAR)
         sys.stdout.write('Generated {} block ({} -> {}) ...'.format(
-            index+1, block_start, block_start+block_size))
+            index+1, block_start, block_stop))
         sys.stdout.flush()
     print(CLEAR+'Block generation completed')
 
+    # One stop sentinel per worker, `queue.empty()` is not reliable across processes
+    for _ in range(mp.cpu_count()):
+        queue.put(None)
+
     print('Starting %d workers ...' % mp.cpu_count())
     workers = []
     for worker_id in range(mp.cpu_count()):
         worker = mp.Process(target=start_worker, 
-                            args=(worker_id, queue, args.chars_len, hash_algorithms, args.output))
+                            args=(worker_id, queue, chars_len, hash_algorithms, args.output, charset, keyspace,
+                                  args.format, header, args.shard_bits, shard_algorithm, truncate))
         worker.start()
         workers.append(worker)
     [worker.join() for worker in workers]
@@ -125,17 +284,23 @@ if __name__ == '__main__':
     parser.add_argument('-a', '--algorithms',
         nargs='*',
         dest='algorithms',
-        help='hashing algorithm to use: %s' % (['all']+ sorted(algorithms.keys())),
-        required=True)
+        help='hashing algorithm to use: %s, salted algorithms %s with each user of -U' % (
+            ['all']+ sorted(algorithms.keys()), sorted(salted_algorithms.keys())),
+        default=[])
+    parser.add_argument('-U', '--users',
+        nargs='+',
+        dest='users',
+        help='users to salt the salted algorithms of -a with, e.g. -a postgres_md5 -U root bob',
+        default=None)
     parser.add_argument('-o', '--output',
         dest='output',
         default=getcwd(),
         help='output directory to write data to')
     
     parser.add_argument('-k', '--keyspace',
-        type=int,
-        dest='chars_len',
-        help='generate keyspace for `n` chars',
+        type=str,
+        dest='keyspace',
+        help='generate keyspace for `n` chars, a mask (e.g. ?u?l?l?l?d?d) or a policy (e.g. 8:?u?d?s)',
         required=True)
     parser.add_argument('-s', '--skip',
         type=int,
@@ -153,11 +318,68 @@ if __name__ == '__main__':
         dest='charset',
         help='generate keyspace using a given charset',
         default=None)
+    parser.add_argument('-w', '--wordlist',
+        type=str,
+        dest='wordlist',
+        help='combine every word in a wordlist with the -k mask (hybrid mode)',
+        default=None)
+    parser.add_argument('-P', '--prepend',
+        action='store_true',
+        dest='prepend',
+        help='in hybrid mode put the mask before each word instead of after',
+        default=False)
+    parser.add_argument('-M', '--markov',
+        type=str,
+        dest='markov',
+        help='generate `n` chars in markov order using a model (see train_markov.py)',
+        default=None)
+    parser.add_argument('-C', '--custom-charset',
+        action='append',
+        dest='custom_charsets',
+        help='custom charset for a mask, referenced as ?1 - ?4 in order given',
+        default=None)
     parser.add_argument('-i', '--inclusive',
         type=bool,
         dest='inclusive',
         help='generate entire keyspace inclusively (e.g. 1 char, 2 char ...)',
         default=False)
+    parser.add_argument('-H', '--lm-half',
+        action='store_true',
+        dest='lm_half',
+        help='generate an LM half table (uppercase, up to 7 chars) for lm_lookup.py',
+        default=False)
+    parser.add_argument('-f', '--format',
+        choices=[JSON, BINARY, COLUMNAR],
+        dest='format',
+        help='write JSON lines, fixed width binary records (see table_format.py) '
+             'or a column per algorithm (see columnar.py)',
+        default=JSON)
+    parser.add_argument('-p', '--preimage',
+        choices=PREIMAGE_MODES,
+        dest='preimage',
+        help='store binary preimages inline, as their rank, or implied by record order',
+        default=INLINE)
+    parser.add_argument('-S', '--shard-bits',
+        type=int,
+        dest='shard_bits',
+        help='route records into 2^n shard directories by the leading bits of a digest',
+        default=None)
+    parser.add_argument('--shard-algorithm',
+        dest='shard_algorithm',
+        help='algorithm whose digest picks the shard (default: the first algorithm)',
+        default=None)
+    parser.add_argument('-T', '--truncate',
+        type=parse_truncate,
+        dest='truncate',
+        help='bytes to truncate digests to, or %s to pick them from the keyspace size and -R '
+             '(default: %d)' % (AUTO, TRUNCATE),
+        default=TRUNCATE)
+    parser.add_argument('-R', '--collision-rate',
+        type=float,
+        dest='collision_rate',
+        help='with -T %s, the chance a hash not in the table matches a row anyway (default: %s)'
+             % (AUTO, COLLISION_RATE),
+        default=COLLISION_RATE)
     parser.add_argument('-K', '--keyspace-only',
         action='store_true',
         dest='keyspace_only',
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+'''
+
+> Rainbow chain tables, a time-memory tradeoff for keyspaces too big to store
+
+Instead of every `(preimage, digest)` pair a chain table stores one record
+per chain of `length` preimages. A chain starts at a rank in the keyspace,
+and each step hashes the preimage then reduces the digest to the next rank:
+
+    rank -> unrank -> hash -> reduce(digest, step) -> rank -> ... -> end rank
+
+The reduction is the digest (its first 16 bytes, little endian) plus the
+step, modulo the keyspace size, so it differs at every step (which is what
+keeps chains that collide from merging) and between tables (`--table`).
+
+Tables are sorted indexes (see sorted_index.py) of end rank -> start rank,
+with the chain length and table number in the header. Looking a digest up
+(see chain_lookup.py) assumes it is at each step in turn, walks to the end
+of the chain, and regenerates the chains whose end rank is in the table.
+
+Keyspaces are the same as multigen.py's, `n` chars of a charset is the mask
+of `n` custom charset chars so every value has a rank.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing as mp
+
+from algorithms import algorithms, salted_algorithms, get_algorithm
+from generate_seeded_keyspace import KeyspaceGenerator, MaskKeyspace, PolicyKeyspace, MarkovKeyspace
+from generate_seeded_keyspace import IncrementKeyspace
+from sorted_index import IndexHeader, IndexWriter
+from table_format import RANK
+from build_index import merge_all, MAX_FAN_IN
+
+EXTENSION = '.chains'
+CHAIN_LENGTH = 1000
+REDUCE_BYTES = 16
+TABLE_SHIFT = 32  # Tables offset every reduction by their number shifted this far
+CHAIN_BATCH = 4096  # Chains per worker task
+
+
+def chains_path(dirpath, algorithm, table, first=0):
+    ''' Path of a chain table (whose first chain starts at rank `first`) in `dirpath` '''
+    return os.path.join(dirpath, '%s_%d_%d%s' % (algorithm, table, first, EXTENSION))
+
+
+class Chains(object):
+    ''' Hashing, reduction and chain walking for one chain table header '''
+
+    def __init__(self, header):
+        if header.chain is None:
+            raise ValueError('Not a chain table')
+        self.header = header
+        self.algorithm = get_algorithm(header.algorithm)
+        self.length = header.chain['length']
+        self.table = header.chain['table']
+        self.count = header.chain['count']
+
+    @classmethod
+    def header_for(cls, algorithm, keyspace, length=CHAIN_LENGTH, table=0):
+        ''' Header of a chain table for `algorithm` over a keyspace object '''
+        if length < 1:
+            raise ValueError('Chains must be at least 1 step long')
+        count = keyspace.count
+        width = max(1, ((count - 1).bit_length() + 7) // 8)
+        chain = {'length': length, 'table': table, 'count': count}
+        return IndexHeader(algorithm, width, keyspace=keyspace.to_dict(), preimage=RANK, chain=chain)
+
+    def unrank(self, rank):
+        return self.header.preimage_of(rank)
+
+    def reduce(self, digest, step):
+        ''' Rank of the preimage that follows `digest` at `step` '''
+        value = int.from_bytes(digest[:REDUCE_BYTES], 'little')
+        return (value + step + (self.table << TABLE_SHIFT)) % self.count
+
+    def encode(self, rank):
+        ''' A rank as a (big endian) key in the table '''
+        return rank.to_bytes(self.header.digest_width, 'big')
+
+    def walk(self, rank, start=0):
+        ''' End rank of a chain that is at `rank` before `start` '''
+        for step in range(start, self.length):
+            rank = self.reduce(self.algorithm._hash(self.unrank(rank)), step)
+        return rank
+
+    def end_of(self, digest, step):
+        ''' End rank of a chain that has `digest` at `step` '''
+        return self.walk(self.reduce(digest, step), step + 1)
+
+    def preimage_in(self, start, digest, step):
+        ''' Preimage of `digest` in the chain from `start`, checking up to `step`, None on false alarm '''
+        rank = start
+        for position in range(step + 1):
+            preimage = self.unrank(rank)
+            candidate = self.algorithm._hash(preimage)
+            if candidate == digest:
+                return preimage
+            rank = self.reduce(candidate, position)
+        return None
+
+
+def generate_chains(task):
+    ''' Worker process, walks the chains from ranks `first` -> `stop` into a sorted run '''
+    header, first, stop, run_dir = task
+    header = IndexHeader.from_dict(header)
+    chains = Chains(header)
+    records = sorted((chains.encode(chains.walk(rank)), rank) for rank in range(first, stop))
+    fd, fpath = tempfile.mkstemp(prefix='run_', suffix=EXTENSION, dir=run_dir)
+    os.close(fd)
+    writer = IndexWriter(fpath, header)
+    writer.write(records)
+    writer.close()
+    return fpath
+
+
+def get_keyspace(args):
+    ''' Keyspace object for the -k/-c/-C/-M/-i arguments, the same as multigen.py's '''
+    charset = KeyspaceGenerator.DEFAULT_CHARSET if args.charset is None else args.charset
+    if args.markov is not None:
+        return MarkovKeyspace.load(args.markov, int(args.keyspace))
+    if PolicyKeyspace.is_policy(args.keyspace):
+        return PolicyKeyspace.from_spec(args.keyspace)
+    if MaskKeyspace.is_mask(args.keyspace):
+        return MaskKeyspace(args.keyspace, args.custom_charsets)
+    length = int(args.keyspace)
+    if args.inclusive:
+        return IncrementKeyspace.from_charset(charset, length)
+    return IncrementKeyspace.from_charset(charset, length, length)
+
+
+def main(args):
+    if get_algorithm(args.algorithm) is None:
+        sys.stderr.write('Unknown algorithm %s, see -a\n' % args.algorithm)
+        sys.exit(1)
+    keyspace = get_keyspace(args)
+    header = Chains.header_for(args.algorithm, keyspace, args.length, args.table)
+    chains = args.chains if args.chains is not None else max(1, keyspace.count // args.length)
+    if not 0 <= args.first < keyspace.count:
+        sys.stderr.write('The first chain must start inside the keyspace, see -s\n')
+        sys.exit(1)
+    chains = min(chains, keyspace.count - args.first)
+    print('Keyspace has %d values, generating %d chains of %d (table %d)' % (
+        keyspace.count, chains, args.length, args.table))
+
+    os.makedirs(args.output, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix='rainbow_chains_', dir=args.output)
+    tasks = [(header.to_dict(), first, min(first + CHAIN_BATCH, args.first + chains), run_dir)
+             for first in range(args.first, args.first + chains, CHAIN_BATCH)]
+    started = time.time()
+    pool = mp.Pool(args.jobs)
+    try:
+        runs = []
+        for run_path in pool.imap_unordered(generate_chains, tasks):
+            runs.append(run_path)
+            sys.stdout.write('\r\x1b[2KGenerated %d of %d batches ...' % (len(runs), len(tasks)))
+            sys.stdout.flush()
+        fpath = merge_all(sorted(runs), chains_path(args.output, args.algorithm, args.table, args.first), run_dir,
+                          MAX_FAN_IN)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(run_dir, ignore_errors=True)
+    print('\r\x1b[2K%d chains -> %s (%.1fs)' % (chains, fpath, time.time() - started))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a rainbow chain table')
+    parser.add_argument('-a', '--algorithm',
+        dest='algorithm',
+        help='hashing algorithm to use: %s, or a salted algorithm and user e.g. postgres_md5_root (%s)' % (
+            sorted(algorithms.keys()), sorted(salted_algorithms.keys())),
+        required=True)
+    parser.add_argument('-k', '--keyspace',
+        type=str,
+        dest='keyspace',
+        help='`n` chars, a mask (e.g. ?u?l?l?l?d?d) or a policy (e.g. 8:?u?d?s)',
+        required=True)
+    parser.add_argument('-c', '--charset',
+        type=str,
+        dest='charset',
+        help='charset of an `n` chars keyspace',
+        default=None)
+    parser.add_argument('-C', '--custom-charset',
+        action='append',
+        dest='custom_charsets',
+        help='custom charset for a mask, referenced as ?1 - ?4 in order given',
+        default=None)
+    parser.add_argument('-M', '--markov',
+        type=str,
+        dest='markov',
+        help='`n` chars in markov order using a model (see train_markov.py)',
+        default=None)
+    parser.add_argument('-i', '--inclusive',
+        action='store_true',
+        dest='inclusive',
+        help='every value of 1 to `n` chars instead of exactly `n`',
+        default=False)
+    parser.add_argument('-L', '--length',
+        type=int,
+        dest='length',
+        help='steps per chain (default: %d)' % CHAIN_LENGTH,
+        default=CHAIN_LENGTH)
+    parser.add_argument('-n', '--chains',
+        type=int,
+        dest='chains',
+        help='number of chains (default: keyspace size / chain length)',
+        default=None)
+    parser.add_argument('-s', '--first',
+        type=int,
+        dest='first',
+        help='rank the first chain starts at, to extend a table (default: 0)',
+        default=0)
+    parser.add_argument('-t', '--table',
+        type=int,
+        dest='table',
+        help='table number, each number uses different reductions (default: 0)',
+        default=0)
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        dest='jobs',
+        help='worker processes (default: %d)' % mp.cpu_count(),
+        default=mp.cpu_count())
+    parser.add_argument('-o', '--output',
+        dest='output',
+        default=os.getcwd(),
+        help='output directory to write the table to')
+    main(parser.parse_args())
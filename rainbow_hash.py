@@ -14,25 +14,34 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import os
 import sys
 import time
 import json
+import shutil
 import struct
 import hashlib
 import argparse
 import threading
 import platform
+import multiprocessing as mp
 
 from binascii import hexlify
 from base64 import b64encode
 from os import _exit, getcwd, path
 
 try:
-    from algorithms import algorithms
+    from algorithms import algorithms, salted_algorithms, with_users, digest_valid, digest_width, encode_digests
 except ImportError:
     sys.stderr.write("Missing file algorithms.py")
     _exit(2)
 
+from rules import load_rules, mutate
+from line_ranges import split_lines
+from generate_seeded_keyspace import MaskKeyspace, KeyspaceBlock, HybridKeyspace
+from table_format import TableHeader, TableFormatError, TRUNCATE, AUTO, COLLISION_RATE
+from table_format import truncate_width, parse_truncate
+
 if platform.system().lower() in ['windows']:
     print("[!] It appears you're running a shitty operating system" + \
           " make sure to use a real terminal emulator (not cmd.exe)")
@@ -51,28 +60,82 @@ WARN = bold + R + "[!] " + W
 MONEY = bold + O + "[$] " + W
 PROMPT = bold + P + "[?] " + W
 
-TRUNCATE = 6  # Bytes to truncate hash at (48-bites)
+PROGRESS_INTERVAL = 1024 ** 2  # Bytes read by a worker between progress updates
+BATCH_SIZE = 4096  # Candidates hashed per digest_all() call
+BATCH_BYTES = 64 * 1024  # Bytes of the wordlist read per batch
+JSON, BINARY = 'json', 'binary'
+
+
+def get_candidates(word, rules=None, mask_block=None, prepend=False):
+    ''' Mangle `word` with `rules` then combine it with each value of the mask '''
+    candidates = mutate(word, rules) if rules else (word,)
+    if mask_block is None:
+        return candidates
+    return (hybrid for candidate in candidates
+            for hybrid in HybridKeyspace.combine(candidate, mask_block, prepend))
+
+
+def compute_lines(words, hash_algorithms, rules=None, mask_block=None, prepend=False, header=None,
+                  truncate=TRUNCATE):
+    '''
+    Yield the index lines for every candidate of `words`, hashed in batches,
+    or binary records if given a table `header` (wider candidates are skipped)
+    '''
+    candidates, preimages = [], []
+    for word in words:
+        for candidate in get_candidates(word, rules, mask_block, prepend):
+            if header is not None and header.preimage_width < len(candidate):
+                continue
+            try:
+                preimages.append(candidate.decode())
+            except UnicodeDecodeError:
+                continue
+            candidates.append(candidate)
+            if BATCH_SIZE <= len(candidates):
+                yield compute_batch(candidates, preimages, hash_algorithms, header, truncate)
+                candidates, preimages = [], []
+    if candidates:
+        yield compute_batch(candidates, preimages, hash_algorithms, header, truncate)
 
 
-def compute_entry(fword, fout, hash_algorithms, flock):
-    ''' Create an index and write to file '''
-    line = fword.readline()
-    while line:
-        word = line[:-1] if line.endswith(b'\n') else line
+def compute_batch(candidates, preimages, hash_algorithms, header=None, truncate=TRUNCATE):
+    '''
+    Index lines for a batch of candidates, digests shared between algorithms
+    are computed once and candidates an algorithm can't hash are skipped
+    '''
+    kept, digests = digest_valid(hash_algorithms, candidates, truncate)
+    if len(kept) < len(candidates):
+        candidates = [candidates[index] for index in kept]
+        preimages = [preimages[index] for index in kept]
+    if header is not None:
+        return header.pack(candidates, digests)
+    columns = {}
+    for name, algo in hash_algorithms.items():
+        columns[name] = encode_digests(digests[name], digest_width(algo, truncate))
+    lines = []
+    for index, preimage in enumerate(preimages):
+        results = {"preimage": preimage}
+        for name, column in columns.items():
+            results[name] = column[index]
+        lines.append(json.dumps(results)+"\n")
+    return ''.join(lines).encode()
+
+
+def compute_entry(fword, fout, hash_algorithms, flock, rules=None, mask_block=None, prepend=False,
+                  header=None, truncate=TRUNCATE):
+    ''' Create an index and write to file, mangling each word with `rules` '''
+    lines = fword.readlines(BATCH_BYTES)
+    while lines:
+        words = [line[:-1] if line.endswith(b'\n') else line for line in lines]
         try:
-            results = {"preimage": word.decode()}
-            for name, algo in hash_algorithms.items():
-                results[name] = b64encode(algo(word).digest()[:TRUNCATE]).decode()
-            data = json.dumps(results)+"\n"
-            flock.acquire()
-            fout.write(data.encode())
-            flock.release()
-        except UnicodeDecodeError:
-            pass
+            for data in compute_lines(words, hash_algorithms, rules, mask_block, prepend, header, truncate):
+                flock.acquire()
+                fout.write(data)
+                flock.release()
         except KeyboardInterrupt:
             return
         finally:
-            line = fword.readline()
+            lines = fword.readlines(BATCH_BYTES)
 
 
 def display_status(fword, fout, flock):
@@ -97,11 +160,12 @@ def display_status(fword, fout, flock):
         raise error
 
 
-def index_wordlist(fword, fout, hash_algorithms, flock):
+def index_wordlist(fword, fout, hash_algorithms, flock, rules=None, mask_block=None, prepend=False,
+                   header=None, truncate=TRUNCATE):
     try:
         thread = threading.Thread(target=display_status, args=(fword, fout, flock))
         thread.start()
-        compute_entry(fword, fout, hash_algorithms, flock)
+        compute_entry(fword, fout, hash_algorithms, flock, rules, mask_block, prepend, header, truncate)
     except KeyboardInterrupt:
         sys.stdout.write(clear + WARN + 'User requested stop ...\n')
         return
@@ -110,20 +174,115 @@ def index_wordlist(fword, fout, hash_algorithms, flock):
         fword.close()
         thread.join()
 
+
+def index_range(wordlist, start, end, part_path, hash_algorithms, progress,
+                rules=None, mask_block=None, prepend=False, header=None, truncate=TRUNCATE):
+    ''' Worker process, indexes the lines in `start` -> `end` into its own file '''
+    try:
+        with open(wordlist, 'rb') as fword, open(part_path, 'wb') as fout:
+            fword.seek(start)
+            position = reported = start
+            while position < end:
+                words = []
+                while position < end and len(words) < BATCH_SIZE:
+                    line = fword.readline()
+                    if not line:
+                        break
+                    position += len(line)
+                    words.append(line[:-1] if line.endswith(b'\n') else line)
+                if not words:
+                    break
+                for data in compute_lines(words, hash_algorithms, rules, mask_block, prepend, header, truncate):
+                    fout.write(data)
+                if PROGRESS_INTERVAL <= position - reported:
+                    with progress.get_lock():
+                        progress.value += position - reported
+                    reported = position
+            with progress.get_lock():
+                progress.value += position - reported
+    except KeyboardInterrupt:
+        return
+
+
+def index_wordlist_parallel(wordlist, fout, hash_algorithms, jobs, rules=None, mask_block=None, prepend=False,
+                            header=None, truncate=TRUNCATE):
+    ''' Index newline aligned ranges of the wordlist in `jobs` processes, then merge '''
+    megabyte = (1024.0 ** 2.0)
+    size = path.getsize(wordlist) / megabyte
+    progress = mp.Value('q', 0)
+    workers, part_paths = [], []
+    for index, (start, end) in enumerate(split_lines(wordlist, jobs)):
+        part_path = '%s.part%d' % (fout.name, index)
+        worker = mp.Process(target=index_range,
+                            args=(wordlist, start, end, part_path, hash_algorithms, progress,
+                                  rules, mask_block, prepend, header, truncate))
+        worker.start()
+        workers.append(worker)
+        part_paths.append(part_path)
+    sys.stdout.write(INFO + 'Reading %s with %d workers ...\n' % (path.abspath(wordlist), len(workers)))
+    try:
+        while any(worker.is_alive() for worker in workers):
+            fword_pos = progress.value / megabyte
+            sys.stdout.write(clear)
+            sys.stdout.write(INFO + '%.2f Mb of %.2f Mb' % (fword_pos, size))
+            sys.stdout.write(' (%3.2f%s)' % ((100.0 * (fword_pos / size)) if size else 100.0, '%',))
+            sys.stdout.flush()
+            time.sleep(0.25)
+        [worker.join() for worker in workers]
+        sys.stdout.write(clear + INFO + 'Merging %d part(s) -> "%s"' % (len(part_paths), fout.name))
+        sys.stdout.flush()
+        for part_path in part_paths:
+            with open(part_path, 'rb') as fpart:
+                shutil.copyfileobj(fpart, fout)
+    except KeyboardInterrupt:
+        sys.stdout.write(clear + WARN + 'User requested stop ...\n')
+        [worker.terminate() for worker in workers]
+    finally:
+        fout.close()
+        for part_path in part_paths:
+            if path.exists(part_path):
+                os.unlink(part_path)
+
+
+def count_candidates(wordlist, rules=None, mask_block=None):
+    ''' Upper bound of the candidates a wordlist makes, rules may reject some '''
+    lines, last = 0, b'\n'
+    with open(wordlist, 'rb') as fword:
+        for block in iter(lambda: fword.read(BATCH_BYTES), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    # The final line is still read as a word without a trailing newline
+    if last != b'\n':
+        lines += 1
+    masks = mask_block.stop - mask_block.start if mask_block is not None else 1
+    return lines * (len(rules) if rules else 1) * masks
+
+
 def get_hash_algorithms(args):
-    if ALL in args.algorithms:
-        return algorithms
-    else:
-        hash_algorithms = {}
-        for name in args.algorithms:
-            if name in algorithms:
-                hash_algorithms[name] = algorithms[name]
-        return hash_algorithms
+    return with_users(args.algorithms, args.users)
 
 def main(args):
     flock = threading.Lock()
-    hash_algorithms = get_hash_algorithms(args)
-    fword = open(args.wordlist, 'rb')
+    try:
+        hash_algorithms = get_hash_algorithms(args)
+    except ValueError as error:
+        sys.stdout.write(WARN + '%s\n' % error)
+        _exit(1)
+    rules = load_rules(args.rules) if args.rules is not None else None
+    mask_block = None
+    if args.mask is not None:
+        mask = MaskKeyspace(args.mask, args.custom_charsets)
+        mask_block = KeyspaceBlock(0, mask.count, keyspace=mask)
+    truncate = args.truncate
+    if truncate == AUTO:
+        truncate = truncate_width(count_candidates(args.wordlist, rules, mask_block), args.collision_rate)
+        sys.stdout.write(INFO + 'Truncating digests to %d bytes\n' % truncate)
+    header = None
+    if args.format == BINARY:
+        # Only describes how the table was made, wordlist tables always store preimages inline
+        keyspace = HybridKeyspace([], mask, args.prepend) if args.mask is not None else None
+        header = TableHeader.for_algorithms(hash_algorithms, truncate, args.preimage_width,
+                                            keyspace=keyspace)
     mode = 'wb'
     if path.exists(args.output) and path.isfile(args.output):
         prompt = input(PROMPT+'File already exists %s [w/a/skip]: ' % args.output)
@@ -131,12 +290,29 @@ def main(args):
             mode = 'ab'
         elif prompt.lower() != 'w':
             mode = None
+    if mode == 'ab' and header is not None:
+        try:
+            with open(args.output, 'rb') as fp:
+                existing = TableHeader.read(fp).to_dict()
+        except TableFormatError:
+            existing = None
+        if existing != header.to_dict():
+            sys.stdout.write(WARN + 'Cannot append, %s is not a matching binary table\n' % args.output)
+            mode = None
     if mode is not None:
         fout = open(args.output, mode)
+        if mode == 'wb' and header is not None:
+            fout.write(header.to_bytes())
         sys.stdout.write(clear + INFO + "Creating " + bold)
         sys.stdout.write(','.join([k for k in hash_algorithms]) + W + " index ...\n")
         sys.stdout.flush()
-        index_wordlist(fword, fout, hash_algorithms, flock)
+        if 1 < args.jobs:
+            index_wordlist_parallel(args.wordlist, fout, hash_algorithms, args.jobs,
+                                    rules, mask_block, args.prepend, header, truncate)
+        else:
+            fword = open(args.wordlist, 'rb')
+            index_wordlist(fword, fout, hash_algorithms, flock, rules, mask_block, args.prepend, header,
+                           truncate)
         sys.stdout.write(clear + INFO + "Completed index file %s\n" % args.output)
     sys.stdout.write(clear + MONEY + 'All Done.\n')
 
@@ -151,12 +327,63 @@ if __name__ == '__main__':
     parser.add_argument('-a',
         nargs='*',
         dest='algorithms',
-        help='hashing algorithm to use: %s' % (['all']+ sorted(algorithms.keys())),
+        help='hashing algorithm to use: %s, salted algorithms %s with each user of -U' % (
+            ['all']+ sorted(algorithms.keys()), sorted(salted_algorithms.keys())),
         required=True)
+    parser.add_argument('-U',
+        nargs='+',
+        dest='users',
+        help='users to salt the salted algorithms of -a with, e.g. -a postgres_md5 -U root bob',
+        default=None)
     parser.add_argument('-o',
         dest='output',
         default=getcwd(),
         help='output directory to write data to')
+    parser.add_argument('-j',
+        type=int,
+        dest='jobs',
+        default=1,
+        help='number of worker processes, the wordlist is split on line boundaries')
+    parser.add_argument('-r',
+        dest='rules',
+        default=None,
+        help='mangle each word with the rules in this file (hashcat/john style)')
+    parser.add_argument('-m',
+        dest='mask',
+        default=None,
+        help='combine each word with every value of a mask (e.g. ?d?d?d?d)')
+    parser.add_argument('-C',
+        action='append',
+        dest='custom_charsets',
+        default=None,
+        help='custom charset for the mask, referenced as ?1 - ?4 in order given')
+    parser.add_argument('-P',
+        action='store_true',
+        dest='prepend',
+        default=False,
+        help='put the mask before each word instead of after')
+    parser.add_argument('-f',
+        choices=[JSON, BINARY],
+        dest='format',
+        default=JSON,
+        help='write JSON lines, or fixed width binary records (see table_format.py)')
+    parser.add_argument('-W',
+        type=int,
+        dest='preimage_width',
+        default=64,
+        help='max bytes of a candidate in binary records, longer candidates are skipped')
+    parser.add_argument('-T',
+        type=parse_truncate,
+        dest='truncate',
+        default=TRUNCATE,
+        help='bytes to truncate digests to, or %s to pick them from the number of candidates and -R '
+             '(default: %d)' % (AUTO, TRUNCATE))
+    parser.add_argument('-R',
+        type=float,
+        dest='collision_rate',
+        default=COLLISION_RATE,
+        help='with -T %s, the chance a hash not in the table matches a row anyway (default: %s)'
+             % (AUTO, COLLISION_RATE))
     args = parser.parse_args()
     if path.exists(args.wordlist) and path.isfile(args.wordlist):
         main(args)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+'''
+
+> Hashcat/John style word mangling rules, applied to words as they stream in
+
+Each line of a rule file is one rule, and each rule turns a word into one
+candidate. Supported functions (N is a position 0-9 A-Z, X/Y are chars):
+
+    :      do nothing                 l      lowercase
+    u      uppercase                  c      capitalize
+    C      invert capitalize          t      toggle case
+    TN     toggle case at N           r      reverse
+    d      duplicate                  pN     append duplicated N times
+    f      reflect (word + reversed)  {      rotate left
+    }      rotate right               $X     append X
+    ^X     prepend X                  [      delete first char
+    ]      delete last char           DN     delete at N
+    'N     truncate at N              iNX    insert X at N
+    oNX    overwrite at N with X      sXY    replace all X with Y
+    @X     purge all X                zN     duplicate first char N times
+    ZN     duplicate last char N times
+
+Reject functions keep the word unchanged when it passes and reject it
+otherwise:
+
+    <N     length less than N         >N     length greater than N
+    _N     length equal to N          !X     does not contain X
+    /X     contains X                 (X     starts with X
+    )X     ends with X                =NX    X at position N
+    %NX    at least N instances of X
+
+Rules that reference a position past the end of the word reject it too.
+Lines starting with "#" or that are empty are skipped.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import sys
+
+from string import digits, ascii_uppercase
+
+POSITIONS = digits + ascii_uppercase
+
+
+class RuleRejected(Exception):
+    ''' The rule cannot be applied to this word '''
+    pass
+
+
+class RuleError(ValueError):
+    ''' The rule could not be parsed '''
+    pass
+
+
+def _position(word, position):
+    if len(word) <= position:
+        raise RuleRejected()
+    return position
+
+
+def _toggle_at(word, position):
+    position = _position(word, position)
+    return word[:position] + word[position:position + 1].swapcase() + word[position + 1:]
+
+
+def _delete_at(word, position):
+    position = _position(word, position)
+    return word[:position] + word[position + 1:]
+
+
+def _insert_at(word, position, char):
+    if len(word) < position:
+        raise RuleRejected()
+    return word[:position] + char + word[position:]
+
+
+def _overwrite_at(word, position, char):
+    position = _position(word, position)
+    return word[:position] + char + word[position + 1:]
+
+
+def _truncate_at(word, position):
+    if len(word) < position:
+        raise RuleRejected()
+    return word[:position]
+
+
+def _reject_unless(word, condition):
+    if not condition:
+        raise RuleRejected()
+    return word
+
+
+def _rotate_left(word):
+    return word[1:] + word[:1]
+
+
+def _rotate_right(word):
+    return word[-1:] + word[:-1]
+
+
+def _invert_capitalize(word):
+    return word[:1].lower() + word[1:].upper()
+
+
+# Function char -> (arguments, implementation), argument types are
+# "N" for a position and "X" for a char
+FUNCTIONS = {
+    ':': ('', lambda word: word),
+    'l': ('', lambda word: word.lower()),
+    'u': ('', lambda word: word.upper()),
+    'c': ('', lambda word: word.capitalize()),
+    'C': ('', _invert_capitalize),
+    't': ('', lambda word: word.swapcase()),
+    'T': ('N', _toggle_at),
+    'r': ('', lambda word: word[::-1]),
+    'd': ('', lambda word: word + word),
+    'p': ('N', lambda word, count: word * (count + 1)),
+    'f': ('', lambda word: word + word[::-1]),
+    '{': ('', _rotate_left),
+    '}': ('', _rotate_right),
+    '$': ('X', lambda word, char: word + char),
+    '^': ('X', lambda word, char: char + word),
+    '[': ('', lambda word: word[1:]),
+    ']': ('', lambda word: word[:-1]),
+    'D': ('N', _delete_at),
+    "'": ('N', _truncate_at),
+    'i': ('NX', _insert_at),
+    'o': ('NX', _overwrite_at),
+    's': ('XX', lambda word, char, replacement: word.replace(char, replacement)),
+    '@': ('X', lambda word, char: word.replace(char, b'')),
+    'z': ('N', lambda word, count: word[:1] * count + word),
+    'Z': ('N', lambda word, count: word + word[-1:] * count),
+    '<': ('N', lambda word, length: _reject_unless(word, len(word) < length)),
+    '>': ('N', lambda word, length: _reject_unless(word, len(word) > length)),
+    '_': ('N', lambda word, length: _reject_unless(word, len(word) == length)),
+    '!': ('X', lambda word, char: _reject_unless(word, char not in word)),
+    '/': ('X', lambda word, char: _reject_unless(word, char in word)),
+    '(': ('X', lambda word, char: _reject_unless(word, word[:1] == char)),
+    ')': ('X', lambda word, char: _reject_unless(word, word[-1:] == char)),
+    '=': ('NX', lambda word, position, char: _reject_unless(
+        word, word[position:position + 1] == char)),
+    '%': ('NX', lambda word, count, char: _reject_unless(word, count <= word.count(char))),
+}
+
+
+class Rule(object):
+    ''' A single parsed rule, call it with a word (bytes) to mangle it '''
+
+    def __init__(self, text):
+        self.text = text
+        self.operations = self._parse(text)
+
+    def _parse(self, text):
+        operations = []
+        index = 0
+        while index < len(text):
+            name = text[index]
+            index += 1
+            if name == ' ':
+                continue
+            if name not in FUNCTIONS:
+                raise RuleError('Unknown rule function %r in %r' % (name, self.text))
+            arg_types, func = FUNCTIONS[name]
+            if len(text) < index + len(arg_types):
+                raise RuleError('Missing arguments for %r in %r' % (name, self.text))
+            args = []
+            for arg_type in arg_types:
+                arg = text[index]
+                index += 1
+                if arg_type == 'N':
+                    if arg not in POSITIONS:
+                        raise RuleError('Invalid position %r in %r' % (arg, self.text))
+                    args.append(POSITIONS.index(arg))
+                else:
+                    args.append(arg.encode())
+            operations.append((func, tuple(args)))
+        return operations
+
+    def __call__(self, word):
+        ''' Returns the mangled word, or None if the rule rejects it '''
+        try:
+            for func, args in self.operations:
+                word = func(word, *args)
+        except RuleRejected:
+            return None
+        return word
+
+    def __str__(self):
+        return self.text
+
+
+def load_rules(fpath):
+    ''' Parse a rule file, one rule per line '''
+    rules = []
+    with open(fpath, 'r') as fp:
+        for line in fp:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            rules.append(Rule(line))
+    return rules
+
+
+def mutate(word, rules):
+    ''' Yield each candidate `rules` produce for `word` '''
+    for rule in rules:
+        candidate = rule(word)
+        if candidate is not None:
+            yield candidate
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.stderr.write('Usage: %s <rule file> <wordlist>\n' % sys.argv[0])
+        sys.exit(1)
+    rules = load_rules(sys.argv[1])
+    with open(sys.argv[2], 'rb') as fword:
+        for line in fword:
+            for candidate in mutate(line.rstrip(b'\r\n'), rules):
+                sys.stdout.buffer.write(candidate + b'\n')
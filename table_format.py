@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+'''
+
+> Compact fixed width binary tables, and conversion back to NDJSON
+
+A table is a small header followed by fixed width records:
+
+    magic       4 bytes, "BRT1"
+    length      uint32 (little endian), length of the JSON header
+    header      JSON, algorithms, digest widths, truncation, charset ...
+
+Each record starts with the preimage, then the raw (truncated) digest of
+every algorithm in header order. How the preimage is stored depends on the
+header's `preimage` mode:
+
+    inline      one length byte and the preimage padded with NULs to
+                `preimage_width`
+    rank        the preimage's rank in the keyspace as a uint64
+    implicit    nothing, the rank is `start` + the record's index
+
+Rank and implicit tables only work for keyspaces that can be rebuilt from
+the header (a charset, mask, policy, markov or increment keyspace), their
+preimages are unranked on demand. Records are packed and unpacked a whole
+batch at a time, one byte column at a time.
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import os
+import sys
+import copy
+import json
+import math
+import struct
+import argparse
+
+from algorithms import digest_width, encode_digests
+from generate_seeded_keyspace import KeyspaceGenerator, keyspace_from_dict
+
+MAGIC = b'BRT1'
+VERSION = 1
+MAX_PREIMAGE_WIDTH = 255
+RANK_WIDTH = 8
+BATCH_RECORDS = 4096  # Records read per batch
+INLINE, RANK, IMPLICIT = 'inline', 'rank', 'implicit'
+PREIMAGE_MODES = (INLINE, RANK, IMPLICIT)
+TRUNCATE = 6  # Default bytes digests are truncated to, what the lambda queries with
+AUTO = 'auto'
+COLLISION_RATE = 0.001  # Default chance a hash that isn't in a table matches a row anyway
+MIN_TRUNCATE = 4
+
+
+class TableFormatError(ValueError):
+    ''' The file is not a table, or not one we can read '''
+    pass
+
+
+def batch_ranks(start, count):
+    ''' Ranks of a batch, `start` is the rank of its first preimage or a list of every rank '''
+    if isinstance(start, int):
+        return range(start, start + count)
+    if len(start) != count:
+        raise ValueError('Every preimage needs a rank')
+    return start
+
+
+def truncate_width(cardinality, collision_rate=COLLISION_RATE):
+    '''
+    Fewest bytes to truncate digests to so a hash that isn't in a table of
+    `cardinality` rows matches one with at most `collision_rate` chance
+    '''
+    if not 0 < collision_rate < 1:
+        raise ValueError('Collision rate must be between 0 and 1')
+    bits = math.log(max(1, cardinality) / collision_rate, 2)
+    return max(MIN_TRUNCATE, int(math.ceil(bits / 8)))
+
+
+def parse_truncate(value):
+    ''' A -T argument, bytes or AUTO to pick them with `truncate_width` '''
+    if value == AUTO:
+        return AUTO
+    try:
+        width = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Truncation must be a number of bytes or %s' % AUTO)
+    if width < 1:
+        raise argparse.ArgumentTypeError('Truncation must be at least 1 byte')
+    return width
+
+
+class TableHeader(object):
+    ''' Layout of a table's records, plus what generated them '''
+
+    def __init__(self, algorithms, digest_widths, preimage_width, truncate=None,
+                 charset=None, keyspace=None, preimage=INLINE, start=0):
+        if len(algorithms) != len(digest_widths):
+            raise ValueError('Every algorithm needs a digest width')
+        if not 0 < preimage_width <= MAX_PREIMAGE_WIDTH:
+            raise ValueError('Preimage width must be 1 - %d' % MAX_PREIMAGE_WIDTH)
+        if preimage not in PREIMAGE_MODES:
+            raise ValueError('Preimage mode must be one of %s' % ', '.join(PREIMAGE_MODES))
+        self.algorithms = list(algorithms)
+        self.digest_widths = list(digest_widths)
+        self.preimage_width = preimage_width
+        self.truncate = truncate
+        self.charset = charset
+        self.keyspace = keyspace
+        self.preimage = preimage
+        self.start = start
+        self._keyspace = None
+        if preimage != INLINE:
+            # Fail now rather than when the preimages are needed
+            self.unrank(start)
+
+    @classmethod
+    def for_algorithms(cls, hash_algorithms, truncate, preimage_width, charset=None, keyspace=None,
+                       preimage=INLINE, start=0):
+        '''
+        Header for digests of `hash_algorithms` (key -> algorithm) truncated to
+        `truncate` bytes, `keyspace` is a keyspace object (see `to_dict`)
+        '''
+        widths = [digest_width(algo, truncate) for algo in hash_algorithms.values()]
+        keyspace = keyspace.to_dict() if keyspace is not None else None
+        return cls(list(hash_algorithms), widths, preimage_width, truncate, charset, keyspace,
+                   preimage, start)
+
+    @property
+    def preimage_field_width(self):
+        if self.preimage == INLINE:
+            return 1 + self.preimage_width
+        return RANK_WIDTH if self.preimage == RANK else 0
+
+    @property
+    def record_width(self):
+        return self.preimage_field_width + sum(self.digest_widths)
+
+    def offset(self, algorithm):
+        ''' Offset of an algorithm's digest within a record '''
+        index = self.algorithms.index(algorithm)
+        return self.preimage_field_width + sum(self.digest_widths[:index])
+
+    def unrank(self, rank):
+        ''' The preimage (bytes) at `rank` in the table's keyspace '''
+        if self.keyspace is None:
+            if self.charset is None:
+                raise ValueError('Table has no keyspace or charset to unrank with')
+            return KeyspaceGenerator.unrank(rank, self.charset).encode()
+        if self._keyspace is None:
+            self._keyspace = keyspace_from_dict(self.keyspace)
+        return self._keyspace.unrank(rank).encode()
+
+    def with_start(self, start):
+        ''' Copy of the header for a table whose first record has rank `start` '''
+        header = copy.copy(self)
+        header.start = start
+        return header
+
+    def preimage_of(self, key):
+        ''' A preimage from `unpack`, which is either the preimage or its rank '''
+        return self.unrank(key) if isinstance(key, int) else key
+
+    def to_dict(self):
+        return {
+            'version': VERSION,
+            'algorithms': self.algorithms,
+            'digest_widths': self.digest_widths,
+            'preimage_width': self.preimage_width,
+            'truncate': self.truncate,
+            'charset': self.charset,
+            'keyspace': self.keyspace,
+            'preimage': self.preimage,
+            'start': self.start,
+        }
+
+    def to_bytes(self):
+        header = json.dumps(self.to_dict()).encode()
+        return MAGIC + struct.pack('<I', len(header)) + header
+
+    @classmethod
+    def read(cls, fp):
+        ''' Read the header from the start of a table, leaves `fp` at the first record '''
+        prefix = fp.read(len(MAGIC) + 4)
+        if len(prefix) != len(MAGIC) + 4 or prefix[:len(MAGIC)] != MAGIC:
+            raise TableFormatError('Not a binary table')
+        length = struct.unpack('<I', prefix[len(MAGIC):])[0]
+        return cls.from_dict(json.loads(fp.read(length).decode()))
+
+    @classmethod
+    def from_dict(cls, header):
+        ''' The inverse of `to_dict` '''
+        if header.get('version') != VERSION:
+            raise TableFormatError('Unsupported table version %r' % header.get('version'))
+        return cls(header['algorithms'], header['digest_widths'], header['preimage_width'],
+                   header.get('truncate'), header.get('charset'), header.get('keyspace'),
+                   header.get('preimage', INLINE), header.get('start', 0))
+
+    def _interleave(self, data, offset, width, column):
+        for index in range(width):
+            data[offset + index::self.record_width] = column[index::width]
+
+    def _deinterleave(self, data, offset, width):
+        column = bytearray((len(data) // self.record_width) * width)
+        for index in range(width):
+            column[index::width] = data[offset + index::self.record_width]
+        return column
+
+    def pack(self, preimages, digests, start=None):
+        '''
+        Records for a batch of `preimages` (bytes) and their `digests`, a dict of
+        algorithm -> packed digests in the same order (see digest_all). Rank
+        tables also need `start`, the rank of the first preimage (the rest
+        follow on) or a list with the rank of each.
+        '''
+        count = len(preimages)
+        data = bytearray(count * self.record_width)
+        if self.preimage == INLINE:
+            lengths = [len(preimage) for preimage in preimages]
+            if any(self.preimage_width < length for length in lengths):
+                raise ValueError('Preimage is wider than the table')
+            data[0::self.record_width] = bytes(lengths)
+            padded = b''.join([preimage.ljust(self.preimage_width, b'\x00') for preimage in preimages])
+            self._interleave(data, 1, self.preimage_width, padded)
+        elif self.preimage == RANK:
+            if start is None:
+                raise ValueError('Rank tables need the rank of the first preimage')
+            ranks = struct.pack('<%dQ' % count, *batch_ranks(start, count))
+            self._interleave(data, 0, RANK_WIDTH, ranks)
+        for algorithm, width in zip(self.algorithms, self.digest_widths):
+            self._interleave(data, self.offset(algorithm), width, digests[algorithm])
+        return bytes(data)
+
+    def unpack(self, data, index=0):
+        '''
+        The inverse of `pack`, returns `(preimages, digests)` for a batch of
+        records. Rank and implicit tables return ranks instead of preimages,
+        implicit ranks are relative to `index` the first record's index.
+        '''
+        if len(data) % self.record_width:
+            raise TableFormatError('Truncated record')
+        count = len(data) // self.record_width
+        if self.preimage == INLINE:
+            lengths = data[0::self.record_width]
+            padded = self._deinterleave(data, 1, self.preimage_width)
+            preimages = []
+            for position, length in enumerate(lengths):
+                offset = position * self.preimage_width
+                preimages.append(bytes(padded[offset:offset + length]))
+        elif self.preimage == RANK:
+            ranks = self._deinterleave(data, 0, RANK_WIDTH)
+            preimages = list(struct.unpack('<%dQ' % count, ranks))
+        else:
+            preimages = list(range(self.start + index, self.start + index + count))
+        digests = {}
+        for algorithm, width in zip(self.algorithms, self.digest_widths):
+            digests[algorithm] = self._deinterleave(data, self.offset(algorithm), width)
+        return preimages, digests
+
+
+class TableWriter(object):
+    '''
+    Writes a header then batches of records to a binary file object, the
+    batches of an implicit table must be written in rank order from `start`
+    '''
+
+    def __init__(self, fp, header):
+        self.fp = fp
+        self.header = header
+        self.next_rank = header.start
+        self.fp.write(header.to_bytes())
+
+    def write_batch(self, preimages, digests, start=None):
+        ''' Write a batch of records, `start` is the rank of the first preimage (see `pack`) '''
+        if self.header.preimage == IMPLICIT and start != self.next_rank:
+            raise ValueError('Implicit tables must be written in rank order')
+        self.fp.write(self.header.pack(preimages, digests, start))
+        if isinstance(start, int):
+            self.next_rank = start + len(preimages)
+
+    def close(self):
+        self.fp.close()
+
+
+class TableReader(object):
+    ''' Reads the records of a binary table in batches '''
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.header = TableHeader.read(fp)
+        self.data_offset = fp.tell()
+
+    @classmethod
+    def open(cls, fpath):
+        return cls(open(fpath, 'rb'))
+
+    def __len__(self):
+        size = os.fstat(self.fp.fileno()).st_size
+        return (size - self.data_offset) // self.header.record_width
+
+    def batches(self, count=BATCH_RECORDS, start=0, stop=None):
+        '''
+        Yield `(preimages, digests)` for up to `count` records at a time, for
+        rank and implicit tables the preimages are ranks (see `preimage_of`).
+        `start` and `stop` limit the records read by index.
+        '''
+        index = start
+        self.fp.seek(self.data_offset + start * self.header.record_width)
+        while stop is None or index < stop:
+            limit = count if stop is None else min(count, stop - index)
+            data = self.fp.read(limit * self.header.record_width)
+            if not data:
+                break
+            batch = self.header.unpack(data, index)
+            index += len(batch[0])
+            yield batch
+
+    def __iter__(self):
+        ''' Yield `(preimage, {algorithm: digest})` for each record, unranking if needed '''
+        for preimages, digests in self.batches():
+            for index, preimage in enumerate(preimages):
+                record = {}
+                for algorithm, width in zip(self.header.algorithms, self.header.digest_widths):
+                    record[algorithm] = bytes(digests[algorithm][index * width:(index + 1) * width])
+                yield self.header.preimage_of(preimage), record
+
+    def close(self):
+        self.fp.close()
+
+
+class NdjsonWriter(object):
+    ''' Writes batches as the same JSON lines the generators write, for `header`'s algorithms '''
+
+    def __init__(self, fp, header):
+        self.fp = fp
+        self.header = header
+
+    def write_batch(self, preimages, digests, start=None):
+        columns = {}
+        for algorithm, width in zip(self.header.algorithms, self.header.digest_widths):
+            columns[algorithm] = encode_digests(digests[algorithm], width)
+        lines = []
+        for index, preimage in enumerate(preimages):
+            results = {"preimage": preimage.decode()}
+            for algorithm, column in columns.items():
+                results[algorithm] = column[index]
+            lines.append(json.dumps(results)+"\n")
+        self.fp.write(''.join(lines))
+
+    def close(self):
+        self.fp.close()
+
+
+def to_ndjson(reader, fout):
+    ''' Write a table as the same JSON lines the generators write '''
+    writer = NdjsonWriter(fout, reader.header)
+    for preimages, digests in reader.batches():
+        writer.write_batch([reader.header.preimage_of(preimage) for preimage in preimages], digests)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert binary tables to NDJSON (e.g. for BigQuery)')
+    parser.add_argument('tables',
+        nargs='+',
+        help='binary table file(s)')
+    parser.add_argument('-o', '--output',
+        dest='output',
+        default=None,
+        help='write NDJSON to this file instead of stdout')
+    parser.add_argument('-H', '--header',
+        action='store_true',
+        dest='header',
+        default=False,
+        help='only print the header of each table')
+    args = parser.parse_args()
+    fout = open(args.output, 'w') if args.output is not None else sys.stdout
+    try:
+        for fpath in args.tables:
+            reader = TableReader.open(fpath)
+            try:
+                if args.header:
+                    fout.write(json.dumps(reader.header.to_dict())+"\n")
+                else:
+                    to_ndjson(reader, fout)
+            finally:
+                reader.close()
+    finally:
+        if fout is not sys.stdout:
+            fout.close()
@@ -0,0 +1,82 @@
+import hashlib
+
+from binascii import hexlify
+
+import pytest
+
+from algorithms import _md4, md4, Ntlm, MySql323, MySql41, PostgresMd5, Msdcc, Msdcc2
+from algorithms import with_users, get_algorithm
+
+passlib_hash = pytest.importorskip('passlib.hash')
+passlib_digest = pytest.importorskip('passlib.crypto.digest')
+
+USERS = ['root', 'Administrator', 'j_rgen2']
+PASSWORDS = [
+    b'',
+    b'password',
+    'pässwörd'.encode(),  # Non-ASCII
+    'é'.encode() * 40,  # Over 64 bytes, cut in the middle of a char
+    b'x' * 100,  # Over 64 bytes
+    'ü'.encode() * 70,  # Over 127 bytes
+    b'y' * 200,  # Over 127 bytes
+]
+
+
+def cut(data, length):
+    ''' What the native algorithms hash of `data`, its first `length` bytes as text '''
+    return data[:length].decode('utf-8', 'ignore')
+
+
+def test_md4_fallback():
+    # RFC 1320 test suite
+    assert hexlify(_md4(b'')) == b'31d6cfe0d16ae931b73c59d7e0c089c0'
+    assert hexlify(_md4(b'abc')) == b'a448017aaf21d8525fc10ae87aa6729d'
+    assert hexlify(_md4(b'12345678901234567890123456789012345678901234567890123456789012345678901234567890')) \
+        == b'e33b4ddc9c38f2199c3e7b164fcc0536'
+    reference = passlib_digest.lookup_hash('md4').const
+    for data in PASSWORDS + [b'z' * length for length in range(50, 130)]:
+        assert _md4(data) == reference(data).digest()
+        assert md4(data) == _md4(data)
+
+
+@pytest.mark.parametrize('data', PASSWORDS)
+def test_ntlm(data):
+    assert hexlify(Ntlm._hash(data)).decode() == passlib_hash.nthash.hash(cut(data, 127))
+
+
+@pytest.mark.parametrize('data', PASSWORDS)
+def test_mysql(data):
+    assert hexlify(MySql323._hash(data)).decode() == passlib_hash.mysql323.hash(data[:64])
+    assert '*' + hexlify(MySql41._hash(data)).decode().upper() == passlib_hash.mysql41.hash(data[:64])
+    assert MySql41._derive(data, hashlib.sha1(data).digest()) == MySql41._hash(data)
+
+
+@pytest.mark.parametrize('user', USERS)
+@pytest.mark.parametrize('data', PASSWORDS)
+def test_postgres_md5(data, user):
+    expected = passlib_hash.postgres_md5.hash(data[:64], user=user)
+    assert 'md5' + hexlify(PostgresMd5.with_user(user)._hash(data)).decode() == expected
+
+
+@pytest.mark.parametrize('user', USERS)
+@pytest.mark.parametrize('data', PASSWORDS)
+def test_msdcc(data, user):
+    msdcc, msdcc2 = Msdcc.with_user(user), Msdcc2.with_user(user)
+    assert hexlify(msdcc._hash(data)).decode() == passlib_hash.msdcc.hash(cut(data, 64), user=user)
+    assert hexlify(msdcc2._hash(data)).decode() == passlib_hash.msdcc2.hash(cut(data, 64), user=user)
+    assert msdcc._derive(data, Ntlm._hash(data)) == msdcc._hash(data)
+
+
+@pytest.mark.parametrize('user', ['john.doe', 'a b', '', 'x' * 65, 'root\n', 'jürgen'])
+def test_invalid_users(user):
+    with pytest.raises(ValueError):
+        with_users(['postgres_md5'], [user])
+    with pytest.raises(ValueError):
+        PostgresMd5.with_user(user)
+    assert get_algorithm('postgres_md5_' + user) is None
+
+
+def test_users():
+    selected = with_users(['md5', 'postgres_md5', 'msdcc'], ['root', 'Bob_2'])
+    assert sorted(selected) == ['md5', 'msdcc_bob_2', 'msdcc_root', 'postgres_md5_Bob_2', 'postgres_md5_root']
+    assert get_algorithm('postgres_md5_Bob_2') is selected['postgres_md5_Bob_2']
@@ -0,0 +1,55 @@
+import hashlib
+
+from base64 import b64encode
+
+import pytest
+
+from bloom_filter import BloomFilter, build_filter, filter_path, prune
+from sorted_index import IndexHeader, IndexReader, IndexWriter, index_path
+from table_format import TableFormatError
+
+WIDTH = 4
+
+
+def md5(data):
+    return hashlib.md5(data).digest()[:WIDTH]
+
+
+@pytest.fixture
+def index(tmp_path):
+    # Every digest appears three times, as if truncation collided
+    records = sorted((md5(b'%d' % index), b'p%d%d' % (index, copy))
+                     for index in range(500) for copy in range(3))
+    fpath = index_path(str(tmp_path), 'md5')
+    writer = IndexWriter(fpath, IndexHeader('md5', WIDTH, 8))
+    writer.write(records)
+    writer.close()
+    reader = IndexReader(fpath)
+    yield reader
+    reader.close()
+
+
+def test_filter_holds_each_distinct_digest_once(index, tmp_path):
+    bloom = build_filter(index, 0.01)
+    assert bloom.count == 500
+    assert bloom.bits == BloomFilter.for_capacity('md5', WIDTH, 500, 0.01).bits
+    assert all(md5(b'%d' % index) in bloom for index in range(500))
+    missing = sum(md5(b'missing%d' % index) in bloom for index in range(2000))
+    assert missing < 2000 * 0.05
+    fpath = filter_path(index_path(str(tmp_path), 'md5'))
+    bloom.save(fpath)
+    again = BloomFilter.load(fpath)
+    assert again.to_dict() == bloom.to_dict() and again.data == bloom.data
+    with open(fpath, 'r+b') as fp:
+        fp.truncate(fp.seek(0, 2) - 1)
+    with pytest.raises(TableFormatError):
+        BloomFilter.load(fpath)
+
+
+def test_prune(index):
+    bloom = build_filter(index, 0.01)
+    present = b64encode(hashlib.md5(b'7').digest()).decode()
+    truncated = b64encode(md5(b'8')).decode()
+    assert prune(bloom, [present, truncated]) == [present, truncated]
+    malformed = ['', 'not base64!', present[:-1], present + '@', b64encode(md5(b'9')[:2]).decode(), None]
+    assert prune(bloom, malformed) == []
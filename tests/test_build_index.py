@@ -0,0 +1,50 @@
+import json
+import hashlib
+
+from base64 import b64encode
+
+import build_index
+
+from sorted_index import IndexReader
+
+WIDTH = 6
+
+
+def md5(data):
+    return hashlib.md5(data).digest()[:WIDTH]
+
+
+def write_table(fpath, words):
+    with open(fpath, 'w') as fp:
+        for word in words:
+            fp.write(json.dumps({'preimage': word.decode(), 'md5': b64encode(md5(word)).decode()}) + '\n')
+
+
+def test_merge_sorts_and_drops_duplicates(tmp_path):
+    words = [b'word%d' % (index * 7 % 40) for index in range(40)]
+    # Two unsorted tables that overlap, and repeat words within themselves
+    tables = {}
+    for name, chunk in (('a.json', words[:30] + words[:5]), ('b.json', words[20:] + words[::-3])):
+        fpath = str(tmp_path / name)
+        write_table(fpath, chunk)
+        tables[fpath] = build_index.describe(fpath)
+    templates = build_index.index_templates(tables, [], build_index.INLINE)
+    run_dir = tmp_path / 'runs'
+    run_dir.mkdir()
+    run_paths = []
+    for fpath, (kind, _) in tables.items():
+        for start, stop in build_index.split_table(fpath, kind, 3):
+            task = (fpath, kind, start, stop, templates, build_index.INLINE, str(run_dir), 4)
+            runs, skipped = build_index.generate_runs(task)
+            assert skipped == 0
+            run_paths.extend(run_path for _, run_path in runs)
+    # A fan in of 2 merges the runs in several passes
+    assert 4 < len(run_paths)
+    algorithm, fpath = build_index.merge_algorithm(('md5', run_paths, str(tmp_path), str(run_dir), 2, 0))
+    assert algorithm == 'md5'
+    reader = IndexReader(fpath)
+    try:
+        assert list(reader) == sorted(set((md5(word), word) for word in words))
+    finally:
+        reader.close()
+    assert list(run_dir.iterdir()) == []
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import columnar
+
+from algorithms import algorithms, digest_all
+from generate_seeded_keyspace import MaskKeyspace
+from table_format import TableHeader, TableWriter, TableReader, INLINE, RANK, IMPLICIT
+
+SELECTED = {key: algorithms[key] for key in ('md5', 'sha1')}
+MASK = MaskKeyspace('?1?d', ['abc'])
+WORDS = [MASK.unrank(rank).encode() for rank in range(MASK.count)]
+
+
+def write_table(fpath, preimage):
+    ''' A binary table of `WORDS` with a gap in the ranks, so the conversion splits batches '''
+    header = TableHeader.for_algorithms(SELECTED, 6, 2, keyspace=MASK, preimage=preimage)
+    writer = TableWriter(open(fpath, 'wb'), header)
+    kept = list(range(len(WORDS))) if preimage == IMPLICIT else \
+        [rank for rank in range(len(WORDS)) if rank != 12]
+    preimages = [WORDS[rank] for rank in kept]
+    writer.write_batch(preimages, digest_all(SELECTED, preimages, 6), kept if preimage != IMPLICIT else 0)
+    writer.close()
+    return preimages
+
+
+def convert(tmp_path, preimage):
+    fpath = str(tmp_path / 'table.bin')
+    preimages = write_table(fpath, preimage)
+    reader = TableReader.open(fpath)
+    try:
+        columnar.convert(reader, str(tmp_path / 'table'))
+    finally:
+        reader.close()
+    return preimages
+
+
+@pytest.mark.parametrize('preimage', [INLINE, RANK, IMPLICIT])
+def test_column_files_round_trip(tmp_path, monkeypatch, preimage):
+    monkeypatch.setattr(columnar, 'pyarrow', None)
+    preimages = convert(tmp_path, preimage)
+    reader = columnar.ColumnReader(str(tmp_path / 'table'))
+    assert reader.header.preimage == preimage
+    assert len(reader) == len(preimages)
+    assert [reader.preimage(index) for index in range(len(reader))] == preimages
+    for algorithm in SELECTED:
+        packed = b''.join(reader.digests(algorithm, count=7))
+        assert packed == bytes(digest_all(SELECTED, preimages, 6)[algorithm])
+
+
+@pytest.mark.parametrize('preimage', [INLINE, RANK, IMPLICIT])
+def test_parquet_round_trip(tmp_path, preimage):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    preimages = convert(tmp_path, preimage)
+    table = parquet.read_table(str(tmp_path / 'table.parquet'))
+    header = TableHeader.from_dict(json.loads(table.schema.metadata[columnar.HEADER_METADATA]))
+    assert header.preimage == preimage
+    assert table.num_rows == len(preimages)
+    if preimage == INLINE:
+        assert table.column(columnar.PREIMAGE).to_pylist() == preimages
+    elif preimage == RANK:
+        ranks = table.column(RANK).to_pylist()
+        assert [header.preimage_of(rank) for rank in ranks] == preimages
+    else:
+        assert table.column_names == list(SELECTED)
+    digests = digest_all(SELECTED, preimages, 6)
+    for algorithm in SELECTED:
+        assert b''.join(table.column(algorithm).to_pylist()) == bytes(digests[algorithm])
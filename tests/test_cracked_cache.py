@@ -0,0 +1,69 @@
+from algorithms import algorithms
+from cracked_cache import CrackedCache, decode_hash
+
+WORDS = [b'password', b'letmein', b'\xff\xferaw', b'']
+
+
+def digest(key, word):
+    return algorithms[key]._hash(word)
+
+
+def test_learned_entries_survive_reopening(tmp_path):
+    fpath = str(tmp_path / 'cracked.log')
+    cache = CrackedCache(fpath)
+    md5 = [digest('md5', word) for word in WORDS]
+    # Candidates from a truncated table hit, only the one that verifies is kept
+    assert cache.learn('md5', md5, [b'nope'] + WORDS) == len(WORDS)
+    assert cache.learn('sha1', [digest('sha1', b'letmein')], [b'password']) == 0
+    assert cache.learn('sha1', [digest('sha1', b'letmein')], [b'letmein']) == 1
+    assert cache.learn('md5', md5, WORDS) == 0
+    cache.close()
+
+    cache = CrackedCache(fpath)
+    try:
+        assert len(cache) == len(WORDS) + 1
+        assert [cache.get('md5', value) for value in md5] == WORDS
+        assert cache.get('sha1', digest('sha1', b'letmein')) == b'letmein'
+        assert cache.get('sha1', digest('sha1', b'password')) is None
+        assert cache.get('sha1', md5[0]) is None
+    finally:
+        cache.close()
+
+
+def test_wrong_preimages_are_rejected(tmp_path):
+    full = digest('md5', b'password')
+    assert CrackedCache.verify('md5', full, b'password')
+    assert not CrackedCache.verify('md5', full, b'Password')
+    # A truncated digest can't be verified, and neither can an unknown algorithm
+    assert not CrackedCache.verify('md5', full[:6], b'password')
+    assert not CrackedCache.verify('nope', full, b'password')
+    cache = CrackedCache(str(tmp_path / 'cracked.log'))
+    try:
+        assert cache.learn('md5', [full], [b'Password', b'pass']) == 0
+        assert cache.get('md5', full) is None and len(cache) == 0
+    finally:
+        cache.close()
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    fpath = tmp_path / 'cracked.log'
+    cache = CrackedCache(str(fpath))
+    cache.add('md5', digest('md5', b'password'), b'password')
+    cache.close()
+    with open(str(fpath), 'ab') as fp:
+        fp.write(b'{"algorithm": "md5", "hash": "')
+    cache = CrackedCache(str(fpath))
+    cache.add('md5', digest('md5', b'letmein'), b'letmein')
+    cache.close()
+    cache = CrackedCache(str(fpath))
+    try:
+        assert len(cache) == 2
+        assert cache.get('md5', digest('md5', b'letmein')) == b'letmein'
+    finally:
+        cache.close()
+
+
+def test_decode_hash():
+    assert decode_hash('cGFzcw==') == b'pass'
+    assert decode_hash('not base64!') is None
+    assert decode_hash(None) is None
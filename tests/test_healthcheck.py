@@ -0,0 +1,43 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+pytest.importorskip('tornado')
+
+from index_lookup import IndexLookup
+
+from test_index_lookup import md5, encode, write_index, sharing_prefix
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'aws', 'beanstalk', 'distgen', 'project'))
+
+from healthcheck import LookupService
+
+
+def test_coalesced_hashes_sharing_a_prefix(tmp_path):
+    write_index(tmp_path, 1)
+    other = sharing_prefix(b'alpha', 1)
+    wanted, unwanted = encode(md5(b'alpha')), encode(md5(other))
+    lookup = IndexLookup([str(tmp_path)])
+    service = LookupService(lookup)
+    probes = []
+    answer = service.answer
+    service.answer = lambda algorithm, hashes: probes.append(set(hashes)) or answer(algorithm, hashes)
+
+    async def queries():
+        first, second = await asyncio.gather(
+            service.query({'algorithm': 'md5', 'hashes': [wanted]}),
+            service.query({'algorithm': 'md5', 'hashes': [unwanted]}))
+        # Answered from the LRU this time
+        again = await service.query({'algorithm': 'md5', 'hashes': [unwanted]})
+        return first, second, again
+
+    try:
+        first, second, again = asyncio.run(queries())
+    finally:
+        lookup.close()
+    assert probes == [{wanted, unwanted}]
+    assert first['results'] == [{'preimage': 'alpha', 'hash': encode(md5(b'alpha')[:1])}]
+    assert second['results'] == [] and again['results'] == []
@@ -0,0 +1,54 @@
+import hashlib
+
+from base64 import b64encode
+
+from index_lookup import IndexLookup
+from sorted_index import IndexHeader, IndexWriter, index_path
+
+WORDS = [b'alpha', b'bravo', b'charlie', b'delta']
+
+
+def md5(data):
+    return hashlib.md5(data).digest()
+
+
+def encode(digest):
+    return b64encode(digest).decode()
+
+
+def write_index(dirpath, width):
+    writer = IndexWriter(index_path(str(dirpath), 'md5'), IndexHeader('md5', width, 8))
+    writer.write(sorted((md5(word)[:width], word) for word in WORDS))
+    writer.close()
+
+
+def sharing_prefix(word, width):
+    ''' A password that isn't in the index whose digest starts like `word`'s '''
+    index = 0
+    while md5(b'other%d' % index)[:width] != md5(word)[:width]:
+        index += 1
+    return b'other%d' % index
+
+
+def test_answers_keyed_by_full_hash(tmp_path):
+    write_index(tmp_path, 1)
+    other = sharing_prefix(b'alpha', 1)
+    wanted, unwanted = encode(md5(b'alpha')), encode(md5(other))
+    lookup = IndexLookup([str(tmp_path)])
+    try:
+        answers = lookup.answers('md5', [wanted, unwanted])
+        assert answers == {wanted: [(b'alpha', encode(md5(b'alpha')[:1]))], unwanted: []}
+        assert lookup.lookup('md5', [unwanted]) == []
+    finally:
+        lookup.close()
+
+
+def test_unverified_answers_match_the_prefix(tmp_path):
+    write_index(tmp_path, 1)
+    other = sharing_prefix(b'alpha', 1)
+    unwanted = encode(md5(other))
+    lookup = IndexLookup([str(tmp_path)], verify=False)
+    try:
+        assert lookup.answers('md5', [unwanted]) == {unwanted: [(b'alpha', encode(md5(b'alpha')[:1]))]}
+    finally:
+        lookup.close()
@@ -0,0 +1,101 @@
+from itertools import product
+
+import pytest
+
+from generate_seeded_keyspace import (
+    HybridKeyspace, KeyspaceGenerator, MaskKeyspace, PolicyKeyspace, iter_candidates)
+
+CHARSET = 'abc'
+
+
+def test_rank_unrank_round_trip():
+    for width in range(1, 4):
+        for position, chars in enumerate(product(CHARSET, repeat=width)):
+            value = ''.join(chars)
+            assert KeyspaceGenerator.rank(value, CHARSET) == position
+            assert KeyspaceGenerator.unrank(position, CHARSET, width) == value
+    assert KeyspaceGenerator.unrank(3, CHARSET) == 'ba'
+    with pytest.raises(ValueError):
+        KeyspaceGenerator.unrank(-1, CHARSET)
+
+
+def test_keyspace_range_and_count():
+    assert KeyspaceGenerator.keyspace_range(2, CHARSET) == (3, 9)
+    assert KeyspaceGenerator.keyspace_range(2, CHARSET, inclusive=True) == (0, 9)
+    assert KeyspaceGenerator.keyspace_count(3, CHARSET) == 27 - 9
+    assert KeyspaceGenerator.keyspace_length('ba', CHARSET) == 6
+
+
+def test_generator_index_is_absolute():
+    # Indexes are ranks in the keyspace, the seed only sets where iteration starts
+    gen = KeyspaceGenerator('ba', charset=CHARSET)
+    assert [gen[position] for position in range(9)] == [
+        KeyspaceGenerator.to_base_n(position, CHARSET) for position in range(9)]
+    assert list(gen[3:]) == list(KeyspaceGenerator('ba', charset=CHARSET))
+    assert list(gen[-2:]) == ['cb', 'cc']
+    assert list(gen[0:9:4]) == ['a', 'bb', 'cc']
+    with pytest.raises(TypeError):
+        gen['a']
+
+
+def test_generator_slice_stops_at_stop():
+    gen = KeyspaceGenerator('aa', stop=5, charset=CHARSET)
+    assert list(gen[:]) == ['a', 'b', 'c', 'ba', 'bb', 'bc']
+    assert len(list(KeyspaceGenerator('aa', stop=5, charset=CHARSET))) == 6
+
+
+def test_mask_round_trip_escapes_question_marks():
+    # ?s contains "?", which has to be queued as "??" to be parsed back as itself
+    mask = MaskKeyspace('?1?2', ['?d?s', 'x??'])
+    again = MaskKeyspace.from_dict(mask.to_dict())
+    assert again.charsets == mask.charsets
+    assert '?' in again.charsets[0] and again.charsets[1] == 'x?'
+    assert [again.unrank(position) for position in range(mask.count)] == [
+        mask.unrank(position) for position in range(mask.count)]
+
+
+def test_generator_index_is_absolute_in_a_mask():
+    gen = KeyspaceGenerator('a5', mask=MaskKeyspace('?l?d'))
+    assert (gen[0], gen[11], gen[-1]) == ('a0', 'b1', 'z9')
+    assert list(gen[:3]) == ['a0', 'a1', 'a2']
+
+
+def test_policy_matches_brute_force():
+    policy = PolicyKeyspace.from_spec('3:?u?d')
+    upper, digits = (set(MaskKeyspace.BUILTIN_CHARSETS[key]) for key in 'ud')
+    alphabet = ''.join(policy.charsets)
+    values = [''.join(chars) for chars in product(alphabet, repeat=3)
+              if upper.intersection(chars) and digits.intersection(chars)]
+    assert policy.count == len(values) == 120120
+    for position in range(0, len(values), 97):
+        assert policy.unrank(position) == values[position]
+        assert policy.rank(values[position]) == position
+    assert list(policy) == values
+    assert list(policy.iterate(1000, 1500)) == values[1000:1500]
+    assert list(policy.iterate(len(values) - 3, len(values) + 10)) == values[-3:]
+    with pytest.raises(ValueError):
+        policy.rank('aaa')
+
+
+@pytest.mark.parametrize('prepend', [False, True])
+def test_hybrid_matches_brute_force(tmp_path, prepend):
+    fpath = tmp_path / 'words.txt'
+    fpath.write_bytes(b'pass\nword\n\xff\xfe\nx\n')
+    hybrid = HybridKeyspace.load(str(fpath), MaskKeyspace('?1?d', ['ab']), prepend)
+    words = [b'pass', b'word', b'x']
+    values = [a.encode() + d.encode() for a, d in product('ab', '0123456789')]
+    expected = [value + word if prepend else word + value
+                for word in words for value in values]
+    assert hybrid.count == len(expected) == 60
+    for word_index, word in enumerate(words):
+        for mask_index, value in enumerate(values):
+            position = word_index * hybrid.mask.count + mask_index
+            assert hybrid.position(word_index, mask_index) == position
+            assert hybrid.indexes(position) == (word_index, mask_index)
+            assert hybrid.unrank(position) == expected[position].decode()
+    assert list(hybrid.candidates()) == expected
+    for start, stop in ((0, 60), (5, 25), (19, 21), (20, 40), (55, 100)):
+        assert list(hybrid.candidates(start, stop)) == expected[start:stop]
+        assert list(iter_candidates(start, stop, keyspace=hybrid)) == expected[start:stop]
+    with pytest.raises(IndexError):
+        hybrid.unrank(60)
@@ -0,0 +1,12 @@
+from line_ranges import split_lines
+
+
+def test_split_lines(tmp_path):
+    fpath = tmp_path / 'words.txt'
+    data = b''.join(b'word%d\n' % index for index in range(1000))
+    fpath.write_bytes(data)
+    for parts in (1, 2, 7, 5000):
+        ranges = split_lines(str(fpath), parts)
+        assert len(ranges) <= parts
+        assert b''.join(data[start:end] for start, end in ranges) == data
+        assert all(start == 0 or data[start - 1:start] == b'\n' for start, _ in ranges)
@@ -0,0 +1,104 @@
+from binascii import hexlify
+
+import pytest
+
+pytest.importorskip('passlib')
+
+import lm_lookup
+import multigen
+
+from algorithms import algorithms, named_algorithms, with_users, digest_all, get_algorithm, Lm, LmHalf
+from table_format import TableHeader, TableWriter, RANK
+from sorted_index import IndexHeader, IndexWriter, index_path
+from generate_seeded_keyspace import IncrementKeyspace, HybridKeyspace, MaskKeyspace, PolicyKeyspace
+
+WORDS = [b'', b'A', b'AB', b'BA', b'ABBA', b'ABABABA', b'B']
+LM_HASHES = [hexlify(Lm._hash(password)).decode() for password in (b'abba', b'ababababa', b'')]
+
+
+def lookup(fpaths):
+    halves = lm_lookup.parse_hashes(LM_HASHES)
+    found = lm_lookup.scan_tables(fpaths, set(half for pair in halves.values() for half in pair))
+    return [lm_lookup.resolve(lm_hash, halves[lm_hash], found) for lm_hash in LM_HASHES]
+
+
+def test_lm_half_not_in_all():
+    assert LmHalf.key not in algorithms
+    assert named_algorithms[LmHalf.key] is LmHalf
+    assert LmHalf.key not in with_users(['all'])
+    assert with_users([LmHalf.key]) == {LmHalf.key: LmHalf}
+    assert get_algorithm(LmHalf.key) is LmHalf
+
+
+def test_json_table(tmp_path):
+    fpath = tmp_path / 'lm_half.json'
+    fpath.write_text(multigen.compute_batch(WORDS, {LmHalf.key: LmHalf}))
+    assert lookup([str(fpath)]) == ['ABBA', 'ABABABABA', '']
+
+
+def test_binary_table(tmp_path):
+    fpath = str(tmp_path / 'lm_half.bin')
+    hash_algorithms = {LmHalf.key: LmHalf}
+    header = TableHeader.for_algorithms(hash_algorithms, multigen.TRUNCATE, LmHalf.max_length)
+    with open(fpath, 'wb') as fp:
+        writer = TableWriter(fp, header)
+        writer.write_batch(WORDS, digest_all(hash_algorithms, WORDS, multigen.TRUNCATE))
+        writer.close()
+    assert lookup([fpath]) == ['ABBA', 'ABABABABA', '']
+
+
+def test_rank_table(tmp_path):
+    fpath = str(tmp_path / 'lm_half.bin')
+    hash_algorithms = {LmHalf.key: LmHalf}
+    keyspace = IncrementKeyspace.from_charset('AB', LmHalf.max_length)
+    words = [keyspace.unrank(rank).encode() for rank in range(keyspace.count)]
+    header = TableHeader.for_algorithms(hash_algorithms, multigen.TRUNCATE, LmHalf.max_length,
+                                        keyspace=keyspace, preimage=RANK)
+    with open(fpath, 'wb') as fp:
+        writer = TableWriter(fp, header)
+        writer.write_batch(words, digest_all(hash_algorithms, words, multigen.TRUNCATE), 0)
+        writer.close()
+    assert lookup([fpath]) == ['ABBA', 'ABABABABA', '']
+
+
+def test_index(tmp_path):
+    hash_algorithms = {LmHalf.key: LmHalf}
+    digests = digest_all(hash_algorithms, WORDS, multigen.TRUNCATE)[LmHalf.key]
+    records = sorted((bytes(digests[index * multigen.TRUNCATE:(index + 1) * multigen.TRUNCATE]), word)
+                     for index, word in enumerate(WORDS))
+    fpath = index_path(str(tmp_path), LmHalf.key)
+    writer = IndexWriter(fpath, IndexHeader(LmHalf.key, multigen.TRUNCATE, LmHalf.max_length))
+    writer.write(records)
+    writer.close()
+    assert lookup([fpath]) == ['ABBA', 'ABABABABA', '']
+
+
+@pytest.mark.parametrize('mask, custom_charsets', [
+    ('?u?d?s', None),
+    ('?1?1', ['?uÄ']),
+    ('PASS?d?d?d', None),
+])
+def test_lm_half_masks(mask, custom_charsets):
+    multigen.check_lm_half(MaskKeyspace(mask, custom_charsets))
+
+
+@pytest.mark.parametrize('mask, custom_charsets', [
+    ('?l?d', None),
+    ('?a', None),
+    ('?1?1', ['AB?l']),
+    ('?1?d', ['Ab']),
+    ('pass?d', None),
+    ('?u?u?u?u?u?u?u?u', None),
+])
+def test_lm_half_rejects_lowercase_and_long_masks(mask, custom_charsets):
+    with pytest.raises(ValueError):
+        multigen.check_lm_half(MaskKeyspace(mask, custom_charsets))
+
+
+def test_lm_half_hybrid_masks():
+    multigen.check_lm_half(HybridKeyspace([b'AB', b'ABBA'], '?d?d'))
+    for words, mask in (([b'ab'], '?d'), ([b'ABBA'], '?l'), ([b'ABBAB'], '?d?d?d')):
+        with pytest.raises(ValueError):
+            multigen.check_lm_half(HybridKeyspace(words, mask))
+    with pytest.raises(ValueError):
+        multigen.check_lm_half(PolicyKeyspace.from_spec('4:?u'))
@@ -0,0 +1,60 @@
+import json
+
+from argparse import Namespace
+from itertools import product
+
+import pytest
+
+import train_markov
+
+from generate_seeded_keyspace import MarkovKeyspace, keyspace_from_dict
+
+CHARSET = 'abcd'
+WORDS = ['abc', 'abd', 'abca', 'bad', 'dab', 'cab', 'abba', 'acdc']
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    wordlist = tmp_path / 'words.txt'
+    wordlist.write_bytes(('\n'.join(WORDS) + '\n').encode())
+    output = str(tmp_path / 'markov.json')
+    train_markov.main(Namespace(wordlist=str(wordlist), charset=CHARSET, output=output))
+    return output
+
+
+def levels_of(markov, value):
+    total, prev = 0, MarkovKeyspace.START
+    for offset, char in enumerate(value):
+        total += dict(markov._transitions(offset, prev))[char]
+        prev = char
+    return total
+
+
+def test_every_value_once_in_level_order(model_path):
+    markov = MarkovKeyspace.load(model_path, 3)
+    values = list(markov)
+    assert sorted(values) == [''.join(chars) for chars in product(CHARSET, repeat=3)]
+    assert len(values) == markov.count == 64
+    levels = [levels_of(markov, value) for value in values]
+    assert levels == sorted(levels)
+    # The trained words come out ahead of the smoothed transitions
+    assert values.index('abc') < values.index('ddd')
+
+
+def test_rank_unrank_and_slices(model_path):
+    markov = MarkovKeyspace.load(model_path, 3)
+    values = list(markov)
+    for position, value in enumerate(values):
+        assert markov.rank(value) == position
+        assert markov.unrank(position) == value
+    assert list(markov.iterate(10, 25)) == values[10:25]
+    assert list(markov.iterate(60, 100)) == values[60:]
+    with pytest.raises(IndexError):
+        markov.unrank(64)
+
+
+def test_to_dict_round_trip(model_path):
+    markov = MarkovKeyspace.load(model_path, 3)
+    again = keyspace_from_dict(json.loads(json.dumps(markov.to_dict())))
+    assert str(again) == str(markov)
+    assert list(again) == list(markov)
@@ -0,0 +1,67 @@
+import hashlib
+
+from argparse import Namespace
+
+import chain_lookup
+import rainbow_chains
+
+from generate_seeded_keyspace import MaskKeyspace
+from rainbow_chains import Chains, chains_path
+
+LENGTH = 20
+
+
+def generate(tmp_path, chains, table=0):
+    args = Namespace(algorithm='md5', keyspace='?d?d?d', charset=None, custom_charsets=None,
+                     markov=None, inclusive=False, length=LENGTH, chains=chains, first=0,
+                     table=table, jobs=2, output=str(tmp_path))
+    rainbow_chains.main(args)
+    return chains_path(str(tmp_path), 'md5', table)
+
+
+def on_chains(chains, count):
+    ''' Every preimage of the first `count` chains, in the order they're walked '''
+    preimages = []
+    for start in range(count):
+        rank = start
+        for step in range(chains.length):
+            preimage = chains.unrank(rank)
+            preimages.append(preimage)
+            rank = chains.reduce(hashlib.md5(preimage).digest(), step)
+    return preimages
+
+
+def test_lookup_recovers_preimages_on_chains(tmp_path):
+    fpath = generate(tmp_path, 30)
+    tables = chain_lookup.open_tables([fpath])
+    try:
+        reader, chains = tables[0]
+        assert len(reader) == 30
+        # Each chain ends where walking its start rank ends
+        assert sorted(reader) == sorted((chains.encode(chains.walk(rank)), rank) for rank in range(30))
+        preimages = on_chains(chains, 30)
+        for preimage in preimages[::7] + preimages[LENGTH - 1::LENGTH]:
+            assert chain_lookup.find(tables, hashlib.md5(preimage).digest()) == preimage
+        # A hash from outside the keyspace is never found
+        assert chain_lookup.find(tables, hashlib.md5(b'abcd').digest()) is None
+        missing = [b'%03d' % rank for rank in range(1000) if b'%03d' % rank not in set(preimages)]
+        assert chain_lookup.find(tables, hashlib.md5(missing[0]).digest()) is None
+    finally:
+        for reader, _ in tables:
+            reader.close()
+
+
+def test_tables_reduce_differently():
+    keyspace = MaskKeyspace('?d?d?d')
+    first = Chains(Chains.header_for('md5', keyspace, LENGTH, 0))
+    second = Chains(Chains.header_for('md5', keyspace, LENGTH, 1))
+    digest = hashlib.md5(b'123').digest()
+    assert first.reduce(digest, 3) != second.reduce(digest, 3)
+    assert first.reduce(digest, 3) != first.reduce(digest, 4)
+    assert 0 <= first.reduce(digest, 3) < keyspace.count
+
+
+def test_parse_hashes():
+    digest = hashlib.md5(b'123').hexdigest()
+    assert chain_lookup.parse_hashes([digest + '\n', 'zz', digest[:-2]], 16) == \
+        {digest: bytes.fromhex(digest)}
@@ -0,0 +1,62 @@
+import io
+import json
+import threading
+
+import pytest
+
+import rainbow_hash
+
+from algorithms import algorithms, digest_valid
+
+# Oracle 10g hashes the first 64 bytes, which cuts the "é" in two
+SPLIT = ('a' * 63 + 'é').encode()
+
+needs_oracle = pytest.mark.skipif('oracle10g_sys' not in algorithms, reason='needs passlib')
+
+
+def select(keys):
+    return {key: algorithms[key] for key in keys}
+
+
+@needs_oracle
+def test_digest_valid_skips_failing_candidates():
+    hash_algorithms = select(['md5', 'oracle10g_sys'])
+    kept, digests = digest_valid(hash_algorithms, [b'good', SPLIT, b'also'])
+    assert kept == [0, 2]
+    assert bytes(digests['md5']) == algorithms['md5']._hash(b'good') + algorithms['md5']._hash(b'also')
+
+
+@needs_oracle
+def test_compute_entry_skips_words_that_fail():
+    hash_algorithms = select(['md5', 'oracle10g_sys'])
+    fword = io.BytesIO(b'good\n' + SPLIT + b'\nalso\n')
+    fout = io.BytesIO()
+    rainbow_hash.compute_entry(fword, fout, hash_algorithms, threading.Lock())
+    lines = fout.getvalue().decode().splitlines()
+    assert [json.loads(line)['preimage'] for line in lines] == ['good', 'also']
+
+
+@pytest.mark.parametrize('data, lines', [
+    (b'', 0),
+    (b'one\ntwo\n', 2),
+    (b'one\ntwo', 2),
+    (b'one', 1),
+    (b'\n', 1),
+])
+def test_count_candidates_counts_an_unterminated_last_line(tmp_path, data, lines):
+    fpath = tmp_path / 'words.txt'
+    fpath.write_bytes(data)
+    assert rainbow_hash.count_candidates(str(fpath)) == lines
+    assert rainbow_hash.count_candidates(str(fpath), rules=[None, None]) == lines * 2
+
+
+def test_digest_valid_skips_invalid_utf8_for_ntlm():
+    ntlm = algorithms['ntlm']
+    # Cutting at 127 bytes splits the last "é", which is dropped, but a word
+    # with invalid bytes fails instead of hashing as if they weren't there
+    long_word = 'é'.encode() * 64
+    kept, digests = digest_valid(select(['ntlm']), [b'good', b'go\xffod', long_word])
+    assert kept == [0, 2]
+    assert bytes(digests['ntlm']) == ntlm._hash(b'good') + ntlm._hash('é'.encode() * 63)
+    with pytest.raises(UnicodeDecodeError):
+        ntlm._hash(b'go\xffod')
@@ -0,0 +1,78 @@
+import pytest
+
+from rules import Rule, RuleError, load_rules, mutate
+
+WORD = b'p@ssW0rd'
+
+
+# The examples from hashcat's rule based attack documentation
+@pytest.mark.parametrize('rule, expected', [
+    (':', b'p@ssW0rd'),
+    ('l', b'p@ssw0rd'),
+    ('u', b'P@SSW0RD'),
+    ('c', b'P@ssw0rd'),
+    ('C', b'p@SSW0RD'),
+    ('t', b'P@SSw0RD'),
+    ('T3', b'p@sSW0rd'),
+    ('r', b'dr0Wss@p'),
+    ('d', b'p@ssW0rdp@ssW0rd'),
+    ('p2', b'p@ssW0rdp@ssW0rdp@ssW0rd'),
+    ('f', b'p@ssW0rddr0Wss@p'),
+    ('{', b'@ssW0rdp'),
+    ('}', b'dp@ssW0r'),
+    ('$1', b'p@ssW0rd1'),
+    ('^1', b'1p@ssW0rd'),
+    ('[', b'@ssW0rd'),
+    (']', b'p@ssW0r'),
+    ('D3', b'p@sW0rd'),
+    ("'6", b'p@ssW0'),
+    ('i4!', b'p@ss!W0rd'),
+    ('o3$', b'p@s$W0rd'),
+    ('ss$', b'p@$$W0rd'),
+    ('@s', b'p@W0rd'),
+    ('z2', b'ppp@ssW0rd'),
+    ('Z2', b'p@ssW0rddd'),
+    ('c $1 $2', b'P@ssw0rd12'),
+    ('sa@ so0 se3', b'p@ssW0rd'),
+])
+def test_documented_examples(rule, expected):
+    assert Rule(rule)(WORD) == expected
+
+
+@pytest.mark.parametrize('rule', ['T8', 'D8', 'o8x', 'i9x', "'9"])
+def test_positions_past_the_end_reject(rule):
+    assert Rule(rule)(WORD) is None
+
+
+def test_positions_at_the_end():
+    assert Rule('i8!')(WORD) == b'p@ssW0rd!'
+    assert Rule("'8")(WORD) == WORD
+
+
+@pytest.mark.parametrize('rule, accepted', [
+    ('<9', True), ('<8', False),
+    ('>7', True), ('>8', False),
+    ('_8', True), ('_7', False),
+    ('!x', True), ('!@', False),
+    ('/@', True), ('/x', False),
+    ('(p', True), ('(d', False),
+    (')d', True), (')p', False),
+    ('=1@', True), ('=1s', False), ('=9d', False),
+    ('%2s', True), ('%3s', False),
+])
+def test_reject_rules(rule, accepted):
+    assert Rule(rule)(WORD) == (WORD if accepted else None)
+
+
+@pytest.mark.parametrize('rule', ['X', '$', 'i4', 'T!'])
+def test_invalid_rules(rule):
+    with pytest.raises(RuleError):
+        Rule(rule)
+
+
+def test_load_rules_and_mutate(tmp_path):
+    fpath = tmp_path / 'best.rule'
+    fpath.write_text('# comment\n\n:\nu\n>8 $!\n$1\n')
+    rules = load_rules(str(fpath))
+    assert [str(rule) for rule in rules] == [':', 'u', '>8 $!', '$1']
+    assert list(mutate(WORD, rules)) == [WORD, b'P@SSW0RD', b'p@ssW0rd1']
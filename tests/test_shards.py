@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import multigen
+
+from algorithms import algorithms, digest_all
+from shards import ShardedWriter, shard_name, shard_of
+from table_format import TableHeader, TableReader
+
+SELECTED = {key: algorithms[key] for key in ('md5', 'sha1')}
+WORDS = [b'word%d' % index for index in range(2000)]
+
+
+def test_shard_of():
+    assert shard_of(b'\xab\xcd', 0) == 0
+    assert shard_of(b'\xab\xcd', 4) == 0xa
+    assert shard_of(b'\xab\xcd', 8) == 0xab
+    assert shard_of(b'\xab\xcd', 12) == 0xabc
+    assert shard_of(b'\xab', 12) == 0xab0
+    assert shard_name(0xa, 4) == 'shard_a'
+    assert shard_name(0xab, 12) == 'shard_0ab'
+
+
+@pytest.mark.parametrize('bits', [0, 3, 8, 12])
+def test_records_land_in_the_shard_of_their_prefix(tmp_path, bits):
+    header = TableHeader.for_algorithms(SELECTED, 6, 8)
+    writer = multigen.open_sharded(str(tmp_path), 'table', multigen.BINARY, header, bits, 'sha1')
+    # Small batches, so the shards are buffered across several of them
+    for offset in range(0, len(WORDS), 300):
+        batch = WORDS[offset:offset + 300]
+        writer.write_batch(batch, digest_all(SELECTED, batch, 6))
+    writer.close()
+    found = []
+    for name in os.listdir(str(tmp_path)):
+        reader = TableReader.open(os.path.join(str(tmp_path), name, 'table.bin'))
+        for preimage, digests in reader:
+            assert shard_name(shard_of(digests['sha1'], bits), bits) == name
+            assert digests['sha1'] == SELECTED['sha1']._hash(preimage)[:6]
+            found.append(preimage)
+        reader.close()
+    assert sorted(found) == sorted(WORDS)
+    digests = digest_all(SELECTED, WORDS, 6)['sha1']
+    assert sorted(os.listdir(str(tmp_path))) == sorted(set(
+        shard_name(shard_of(digests[offset:offset + 6], bits), bits)
+        for offset in range(0, len(digests), 6)))
+
+
+def test_shard_bits_are_checked():
+    with pytest.raises(ValueError):
+        ShardedWriter(None, 'md5', {'md5': 1}, 9)
+    with pytest.raises(ValueError):
+        ShardedWriter(None, 'sha1', {'md5': 6}, 4)
@@ -0,0 +1,130 @@
+import io
+
+import pytest
+
+from algorithms import algorithms, digest_all
+from generate_seeded_keyspace import KeyspaceGenerator, MaskKeyspace
+from table_format import TableHeader, TableWriter, TableReader, TableFormatError, INLINE, RANK, IMPLICIT
+
+SELECTED = {key: algorithms[key] for key in ('md5', 'sha1')}
+WORDS = [b'', b'a', b'pass', b'word', b'\xc3\xa9t\xc3\xa9', b'x' * 12] * 5
+
+
+def header_for(preimage, **kwargs):
+    return TableHeader.for_algorithms(SELECTED, 6, 12, preimage=preimage, **kwargs)
+
+
+def write_table(fpath, header, batches):
+    writer = TableWriter(open(fpath, 'wb'), header)
+    for start, preimages in batches:
+        writer.write_batch(preimages, digest_all(SELECTED, preimages, 6), start)
+    writer.close()
+    return TableReader.open(fpath)
+
+
+def records(words):
+    digests = digest_all(SELECTED, words, 6)
+    return [(word, {key: bytes(digests[key][index * 6:(index + 1) * 6]) for key in SELECTED})
+            for index, word in enumerate(words)]
+
+
+def test_inline_pack_unpack_round_trip():
+    header = header_for(INLINE)
+    digests = digest_all(SELECTED, WORDS, 6)
+    data = header.pack(WORDS, digests)
+    assert len(data) == len(WORDS) * header.record_width == len(WORDS) * (13 + 12)
+    preimages, unpacked = header.unpack(data)
+    assert preimages == WORDS
+    assert {key: bytes(value) for key, value in unpacked.items()} == \
+        {key: bytes(value) for key, value in digests.items()}
+    with pytest.raises(ValueError):
+        header.pack([b'x' * 13], digest_all(SELECTED, [b'x' * 13], 6))
+    with pytest.raises(TableFormatError):
+        header.unpack(data[:-1])
+
+
+def test_header_round_trip():
+    header = header_for(INLINE, charset='abc')
+    again = TableHeader.read(io.BytesIO(header.to_bytes() + b'records'))
+    assert again.to_dict() == header.to_dict()
+    with pytest.raises(TableFormatError):
+        TableHeader.read(io.BytesIO(b'BRT0' + header.to_bytes()[4:]))
+
+
+def test_reader_batches(tmp_path):
+    reader = write_table(str(tmp_path / 'table.bin'), header_for(INLINE),
+                         [(None, WORDS[:7]), (None, WORDS[7:])])
+    assert len(reader) == len(WORDS)
+    batches = list(reader.batches(4))
+    assert [len(preimages) for preimages, _ in batches] == [4] * 7 + [2]
+    assert [word for preimages, _ in batches for word in preimages] == WORDS
+    reader.close()
+    reader = TableReader.open(str(tmp_path / 'table.bin'))
+    assert list(reader) == records(WORDS)
+    reader.close()
+
+
+MASK = MaskKeyspace('?1?d', ['abc'])
+RANKED = [MASK.unrank(rank).encode() for rank in range(MASK.count)]
+
+
+@pytest.mark.parametrize('preimage', [INLINE, RANK, IMPLICIT])
+def test_pack_unpack_round_trip(preimage):
+    header = header_for(preimage, keyspace=MASK, start=5)
+    words = RANKED[5:25]
+    digests = digest_all(SELECTED, words, 6)
+    data = header.pack(words, digests, 5)
+    assert len(data) == len(words) * header.record_width
+    keys, unpacked = header.unpack(data)
+    if preimage == INLINE:
+        assert keys == words
+    else:
+        assert keys == list(range(5, 25))
+    assert [header.preimage_of(key) for key in keys] == words
+    assert bytes(unpacked['sha1']) == bytes(digests['sha1'])
+    # Implicit ranks follow the position of the batch in the table
+    assert header.unpack(data[header.record_width:], 1)[0][:1] == \
+        ([6] if preimage != INLINE else [words[1]])
+
+
+def test_rank_preimages_need_a_start():
+    header = header_for(RANK, keyspace=MASK)
+    with pytest.raises(ValueError):
+        header.pack(RANKED[:2], digest_all(SELECTED, RANKED[:2], 6))
+    # Ranks can also be given one per preimage, e.g. after rules drop some
+    words = [RANKED[3], RANKED[9]]
+    keys, _ = header.unpack(header.pack(words, digest_all(SELECTED, words, 6), [3, 9]))
+    assert keys == [3, 9]
+
+
+def test_rank_preimages_from_a_charset():
+    header = TableHeader.for_algorithms(SELECTED, 6, 3, charset='abc', preimage=RANK)
+    assert [header.preimage_of(rank) for rank in range(6)] == \
+        [KeyspaceGenerator.to_base_n(rank, 'abc').encode() for rank in range(6)]
+
+
+@pytest.mark.parametrize('preimage', [INLINE, RANK, IMPLICIT])
+def test_reader_batches_start_stop(tmp_path, preimage):
+    header = header_for(preimage, keyspace=MASK, start=2)
+    words = RANKED[2:]
+    reader = write_table(str(tmp_path / 'table.bin'), header, [(2, words[:7]), (9, words[7:])])
+    assert len(reader) == len(words)
+    assert list(reader) == records(words)
+    # Every pass seeks to `start`, even after the reader was read to the end
+    for start, stop in ((0, None), (3, 17), (4, 5), (25, 100), (28, None), (0, 4)):
+        expected = words[start:stop]
+        batches = list(reader.batches(4, start, stop))
+        assert all(len(keys) <= 4 for keys, _ in batches)
+        keys = [key for batch, _ in batches for key in batch]
+        assert [header.preimage_of(key) for key in keys] == expected
+        md5 = b''.join(bytes(digests['md5']) for _, digests in batches)
+        assert md5 == bytes(digest_all(SELECTED, expected, 6)['md5'])
+    reader.close()
+
+
+def test_implicit_tables_are_written_in_order(tmp_path):
+    writer = TableWriter(open(str(tmp_path / 'table.bin'), 'wb'), header_for(IMPLICIT, keyspace=MASK))
+    writer.write_batch(RANKED[:3], digest_all(SELECTED, RANKED[:3], 6), 0)
+    with pytest.raises(ValueError):
+        writer.write_batch(RANKED[4:6], digest_all(SELECTED, RANKED[4:6], 6), 4)
+    writer.close()
@@ -0,0 +1,69 @@
+import json
+
+from base64 import b64decode, b64encode
+
+import multigen
+import build_index
+import rainbow_hash
+
+from algorithms import algorithms, digest_width
+from index_lookup import IndexLookup
+
+WORDS = [b'abc', b'def', b'ghi']
+TRUNCATE = 10  # Longer than mysql323's 8 byte digests, shorter than md5's 16
+
+
+def select(keys):
+    return {key: algorithms[key] for key in keys}
+
+
+def check_lines(lines, hash_algorithms, truncate):
+    assert [json.loads(line)['preimage'] for line in lines] == [word.decode() for word in WORDS]
+    for line, word in zip(lines, WORDS):
+        entry = json.loads(line)
+        for name, algo in hash_algorithms.items():
+            assert b64decode(entry[name]) == algo._hash(word)[:digest_width(algo, truncate)]
+
+
+def test_digest_width():
+    hash_algorithms = select(['md5', 'mysql323'])
+    assert digest_width(hash_algorithms['md5'], TRUNCATE) == TRUNCATE
+    assert digest_width(hash_algorithms['mysql323'], TRUNCATE) == 8
+    assert digest_width(hash_algorithms['md5']) == 16
+
+
+def test_multigen_mixed_widths():
+    hash_algorithms = select(['md5', 'mysql323'])
+    lines = multigen.compute_batch(WORDS, hash_algorithms, TRUNCATE).splitlines()
+    check_lines(lines, hash_algorithms, TRUNCATE)
+
+
+def test_rainbow_hash_mixed_widths():
+    hash_algorithms = select(['md5', 'mysql323'])
+    preimages = [word.decode() for word in WORDS]
+    data = rainbow_hash.compute_batch(WORDS, preimages, hash_algorithms, truncate=TRUNCATE)
+    check_lines(data.decode().splitlines(), hash_algorithms, TRUNCATE)
+
+
+def test_truncated_table_round_trips_through_lookup(tmp_path):
+    hash_algorithms = select(['md5', 'mysql323'])
+    table = str(tmp_path / 'table.json')
+    with open(table, 'w') as fp:
+        fp.write(multigen.compute_batch(WORDS, hash_algorithms, TRUNCATE))
+    tables = {table: build_index.describe(table)}
+    templates = build_index.index_templates(tables, [], build_index.INLINE)
+    output = tmp_path / 'indexes'
+    output.mkdir()
+    task = (table, build_index.JSON, 0, len(open(table, 'rb').read()), templates, build_index.INLINE,
+            str(tmp_path), 1024)
+    runs, _ = build_index.generate_runs(task)
+    for algorithm, run_path in runs:
+        build_index.merge_algorithm((algorithm, [run_path], str(output), str(tmp_path), 2, 0))
+    lookup = IndexLookup([str(output)])
+    try:
+        for name, algo in hash_algorithms.items():
+            hashes = [b64encode(algo._hash(word)).decode() for word in WORDS]
+            answers = lookup.answers(name, hashes)
+            assert [[preimage for preimage, _ in answers[value]] for value in hashes] == [[word] for word in WORDS]
+    finally:
+        lookup.close()
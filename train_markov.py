@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+'''
+Trains a per position markov model from a wordlist for `multigen.py -M`
+
+-----------------------------------------------------------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+-----------------------------------------------------------------------
+'''
+
+import sys
+import argparse
+
+from os import path
+
+from generate_seeded_keyspace import KeyspaceGenerator, MarkovKeyspace
+
+
+def read_words(fword):
+    ''' Yield each decodable line of the wordlist '''
+    for line in fword:
+        try:
+            yield line.rstrip(b'\r\n').decode()
+        except UnicodeDecodeError:
+            pass
+
+
+def main(args):
+    charset = KeyspaceGenerator.DEFAULT_CHARSET if args.charset is None else args.charset
+    with open(args.wordlist, 'rb') as fword:
+        model = MarkovKeyspace.train(read_words(fword), charset)
+    MarkovKeyspace.save(model, args.output)
+    print('Saved markov model to %s' % args.output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Train a markov model for probability ordered keyspaces')
+    parser.add_argument('-w',
+        dest='wordlist',
+        help='train from passwords in text file',
+        required=True)
+    parser.add_argument('-c',
+        type=str,
+        dest='charset',
+        help='charset of the model',
+        default=None)
+    parser.add_argument('-o',
+        dest='output',
+        default='markov.json',
+        help='output file to write the model to')
+    args = parser.parse_args()
+    if path.exists(args.wordlist) and path.isfile(args.wordlist):
+        main(args)
+    else:
+        sys.stderr.write('Wordlist does not exist, or is not file')